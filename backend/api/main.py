@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -5,12 +6,24 @@ from dotenv import load_dotenv
 import os
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务生命周期：启动时预加载并预热进程内共享的 Reranker，并启动后台入库工作进程池"""
+    from backend.kb.rerank import init_default_reranker
+    from backend.services import kb_service
+    init_default_reranker()
+    if int(os.getenv("KB_INGEST_WORKERS", "2")) > 0:
+        kb_service.start_ingest_workers()
+    yield
+    kb_service.stop_ingest_workers()
+
+
 def create_app() -> FastAPI:
     """创建 FastAPI 应用并挂载路由与中间件"""
     os.environ.setdefault("OTEL_PYTHON_DISABLED", "true")
     os.environ.setdefault("LANGCHAIN_TRACING_V2", "false")
     load_dotenv()
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -22,8 +35,10 @@ def create_app() -> FastAPI:
     # 路由注册
     from backend.api.routers.chat import router as chat_router
     from backend.api.routers.kb import router as kb_router
+    from backend.api.routers.metrics import router as metrics_router
     app.include_router(chat_router)
     app.include_router(kb_router)
+    app.include_router(metrics_router)
 
     # 静态资源挂载：暴露 data/kb 目录用于图片访问
     # 访问示例：/assets/{kbId}/assets/images/{fileId}/{imageName}
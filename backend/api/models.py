@@ -43,11 +43,36 @@ class KBFile(BaseModel):
     createdAt: int
     chunkCount: int
     status: str
+    ingest: Optional[Dict[str, int]] = None
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    sheets: Optional[List[Dict[str, Any]]] = None
 
 
 class KBFileCreate(BaseModel):
-    """上传文件的请求体（可携带 Base64 内容）"""
+    """上传文件的请求体（可携带 Base64 内容；或以 `sha256` 引用已上传过的相同内容，无需再次传输）"""
     name: str
     type: Optional[str] = "application/octet-stream"
     contentBase64: Optional[str] = None
+    sha256: Optional[str] = None
 
+
+class IngestJobCreate(BaseModel):
+    """提交后台入库任务的请求体；`incremental` 为真时只嵌入新增或改动的片段"""
+    filename: str
+    incremental: bool = False
+
+
+class IngestJob(BaseModel):
+    """后台入库任务状态，`progress` 为各阶段（extract/split/embed/index）的完成数与总数"""
+    id: str
+    kbId: str
+    filename: str
+    status: str
+    stage: Optional[str] = None
+    progress: Dict[str, Dict[str, int]] = {}
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+    createdAt: int
+    startedAt: Optional[int] = None
+    finishedAt: Optional[int] = None
@@ -1,7 +1,8 @@
 from typing import List, Dict, Any
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
-from backend.api.models import KnowledgeBase, KnowledgeBaseCreate, KnowledgeBaseUpdate, KBFile, KBFileCreate
+from backend.api.models import KnowledgeBase, KnowledgeBaseCreate, KnowledgeBaseUpdate, KBFile, KBFileCreate, IngestJob, IngestJobCreate
 from backend.services import kb_service
 
 
@@ -43,16 +44,81 @@ def list_files(kb_id: str):
     return [KBFile(**f) for f in files]
 
 
-@router.post("/api/kb/{kb_id}/files", response_model=KBFile)
-def upload_file(kb_id: str, payload: KBFileCreate):
-    """上传文件（可选Base64），入库为未向量化"""
-    name = (payload.name or "").strip()
+def _check_upload_name(name: str) -> str:
+    name = (name or "").strip()
     if not name:
         raise HTTPException(status_code=400, detail="文件名不能为空")
-    lower = name.lower()
-    if not (lower.endswith(".pdf") or lower.endswith(".xlsx")):
-        raise HTTPException(status_code=400, detail="仅支持上传 PDF 或 Excel(xlsx) 文件")
-    info = kb_service.save_upload(kb_id, name, payload.contentBase64)
+    if not kb_service.is_supported_upload(name):
+        raise HTTPException(status_code=400, detail="仅支持上传 PDF、Excel(xlsx) 或 CHM 文件")
+    return name
+
+
+@router.post("/api/kb/{kb_id}/files", response_model=KBFile)
+def upload_file(kb_id: str, payload: KBFileCreate):
+    """上传文件（可选Base64，或按 sha256 引用已有内容），入库为未向量化"""
+    name = _check_upload_name(payload.name)
+    try:
+        if payload.sha256 and not payload.contentBase64:
+            info = kb_service.save_upload_from_blob(kb_id, name, payload.sha256)
+        else:
+            info = kb_service.save_upload(kb_id, name, payload.contentBase64)
+    except kb_service.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return KBFile(**info)
+
+
+@router.post("/api/kb/{kb_id}/files/upload", response_model=KBFile)
+def upload_file_multipart(kb_id: str, file: UploadFile = File(...)):
+    """以 multipart/form-data 上传单个文件：分块写盘并计算 sha256，超过 `KB_UPLOAD_MAX_MB` 返回 413"""
+    name = _check_upload_name(file.filename or "")
+    try:
+        info = kb_service.save_upload_stream(kb_id, name, file.file)
+    except kb_service.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return KBFile(**info)
+
+
+@router.post("/api/kb/{kb_id}/files/upload/batch", response_model=List[KBFile])
+def upload_files_multipart(kb_id: str, files: List[UploadFile] = File(...)):
+    """以 multipart/form-data 一次上传多个文件；先校验全部文件名，任一文件超限时返回 413（此前的文件已保存）"""
+    names = [_check_upload_name(f.filename or "") for f in files]
+    out: List[KBFile] = []
+    for name, f in zip(names, files):
+        try:
+            out.append(KBFile(**kb_service.save_upload_stream(kb_id, name, f.file)))
+        except kb_service.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    return out
+
+
+@router.put("/api/kb/{kb_id}/files/{name}/content", response_model=KBFile)
+async def upload_file_stream(kb_id: str, name: str, request: Request):
+    """以原始请求体（application/octet-stream）流式上传文件，不经过 multipart 临时文件，边接收边写盘
+
+    - 接收到的数据攒满 `UPLOAD_CHUNK_BYTES` 后交给线程池写盘与计算 sha256，不阻塞事件循环
+    """
+    name = _check_upload_name(name)
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > kb_service.upload_max_bytes():
+        raise HTTPException(status_code=413, detail=f"文件超过大小上限：{name}")
+    writer = await run_in_threadpool(kb_service.UploadWriter, kb_id, name)
+    buf = bytearray()
+    try:
+        async for data in request.stream():
+            buf += data
+            if len(buf) >= kb_service.UPLOAD_CHUNK_BYTES:
+                await run_in_threadpool(writer.write, bytes(buf))
+                buf.clear()
+        if buf:
+            await run_in_threadpool(writer.write, bytes(buf))
+        info = await run_in_threadpool(writer.commit)
+    except kb_service.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        writer.abort()
+        raise
     return KBFile(**info)
 
 
@@ -67,12 +133,13 @@ def read_file_chunks(kb_id: str, file_id: str):
 
 @router.post("/api/kb/{kb_id}/ingest", response_model=KBFile)
 def ingest_uploaded_file(kb_id: str, payload: Dict[str, Any]):
-    """向量化处理已上传文件（PDF/Excel）"""
+    """向量化处理已上传文件（PDF/Excel/CHM）；`incremental` 为真时只嵌入新增或改动的片段"""
     name = (str(payload.get("filename", "")).strip())
     if not name:
         raise HTTPException(status_code=400, detail="filename 不能为空")
+    incremental = payload.get("incremental")
     try:
-        info = kb_service.ingest_uploaded_file(kb_id, name)
+        info = kb_service.ingest_uploaded_file(kb_id, name, incremental=None if incremental is None else bool(incremental))
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except ValueError as e:
@@ -82,6 +149,45 @@ def ingest_uploaded_file(kb_id: str, payload: Dict[str, Any]):
     return KBFile(**info)
 
 
+@router.post("/api/kb/{kb_id}/ingest/jobs", response_model=IngestJob, status_code=202)
+def submit_ingest_job(kb_id: str, payload: IngestJobCreate):
+    """提交后台入库任务，立即返回任务ID；进度通过任务查询接口获取"""
+    name = (payload.filename or "").strip()
+    if not name:
+        raise HTTPException(status_code=400, detail="filename 不能为空")
+    try:
+        job = kb_service.submit_ingest_job(kb_id, name, incremental=payload.incremental)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return IngestJob(**job)
+
+
+@router.get("/api/kb/{kb_id}/ingest/jobs", response_model=List[IngestJob])
+def list_ingest_jobs(kb_id: str):
+    """列出知识库最近的入库任务"""
+    return [IngestJob(**j) for j in kb_service.list_ingest_jobs(kb_id)]
+
+
+@router.get("/api/ingest/jobs/{job_id}", response_model=IngestJob)
+def get_ingest_job(job_id: str):
+    """查询入库任务状态与分阶段进度"""
+    try:
+        return IngestJob(**kb_service.get_ingest_job(job_id))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.post("/api/ingest/jobs/{job_id}/cancel", response_model=IngestJob)
+def cancel_ingest_job(job_id: str):
+    """取消入库任务（排队中立即取消，运行中在下一个进度点停止）"""
+    try:
+        return IngestJob(**kb_service.cancel_ingest_job(job_id))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
 @router.delete("/api/files/{file_id}")
 def delete_file(file_id: str):
     """删除文件（在所有知识库中查找并删除）"""
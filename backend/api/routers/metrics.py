@@ -0,0 +1,17 @@
+from typing import Any, Dict
+from fastapi import APIRouter
+
+from backend.kb.rerank import get_rerank_metrics
+from backend.kb.chunk_blocks import BLOCK_CACHE
+
+
+router = APIRouter()
+
+
+@router.get("/api/metrics")
+def get_metrics() -> Dict[str, Any]:
+    """返回检索链路的运行指标（重排模型加载耗时与推理延迟、片段解压块缓存等）"""
+    return {
+        "reranker": get_rerank_metrics(),
+        "chunk_block_cache": BLOCK_CACHE.stats(),
+    }
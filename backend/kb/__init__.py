@@ -5,10 +5,13 @@ from .knowledge_base import (
 )
 from .ingestion import (
     read_pdf_markdown_with_images,
+    render_pdf_images,
     read_chm_text,
     read_excel_text,
     ingest_pdf,
     ingest_excel,
+    ingest_chm,
+    ingest_file,
 )
 
 
@@ -17,9 +20,12 @@ __all__ = [
     "FileChunk",
     "PersistentKnowledgeBaseController",
     "read_pdf_markdown_with_images",
+    "render_pdf_images",
     "read_chm_text",
     "read_excel_text",
     "ingest_pdf",
     "ingest_excel",
+    "ingest_chm",
+    "ingest_file",
 ]
 
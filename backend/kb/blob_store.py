@@ -0,0 +1,116 @@
+from typing import List, Optional, Tuple
+from contextlib import contextmanager
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+
+
+def file_sha256(path: str, chunk_bytes: int = 1 << 20) -> str:
+    """分块计算文件的 sha256"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(chunk_bytes), b""):
+            h.update(data)
+    return h.hexdigest()
+
+
+def link_or_copy(src: str, dest: str) -> None:
+    """以硬链接（跨文件系统时退化为复制）把 `src` 原子地放到 `dest`"""
+    tmp = f"{dest}.{os.getpid()}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+class BlobStore:
+    """按 sha256 内容寻址的上传文件存储，相同内容跨知识库只保存一份
+
+    - 路径：`{root}/{sha[:2]}/{sha}`；各知识库 `uploads/` 下的文件是指向 blob 的硬链接
+    - blob 只会整体替换，不会原地修改；跨文件系统时上传文件是 blob 的副本，因此不能以链接数判断 blob 是否仍被引用，
+      存储不自动清理 blob
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def has(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def put_file(self, tmp_path: str, sha256: str) -> str:
+        """把已写好的临时文件收入存储（内容已存在时直接丢弃临时文件），返回 blob 路径"""
+        dest = self.path(sha256)
+        if os.path.exists(dest):
+            os.remove(tmp_path)
+            return dest
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(tmp_path, dest)
+        return dest
+
+    def link(self, sha256: str, dest: str) -> None:
+        """把 blob 放到 `dest`（通常是某个知识库的 `uploads/{文件名}`）"""
+        link_or_copy(self.path(sha256), dest)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS derived (
+    kb_id INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kb_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS idx_derived_key ON derived(key, created_at);
+"""
+
+
+class DerivedIndex:
+    """派生产物登记表：入库键（blob sha256 + 拆分配置 + 嵌入配置）→ 已按该键完成入库的 (kb_id, file_id)
+
+    - 同键的文件片段与向量完全相同，新入库时可直接复制其索引，跳过解析、拆分与嵌入
+    - 登记可能过期（文件被删除或重新入库），使用方需校验文件记录中的 `ingest_key` 后再复用
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def record(self, key: str, kb_id: int, file_id: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO derived(kb_id, file_id, key, created_at) VALUES (?, ?, ?, ?)",
+                (int(kb_id), int(file_id), str(key), time.time()),
+            )
+
+    def candidates(self, key: str) -> List[Tuple[int, int]]:
+        """按登记时间倒序返回同键的 (kb_id, file_id)"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT kb_id, file_id FROM derived WHERE key = ? ORDER BY created_at DESC", (str(key),)
+            ).fetchall()
+        return [(int(k), int(f)) for k, f in rows]
+
+    def forget(self, kb_id: int, file_id: Optional[int] = None) -> None:
+        with self._connect() as conn:
+            if file_id is None:
+                conn.execute("DELETE FROM derived WHERE kb_id = ?", (int(kb_id),))
+            else:
+                conn.execute("DELETE FROM derived WHERE kb_id = ? AND file_id = ?", (int(kb_id), int(file_id)))
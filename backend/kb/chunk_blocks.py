@@ -0,0 +1,299 @@
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+from collections import OrderedDict
+import json
+import lzma
+import os
+import threading
+import uuid
+import zlib
+import numpy as np
+
+
+CODECS = {"zlib": 1, "lzma": 2}
+
+
+class BlockCache:
+    """进程内共享的解压块 LRU：键为 (数据文件路径, 文件版本, 块偏移)，按解压后字节数限制容量
+
+    - 容量由 `KB_CHUNK_BLOCK_CACHE_MB` 控制（默认 64MB），为 0 时关闭
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("KB_CHUNK_BLOCK_CACHE_MB", "64")) * (1 << 20))
+        self.max_bytes = int(max_bytes)
+        self._data: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        if self.max_bytes <= 0:
+            return None
+        with self._lock:
+            v = self._data.get(key)
+            if v is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return v
+
+    def put(self, key: tuple, value: bytes) -> None:
+        if self.max_bytes <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, v = self._data.popitem(last=False)
+                self._size -= len(v)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"blocks": len(self._data), "bytes": self._size, "hits": self.hits, "misses": self.misses}
+
+
+BLOCK_CACHE = BlockCache()
+
+
+def _build_dictionary(lines: List[bytes], max_bytes: int) -> bytes:
+    """从均匀间隔抽样的记录中截取预置字典（表格管道符、重复表头等高频片段）"""
+    if max_bytes <= 0 or not lines:
+        return b""
+    per_line = max(256, max_bytes // max(1, min(len(lines), 64)))
+    step = max(1, len(lines) // max(1, max_bytes // per_line))
+    parts: List[bytes] = []
+    total = 0
+    for line in lines[::step]:
+        piece = line[:per_line]
+        parts.append(piece)
+        total += len(piece)
+        if total >= max_bytes:
+            break
+    # zlib 对字典末尾的内容匹配代价最低，保持抽样顺序即可
+    return b"".join(parts)[-max_bytes:]
+
+
+def _compress(codec: int, raw: bytes, zdict: bytes) -> bytes:
+    if codec == CODECS["zlib"]:
+        c = zlib.compressobj(level=6, wbits=-15, zdict=zdict) if zdict else zlib.compressobj(level=6, wbits=-15)
+        return c.compress(raw) + c.flush()
+    return lzma.compress(raw, format=lzma.FORMAT_XZ, preset=6)
+
+
+def _decompress(codec: int, data: bytes, zdict: bytes) -> bytes:
+    if codec == CODECS["zlib"]:
+        d = zlib.decompressobj(wbits=-15, zdict=zdict) if zdict else zlib.decompressobj(wbits=-15)
+        return d.decompress(data) + d.flush()
+    if codec == CODECS["lzma"]:
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    raise ValueError(f"未知的片段压缩编码：{codec}")
+
+
+def tmp_path_for(path: str) -> str:
+    """`path` 的写入临时文件名：带进程号与随机后缀，同一文件的并发写入方不会互相覆盖"""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+class BlockWriter:
+    """按块压缩逐条写入片段记录，供流式入库使用
+
+    - 数据文件：`[预置字典][块0][块1]...`，每块为若干条 JSONL 记录独立压缩，可单独解压
+    - 索引文件（`.npy`）：首行 `(条数, 数据字节数, 编码, 字典字节数, 块数)`，
+      其后每行 `(chunk_index, 块偏移, 块长度, 块内偏移, 记录长度)`
+    - zlib 使用同一文件内所有块共享的预置字典（`zdict`），由最先写入的 `sample_bytes` 字节记录抽样得到；
+      抽样完成前记录暂存在内存中，之后每凑满一块即压缩落盘
+    - lzma 在标准库中不支持预置字典，各块独立压缩
+    - 写入临时文件（见 `tmp_path_for`），`commit` 时原子替换；`abort` 丢弃临时文件
+    """
+
+    def __init__(
+        self,
+        path: str,
+        index_path: str,
+        codec: str = "zlib",
+        block_bytes: Optional[int] = None,
+        dict_bytes: Optional[int] = None,
+        sample_bytes: Optional[int] = None,
+    ):
+        self.path = path
+        self.index_path = index_path
+        self.codec_id = CODECS[codec]
+        self.block_bytes = int(block_bytes or os.getenv("KB_CHUNK_BLOCK_BYTES", "65536"))
+        self.dict_bytes = int(dict_bytes if dict_bytes is not None else os.getenv("KB_CHUNK_DICT_BYTES", "32768"))
+        if self.codec_id != CODECS["zlib"]:
+            self.dict_bytes = 0
+        # 默认抽样若干块的数据构建字典；None 表示不限（全部记录写入后再建字典）
+        self.sample_bytes = sample_bytes if sample_bytes is not None else max(self.block_bytes, self.dict_bytes) * 4
+        self._tmp = tmp_path_for(path)
+        self._index_tmp = tmp_path_for(index_path)
+        self._f = open(self._tmp, "wb")
+        self._zdict: Optional[bytes] = None
+        self._pending: List[Tuple[int, bytes]] = []
+        self._pending_bytes = 0
+        self._rows: List[List[int]] = []
+        self._offset = 0
+        self._count = 0
+        self.raw_bytes = 0
+        self.n_blocks = 0
+
+    def write(self, records: Iterable[Dict[str, Any]]) -> None:
+        for r in records:
+            line = (json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8")
+            self._pending.append((int(r.get("chunk_index", self._count)), line))
+            self._pending_bytes += len(line)
+            self._count += 1
+        if self._zdict is None:
+            if self.sample_bytes is None or self._pending_bytes < self.sample_bytes:
+                return
+            self._start()
+        self._flush(final=False)
+
+    def _start(self) -> None:
+        self._zdict = _build_dictionary([ln for _, ln in self._pending], self.dict_bytes) if self.dict_bytes else b""
+        self._f.write(self._zdict)
+        self._offset = len(self._zdict)
+
+    def _flush(self, final: bool) -> None:
+        lines = self._pending
+        k = 0
+        while k < len(lines):
+            start = k
+            raw_len = 0
+            while k < len(lines) and (k == start or raw_len + len(lines[k][1]) <= self.block_bytes):
+                raw_len += len(lines[k][1])
+                k += 1
+            if k == len(lines) and not final and raw_len < self.block_bytes:
+                # 未凑满一块的尾部留待后续记录
+                k = start
+                break
+            raw = b"".join(ln for _, ln in lines[start:k])
+            comp = _compress(self.codec_id, raw, self._zdict or b"")
+            inner = 0
+            for ci, ln in lines[start:k]:
+                self._rows.append([ci, self._offset, len(comp), inner, len(ln)])
+                inner += len(ln)
+            self._f.write(comp)
+            self._offset += len(comp)
+            self.raw_bytes += len(raw)
+            self.n_blocks += 1
+        self._pending = lines[k:]
+        self._pending_bytes = sum(len(ln) for _, ln in self._pending)
+
+    def commit(self) -> Dict[str, int]:
+        if self._zdict is None:
+            self._start()
+        self._flush(final=True)
+        self._f.close()
+        index = np.asarray(
+            [[len(self._rows), self._offset, self.codec_id, len(self._zdict or b""), self.n_blocks]] + self._rows,
+            dtype=np.int64,
+        ).reshape(-1, 5)
+        with open(self._index_tmp, "wb") as f:
+            np.save(f, index)
+        os.replace(self._tmp, self.path)
+        os.replace(self._index_tmp, self.index_path)
+        return {"raw_bytes": self.raw_bytes, "stored_bytes": self._offset}
+
+    def abort(self) -> None:
+        try:
+            self._f.close()
+        finally:
+            for p in (self._tmp, self._index_tmp):
+                if os.path.exists(p):
+                    os.remove(p)
+
+
+def write_blocks(
+    path: str,
+    index_path: str,
+    records: Iterable[Dict[str, Any]],
+    codec: str = "zlib",
+    block_bytes: Optional[int] = None,
+    dict_bytes: Optional[int] = None,
+) -> Dict[str, int]:
+    """一次性按块压缩写入片段记录（字典从全部记录中抽样），格式见 `BlockWriter`
+
+    - 返回原始字节数与压缩后字节数，便于观察压缩比
+    """
+    writer = BlockWriter(path, index_path, codec, block_bytes, dict_bytes, sample_bytes=None)
+    try:
+        writer.write(records)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class BlockFile:
+    """压缩块数据文件的只读视图；索引与数据不匹配（写入中或已损坏）时 `valid` 为 False"""
+
+    def __init__(self, path: str, index_path: str):
+        self.path = path
+        st = os.stat(path)
+        # 写入以临时文件 + os.replace 完成，inode 随之改变；与 mtime、大小一起区分文件版本
+        self.version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        self.valid = False
+        self.rows = np.zeros((0, 5), dtype=np.int64)
+        try:
+            index = np.load(index_path)
+        except Exception:
+            return
+        if index.ndim != 2 or index.shape[0] < 1 or index.shape[1] != 5 or int(index[0, 1]) != st.st_size:
+            return
+        self.codec = int(index[0, 2])
+        self.dict_len = int(index[0, 3])
+        self.rows = index[1:]
+        self.valid = True
+        self._zdict: Optional[bytes] = None
+
+    def _dictionary(self, f) -> bytes:
+        if self._zdict is None:
+            f.seek(0)
+            self._zdict = f.read(self.dict_len) if self.dict_len else b""
+        return self._zdict
+
+    def _block(self, f, offset: int, length: int) -> bytes:
+        key = (self.path, self.version, int(offset))
+        raw = BLOCK_CACHE.get(key)
+        if raw is None:
+            zdict = self._dictionary(f)
+            f.seek(offset)
+            raw = _decompress(self.codec, f.read(length), zdict)
+            BLOCK_CACHE.put(key, raw)
+        return raw
+
+    def read(self, indices: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """按 chunk_index 读取记录，只解压命中的块"""
+        want = set(int(i) for i in indices)
+        out: Dict[int, Dict[str, Any]] = {}
+        if not want or not self.valid:
+            return out
+        with open(self.path, "rb") as f:
+            for ci, boff, blen, roff, rlen in self.rows.tolist():
+                if ci not in want:
+                    continue
+                raw = self._block(f, boff, blen)
+                out[ci] = json.loads(raw[roff:roff + rlen].decode("utf-8"))
+        return out
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """按写入顺序逐块解压遍历全部记录"""
+        if not self.valid:
+            return
+        seen: set[int] = set()
+        with open(self.path, "rb") as f:
+            for _, boff, blen, __, ___ in self.rows.tolist():
+                if boff in seen:
+                    continue
+                seen.add(boff)
+                raw = self._block(f, boff, blen)
+                # 只按 b"\n" 切分：正文中未转义的 U+2028 等字符也会被 str.splitlines 当作换行
+                for line in raw.split(b"\n"):
+                    if line.strip():
+                        yield json.loads(line)
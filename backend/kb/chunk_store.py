@@ -0,0 +1,571 @@
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+import json
+import os
+import threading
+import numpy as np
+
+from .chunk_blocks import CODECS, BlockFile, BlockWriter, tmp_path_for, write_blocks
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows 无 flock，仅做进程内互斥
+    fcntl = None
+
+
+_THREAD_LOCKS: Dict[str, threading.Lock] = {}
+_THREAD_LOCKS_GUARD = threading.Lock()
+
+
+def _thread_lock_for(path: str) -> threading.Lock:
+    with _THREAD_LOCKS_GUARD:
+        return _THREAD_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class ChunkStore:
+    """片段与文件元信息的存储后端接口。
+
+    - 文件元信息以 `{"files": [...], "next_id": int}` 的字典形式读写
+    - 片段以标准化字典记录读写：`file_id`、`chunk_index`、`content`、`metadata`（可选）、`embedding`（可选）
+    """
+
+    name: str = "base"
+
+    def __init__(self, base_dir: str = "data/kb"):
+        self.base_dir = base_dir
+
+    def kb_dir(self, kb_id: int) -> str:
+        return os.path.join(self.base_dir, str(kb_id))
+
+    def ensure_kb(self, kb_id: int) -> None:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    @contextmanager
+    def files_lock(self, kb_id: int) -> Iterator[None]:
+        """文件元信息读-改-写的互斥锁（不可重入）：进程内线程锁 + `{kb_dir}/files.lock` 上的 flock，
+        API 进程与入库工作进程之间同样互斥"""
+        kb_dir = self.kb_dir(kb_id)
+        os.makedirs(kb_dir, exist_ok=True)
+        path = os.path.join(kb_dir, "files.lock")
+        with _thread_lock_for(path):
+            if fcntl is None:
+                yield
+                return
+            with open(path, "a+b") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def reset_kb(self, kb_id: int) -> None:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def load_files(self, kb_id: int) -> Dict[str, Any]:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def save_files(self, kb_id: int, data: Dict[str, Any]) -> None:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def write_chunks(self, kb_id: int, file_id: int, records: List[Dict[str, Any]]) -> None:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def open_writer(self, kb_id: int, file_id: int) -> "ChunkWriter":
+        """打开逐批写入片段的写入器；`commit` 前读取方仍看到旧数据。默认实现在提交时一次性 `write_chunks`"""
+        return ChunkWriter(self, kb_id, file_id)
+
+    def read_chunks(self, kb_id: int, file_id: int, indices: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:  # pragma: no cover - interface
+        """读取片段记录（按 chunk_index 升序）；指定 `indices` 时只返回对应记录，且可省略 embedding"""
+        raise NotImplementedError
+
+    def iter_chunks(self, kb_id: int) -> Iterator[Dict[str, Any]]:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def iter_file_chunks(self, kb_id: int, file_id: int) -> Iterator[Dict[str, Any]]:
+        """按写入顺序逐条遍历某个文件的片段记录（可能包含 embedding）；默认实现一次性读取"""
+        return iter(self.read_chunks(kb_id, file_id))
+
+    def delete_file(self, kb_id: int, file_id: int) -> bool:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    def chunks_mtime(self, kb_id: int, file_id: int) -> Optional[float]:
+        """片段最后写入时间（秒），不存在时返回 None"""
+        return None
+
+    def files_version(self, kb_id: int) -> Optional[Any]:
+        """文件元信息的版本标记（mtime 或代数），内容变化时必然改变；返回 None 表示不支持缓存"""
+        return None
+
+    def keyword_candidates(self, kb_id: int, tokens: List[str]) -> Optional[Iterator[Dict[str, Any]]]:
+        """返回可能包含任一 token 的片段记录；后端不支持索引检索时返回 None，由调用方全量扫描"""
+        return None
+
+
+class ChunkWriter:
+    """片段写入器：`write` 追加一批记录，`commit` 原子替换该文件的全部片段，`abort` 放弃本次写入
+
+    - 基类实现把记录暂存在内存中，提交时调用 `write_chunks`；支持流式落盘的后端覆盖本类
+    """
+
+    def __init__(self, store: ChunkStore, kb_id: int, file_id: int):
+        self.store = store
+        self.kb_id = kb_id
+        self.file_id = file_id
+        self.count = 0
+        self._records: List[Dict[str, Any]] = []
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        self._records.extend(records)
+        self.count += len(records)
+
+    def commit(self) -> None:
+        self.store.write_chunks(self.kb_id, self.file_id, self._records)
+        self._records = []
+
+    def abort(self) -> None:
+        self._records = []
+
+
+class _JsonlWriter(ChunkWriter):
+    """逐条写入 `{file_id}.jsonl` 的临时文件，偏移索引行在内存中累积（每条 24 字节），提交时一起替换"""
+
+    def __init__(self, store: "JsonChunkStore", kb_id: int, file_id: int):
+        super().__init__(store, kb_id, file_id)
+        store.ensure_kb(kb_id)
+        self.path = store._chunk_path(kb_id, file_id)
+        self.index_path = store._index_path(kb_id, file_id)
+        self._tmp = tmp_path_for(self.path)
+        self._index_tmp = tmp_path_for(self.index_path)
+        self._f = open(self._tmp, "wb")
+        self._rows: List[List[int]] = []
+        self._offset = 0
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        for r in records:
+            line = (json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8")
+            self._f.write(line)
+            self._rows.append([int(r.get("chunk_index", len(self._rows))), self._offset, len(line)])
+            self._offset += len(line)
+        self.count += len(records)
+
+    def commit(self) -> None:
+        self._f.close()
+        index = np.asarray([[len(self._rows), self._offset, 0]] + self._rows, dtype=np.int64)
+        with open(self._index_tmp, "wb") as f:
+            np.save(f, index)
+        # 先替换数据再替换索引；读取方以索引首行记录的字节数校验两者是否匹配
+        os.replace(self._tmp, self.path)
+        os.replace(self._index_tmp, self.index_path)
+        self.store._remove_other_formats(self.kb_id, self.file_id, (self.path, self.index_path))
+
+    def abort(self) -> None:
+        self._f.close()
+        for p in (self._tmp, self._index_tmp):
+            if os.path.exists(p):
+                os.remove(p)
+
+
+class _BlockChunkWriter(ChunkWriter):
+    """块压缩格式的写入器，压缩字典取自最先写入的若干块记录"""
+
+    def __init__(self, store: "JsonChunkStore", kb_id: int, file_id: int):
+        super().__init__(store, kb_id, file_id)
+        store.ensure_kb(kb_id)
+        self.path = store._block_path(kb_id, file_id)
+        self.index_path = store._block_index_path(kb_id, file_id)
+        self._writer = BlockWriter(self.path, self.index_path, codec=store.compression)
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        self._writer.write(records)
+        self.count += len(records)
+
+    def commit(self) -> None:
+        self._writer.commit()
+        self.store._remove_other_formats(self.kb_id, self.file_id, (self.path, self.index_path))
+
+    def abort(self) -> None:
+        self._writer.abort()
+
+
+class ChunkRecordCache:
+    """进程内共享的片段记录 LRU：键为 (片段文件路径, 文件版本, chunk_index)
+
+    - 文件版本取 `(mtime_ns, size, inode)`，文件被任意进程改写（临时文件替换）后旧条目自然失效
+    - 容量由 `KB_CHUNK_CACHE_SIZE` 控制（默认 2048 条），为 0 时关闭
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = int(max_size if max_size is not None else os.getenv("KB_CHUNK_CACHE_SIZE", "2048"))
+        self._data: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        if self.max_size <= 0:
+            return None
+        with self._lock:
+            v = self._data.get(key)
+            if v is not None:
+                self._data.move_to_end(key)
+            return v
+
+    def put(self, key: tuple, value: Dict[str, Any]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+
+CHUNK_CACHE = ChunkRecordCache()
+
+
+@dataclass
+class FilesSnapshot:
+    """某个知识库文件元信息的只读快照，附带 id/文件名 的 O(1) 映射"""
+
+    version: Any
+    data: Dict[str, Any]
+    by_id: Dict[int, Dict[str, Any]]
+    by_name: Dict[str, Dict[str, Any]]
+
+    @classmethod
+    def build(cls, version: Any, data: Dict[str, Any]) -> "FilesSnapshot":
+        files = data.get("files", []) or []
+        by_id = {int(f["id"]): f for f in files}
+        by_name: Dict[str, Dict[str, Any]] = {}
+        for f in files:
+            # 同名文件取列表中第一条，与按顺序查找的既有行为一致
+            by_name.setdefault(str(f.get("filename", "")), f)
+        return cls(version=version, data=data, by_id=by_id, by_name=by_name)
+
+
+class FilesMetaCache:
+    """按知识库缓存文件元信息，每次读取前以 `store.files_version` 校验是否过期
+
+    - 校验只需一次 stat（JSON）或一次单行查询（SQLite），避免反复解析 `files.json`
+    - `put` 用于写穿：保存后直接以新版本替换缓存
+    - 快照内容视为只读，需要修改时请先复制
+    """
+
+    def __init__(self, store: ChunkStore):
+        self._store = store
+        self._data: Dict[int, FilesSnapshot] = {}
+        self._lock = threading.Lock()
+
+    def get(self, kb_id: int) -> FilesSnapshot:
+        kb_id = int(kb_id)
+        version = self._store.files_version(kb_id)
+        with self._lock:
+            snap = self._data.get(kb_id)
+        if snap is not None and version is not None and snap.version == version:
+            return snap
+        data = self._store.load_files(kb_id)
+        if version is None:
+            return FilesSnapshot.build(None, data)
+        # 读取期间可能被其他进程改写，以读取后的版本为准，不一致时下次再刷新
+        after = self._store.files_version(kb_id)
+        snap = FilesSnapshot.build(after if after == version else None, data)
+        with self._lock:
+            self._data[kb_id] = snap
+        return snap
+
+    def put(self, kb_id: int, data: Dict[str, Any]) -> None:
+        version = self._store.files_version(int(kb_id))
+        with self._lock:
+            if version is None:
+                self._data.pop(int(kb_id), None)
+            else:
+                self._data[int(kb_id)] = FilesSnapshot.build(version, data)
+
+    def invalidate(self, kb_id: Optional[int] = None) -> None:
+        with self._lock:
+            if kb_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(int(kb_id), None)
+
+
+class JsonChunkStore(ChunkStore):
+    """基于 JSON 文件的存储后端（默认）
+
+    - `files.json`：文件列表与元信息
+    - `chunks/{file_id}.jsonl`：每行一条片段记录
+    - `chunks/{file_id}.idx.npy`：偏移索引，首行为 `(条数, jsonl 字节数, 0)`，其后每行 `(chunk_index, 偏移, 长度)`
+    - 兼容旧格式 `chunks/{file_id}.json`（整文件 JSON 数组），重新写入时自动转换为新格式
+    - 按下标读取时直接 seek 到对应记录，命中的记录进入进程内 LRU（不含 embedding）
+    - `KB_CHUNK_COMPRESSION=zlib|lzma` 时改为块压缩存储 `chunks/{file_id}.cblk` + `chunks/{file_id}.cidx.npy`，
+      读取时只解压命中的块，解压结果进入进程内块缓存；三种格式可在同一知识库内共存
+    """
+
+    name = "json"
+
+    def __init__(self, base_dir: str = "data/kb", compression: Optional[str] = None):
+        super().__init__(base_dir)
+        comp = str(compression if compression is not None else os.getenv("KB_CHUNK_COMPRESSION", "none")).lower()
+        self.compression = comp if comp in CODECS else None
+
+    def _files_path(self, kb_id: int) -> str:
+        return os.path.join(self.kb_dir(kb_id), "files.json")
+
+    def _chunks_dir(self, kb_id: int) -> str:
+        return os.path.join(self.kb_dir(kb_id), "chunks")
+
+    def _chunk_path(self, kb_id: int, file_id: int) -> str:
+        return os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.jsonl")
+
+    def _index_path(self, kb_id: int, file_id: int) -> str:
+        return os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.idx.npy")
+
+    def _legacy_path(self, kb_id: int, file_id: int) -> str:
+        return os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.json")
+
+    def _block_path(self, kb_id: int, file_id: int) -> str:
+        return os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.cblk")
+
+    def _block_index_path(self, kb_id: int, file_id: int) -> str:
+        return os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.cidx.npy")
+
+    def _all_paths(self, kb_id: int, file_id: int) -> List[str]:
+        return [
+            self._block_path(kb_id, file_id),
+            self._block_index_path(kb_id, file_id),
+            self._chunk_path(kb_id, file_id),
+            self._index_path(kb_id, file_id),
+            self._legacy_path(kb_id, file_id),
+        ]
+
+    def _write_files_json(self, path: str, data: Dict[str, Any], create_only: bool = False) -> None:
+        """先写临时文件再整体替换 `files.json`：读取方不会读到半截内容，且 inode 随每次写入变化，
+        `files_version` 据此识别原地等长改写。`create_only` 时仅在文件不存在时落盘，不覆盖并发创建者"""
+        tmp = tmp_path_for(path)
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            if create_only:
+                try:
+                    os.link(tmp, path)
+                except FileExistsError:
+                    pass
+            else:
+                os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def ensure_kb(self, kb_id: int) -> None:
+        os.makedirs(self._chunks_dir(kb_id), exist_ok=True)
+        files_path = self._files_path(kb_id)
+        if not os.path.exists(files_path):
+            self._write_files_json(files_path, {"files": [], "next_id": 1}, create_only=True)
+
+    def reset_kb(self, kb_id: int) -> None:
+        self.ensure_kb(kb_id)
+        self._write_files_json(self._files_path(kb_id), {"files": [], "next_id": 1})
+
+    def load_files(self, kb_id: int) -> Dict[str, Any]:
+        self.ensure_kb(kb_id)
+        with open(self._files_path(kb_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_files(self, kb_id: int, data: Dict[str, Any]) -> None:
+        self.ensure_kb(kb_id)
+        self._write_files_json(self._files_path(kb_id), data)
+
+    def write_chunks(self, kb_id: int, file_id: int, records: List[Dict[str, Any]]) -> None:
+        if self.compression:
+            self.ensure_kb(kb_id)
+            path = self._block_path(kb_id, file_id)
+            index_path = self._block_index_path(kb_id, file_id)
+            write_blocks(path, index_path, records, codec=self.compression)
+            self._remove_other_formats(kb_id, file_id, (path, index_path))
+            return
+        writer = _JsonlWriter(self, kb_id, file_id)
+        try:
+            writer.write(records)
+            writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+
+    def open_writer(self, kb_id: int, file_id: int) -> ChunkWriter:
+        if self.compression:
+            return _BlockChunkWriter(self, kb_id, file_id)
+        return _JsonlWriter(self, kb_id, file_id)
+
+    def _remove_other_formats(self, kb_id: int, file_id: int, keep: Iterable[str]) -> None:
+        """清理其他格式的旧文件，保证每个文件只有一份片段数据"""
+        keep = set(keep)
+        for p in self._all_paths(kb_id, file_id):
+            if p not in keep and os.path.exists(p):
+                os.remove(p)
+
+    def _read_legacy(self, kb_id: int, file_id: int) -> List[Dict[str, Any]]:
+        path = self._legacy_path(kb_id, file_id)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or []
+
+    def _iter_jsonl(self, path: str) -> Iterator[Dict[str, Any]]:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _load_index(self, kb_id: int, file_id: int, size: int) -> Optional[np.ndarray]:
+        index_path = self._index_path(kb_id, file_id)
+        if not os.path.exists(index_path):
+            return None
+        try:
+            index = np.load(index_path)
+        except Exception:
+            return None
+        if index.ndim != 2 or index.shape[0] < 1 or int(index[0, 1]) != int(size):
+            return None
+        return index[1:]
+
+    def read_chunks(self, kb_id: int, file_id: int, indices: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        """读取片段记录；指定 `indices` 时按偏移随机读取且不返回 embedding"""
+        bpath = self._block_path(kb_id, file_id)
+        if os.path.exists(bpath):
+            return self._read_blocks(bpath, self._block_index_path(kb_id, file_id), indices)
+        path = self._chunk_path(kb_id, file_id)
+        if not os.path.exists(path):
+            raw = self._read_legacy(kb_id, file_id)
+            if indices is None:
+                return raw
+            want = set(int(i) for i in indices)
+            return [{k: v for k, v in r.items() if k != "embedding"} for r in raw if r.get("chunk_index") in want]
+        if indices is None:
+            return list(self._iter_jsonl(path))
+
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size, st.st_ino)
+        want_sorted = sorted(set(int(i) for i in indices))
+        out: Dict[int, Dict[str, Any]] = {}
+        missing: List[int] = []
+        for i in want_sorted:
+            hit = CHUNK_CACHE.get((path, version, i))
+            if hit is not None:
+                out[i] = hit
+            else:
+                missing.append(i)
+        if missing:
+            index = self._load_index(kb_id, file_id, st.st_size)
+            loaded = None if index is None else self._read_by_index(path, index, missing)
+            if loaded is None:
+                # 索引缺失、与数据不匹配或偏移处不是对应记录时顺序扫描
+                loaded = {}
+                want = set(missing)
+                for r in self._iter_jsonl(path):
+                    if r.get("chunk_index") in want:
+                        loaded[int(r["chunk_index"])] = r
+            for i, r in loaded.items():
+                rec = {k: v for k, v in r.items() if k != "embedding"}
+                CHUNK_CACHE.put((path, version, i), rec)
+                out[i] = rec
+        return [out[i] for i in want_sorted if i in out]
+
+    def _read_by_index(self, path: str, index: np.ndarray, indices: List[int]) -> Optional[Dict[int, Dict[str, Any]]]:
+        """按偏移索引读取；数据与索引替换之间的窗口内可能读到等长的新数据，逐条核对 chunk_index，不符时返回 None"""
+        pos = {int(ci): (int(off), int(ln)) for ci, off, ln in index.tolist()}
+        loaded: Dict[int, Dict[str, Any]] = {}
+        with open(path, "rb") as f:
+            for i in indices:
+                loc = pos.get(i)
+                if loc is None:
+                    continue
+                f.seek(loc[0])
+                try:
+                    r = json.loads(f.read(loc[1]).decode("utf-8"))
+                except ValueError:
+                    return None
+                if not isinstance(r, dict) or r.get("chunk_index") != i:
+                    return None
+                loaded[i] = r
+        return loaded
+
+    def _read_blocks(self, path: str, index_path: str, indices: Optional[Iterable[int]]) -> List[Dict[str, Any]]:
+        bf = BlockFile(path, index_path)
+        if indices is None:
+            return list(bf.iter_records())
+        want_sorted = sorted(set(int(i) for i in indices))
+        out: Dict[int, Dict[str, Any]] = {}
+        missing: List[int] = []
+        for i in want_sorted:
+            hit = CHUNK_CACHE.get((path, bf.version, i))
+            if hit is not None:
+                out[i] = hit
+            else:
+                missing.append(i)
+        for i, r in bf.read(missing).items():
+            rec = {k: v for k, v in r.items() if k != "embedding"}
+            CHUNK_CACHE.put((path, bf.version, i), rec)
+            out[i] = rec
+        return [out[i] for i in want_sorted if i in out]
+
+    def iter_file_chunks(self, kb_id: int, file_id: int) -> Iterator[Dict[str, Any]]:
+        bpath = self._block_path(kb_id, file_id)
+        if os.path.exists(bpath):
+            return BlockFile(bpath, self._block_index_path(kb_id, file_id)).iter_records()
+        path = self._chunk_path(kb_id, file_id)
+        if os.path.exists(path):
+            return self._iter_jsonl(path)
+        return iter(self._read_legacy(kb_id, file_id))
+
+    def iter_chunks(self, kb_id: int) -> Iterator[Dict[str, Any]]:
+        chunks_dir = self._chunks_dir(kb_id)
+        if not os.path.exists(chunks_dir):
+            return
+        for fname in os.listdir(chunks_dir):
+            fpath = os.path.join(chunks_dir, fname)
+            try:
+                if fname.endswith(".cblk"):
+                    yield from BlockFile(fpath, fpath[: -len(".cblk")] + ".cidx.npy").iter_records()
+                elif fname.endswith(".jsonl"):
+                    yield from self._iter_jsonl(fpath)
+                elif fname.endswith(".json"):
+                    with open(fpath, "r", encoding="utf-8") as f:
+                        raw = json.load(f) or []
+                    yield from raw
+            except Exception:
+                continue
+
+    def delete_file(self, kb_id: int, file_id: int) -> bool:
+        meta = self.load_files(kb_id)
+        files = meta.get("files", [])
+        new_files = [f for f in files if int(f.get("id")) != int(file_id)]
+        if len(new_files) == len(files):
+            return False
+        meta["files"] = new_files
+        self.save_files(kb_id, meta)
+        for p in self._all_paths(kb_id, file_id):
+            if os.path.exists(p):
+                os.remove(p)
+        return True
+
+    def files_version(self, kb_id: int) -> Optional[Any]:
+        try:
+            st = os.stat(self._files_path(kb_id))
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def chunks_mtime(self, kb_id: int, file_id: int) -> Optional[float]:
+        for p in (self._block_path(kb_id, file_id), self._chunk_path(kb_id, file_id), self._legacy_path(kb_id, file_id)):
+            if os.path.exists(p):
+                return os.path.getmtime(p)
+        return None
+
+
+def get_chunk_store(base_dir: str = "data/kb") -> ChunkStore:
+    """根据环境变量 `KB_STORAGE_BACKEND` 选择存储后端：`json`（默认）或 `sqlite`"""
+    backend = str(os.getenv("KB_STORAGE_BACKEND", "json")).lower()
+    if backend == "sqlite":
+        from .sqlite_store import SqliteChunkStore
+        return SqliteChunkStore(base_dir)
+    return JsonChunkStore(base_dir)
@@ -0,0 +1,102 @@
+from typing import Dict, Optional
+import os
+import threading
+import time
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态时拒绝调用"""
+
+
+class CircuitBreaker:
+    """简单的三态熔断器：closed → open → half_open → closed
+
+    - 连续失败（含超过延迟 SLO 的慢调用）达到 `failure_threshold` 次后打开
+    - 打开 `reset_timeout` 秒后进入半开，仅放行一个探测调用；成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: Optional[int] = None,
+        slo_ms: Optional[float] = None,
+        reset_timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.failure_threshold = int(failure_threshold or os.getenv("EMBED_CB_FAILURES", "3"))
+        self.slo_ms = float(slo_ms if slo_ms is not None else os.getenv("EMBED_CB_SLO_MS", "5000"))
+        self.reset_timeout = float(reset_timeout if reset_timeout is not None else os.getenv("EMBED_CB_RESET_S", "30"))
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow(self) -> bool:
+        """判断当前是否允许发起调用；打开状态到期后转为半开并放行一个探测"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self, latency_s: float = 0.0) -> None:
+        """记录一次成功调用；超过 SLO 的慢调用按失败计数"""
+        if self.slo_ms > 0 and latency_s * 1000.0 > self.slo_ms:
+            self.record_failure()
+            return
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        """记录一次失败调用，必要时打开熔断"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """放弃本次调用且不计成败（如被 KeyboardInterrupt 等中断）：释放半开状态的探测名额，允许下一个探测"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def reset(self) -> None:
+        """强制关闭熔断器并清零计数"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+_BREAKERS_LOCK = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """获取进程内按名称共享的熔断器实例"""
+    with _BREAKERS_LOCK:
+        cb = _BREAKERS.get(name)
+        if cb is None:
+            cb = CircuitBreaker(name)
+            _BREAKERS[name] = cb
+        return cb
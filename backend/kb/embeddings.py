@@ -1,16 +1,31 @@
-from typing import List
+from typing import Any, Callable, Dict, List, Optional
 import numpy as np
 import os
+import re
 import json
+import time
+import zlib
 import urllib.request
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, get_circuit_breaker
+
+
+class EmbeddingServiceError(RuntimeError):
+    """嵌入服务返回了无法解析的响应"""
+
+
+# 嵌入服务不可用时的预期错误：熔断打开、网络/超时（URLError 与 socket 超时均为 OSError）、响应异常
+EMBEDDING_UNAVAILABLE_ERRORS = (CircuitOpenError, OSError, EmbeddingServiceError)
+
 
 class OllamaEmbeddingProvider:
     """基于 Ollama 的嵌入向量生成器（例如 qwen3-embedding）"""
 
-    def __init__(self, base_url: str | None = None, model_name: str | None = None, timeout: int = 30):
+    name = "ollama"
+
+    def __init__(self, base_url: str | None = None, model_name: str | None = None, timeout: float | None = None):
         self._base_url = base_url or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self._model_name = model_name or os.getenv("OLLAMA_EMBED_MODEL", "qwen3-embedding")
-        self._timeout = timeout
+        self.timeout = float(timeout or os.getenv("OLLAMA_TIMEOUT", "30"))
 
     def _post_embed(self, inputs: List[str]) -> List[List[float]]:
         url = f"{self._base_url.rstrip('/')}/api/embed"
@@ -20,13 +35,16 @@ class OllamaEmbeddingProvider:
         }
         data = json.dumps(payload).encode("utf-8")
         req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-        with urllib.request.urlopen(req, timeout=self._timeout) as resp:
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
             body = resp.read()
-        parsed = json.loads(body.decode("utf-8"))
+        try:
+            parsed = json.loads(body.decode("utf-8"))
+        except ValueError as e:
+            raise EmbeddingServiceError(f"Ollama embed API 响应无法解析：{e}") from e
         # Ollama 返回 { "embeddings": [[...], [...]] }
-        embs = parsed.get("embeddings") or parsed.get("embedding")
+        embs = parsed.get("embeddings") or parsed.get("embedding") if isinstance(parsed, dict) else None
         if not embs:
-            raise RuntimeError("Ollama embed API 未返回 embeddings 字段")
+            raise EmbeddingServiceError("Ollama embed API 未返回 embeddings 字段")
         return embs
 
     def embed_texts(self, texts: List[str]) -> np.ndarray:
@@ -40,6 +58,10 @@ class OllamaEmbeddingProvider:
         norms[norms == 0] = 1.0
         return arr / norms
 
+    def fingerprint(self) -> str:
+        """影响向量结果的配置标识"""
+        return f"ollama:{self._model_name}"
+
     def embed_text(self, text: str) -> np.ndarray:
         """单条文本嵌入，返回一维向量"""
         embs = self._post_embed([text])
@@ -48,13 +70,235 @@ class OllamaEmbeddingProvider:
         return v / n if n != 0 else v
 
 
-def get_default_embedder():
-    """根据环境变量选择默认嵌入提供器
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[\u4e00-\u9fff]+")
 
-    - 当 `EMBEDDING_BACKEND=ollama` 时，使用 `OllamaEmbeddingProvider`
-    - 否则使用 `SentenceEmbeddingProvider`
+# 随机投影矩阵按 (特征数, 维度, 种子) 进程内共享，避免重复生成
+_PROJECTIONS: Dict[tuple[int, int, int], np.ndarray] = {}
+
+
+def _projection_matrix(n_features: int, dim: int, seed: int) -> np.ndarray:
+    key = (int(n_features), int(dim), int(seed))
+    proj = _PROJECTIONS.get(key)
+    if proj is None:
+        rng = np.random.default_rng(seed)
+        proj = rng.standard_normal((n_features, dim), dtype=np.float32) / np.float32(np.sqrt(dim))
+        _PROJECTIONS[key] = proj
+    return proj
+
+
+class HashingEmbeddingProvider:
+    """进程内词法嵌入：哈希 TF-IDF n-gram 特征 + 固定随机投影，零网络调用
+
+    - 特征：小写英文词的 1~2 元组与中文字符 2-gram，经 crc32 哈希到 `n_features` 个桶
+    - 权重：亚线性 TF（1 + log tf）乘以可选的 IDF 表（`LOCAL_EMBED_IDF_PATH`，默认全 1）
+    - 投影：固定种子的高斯随机矩阵降维到 `dim`，结果 L2 归一化，跨进程/机器完全确定
     """
+
+    name = "local"
+
+    def __init__(
+        self,
+        dim: Optional[int] = None,
+        n_features: Optional[int] = None,
+        seed: Optional[int] = None,
+        idf_path: Optional[str] = None,
+    ):
+        self.dim = int(dim or os.getenv("LOCAL_EMBED_DIM", "256"))
+        self.n_features = int(n_features or os.getenv("LOCAL_EMBED_FEATURES", str(1 << 14)))
+        self.seed = int(seed if seed is not None else os.getenv("LOCAL_EMBED_SEED", "20240601"))
+        self._proj = _projection_matrix(self.n_features, self.dim, self.seed)
+        self._idf: Optional[np.ndarray] = None
+        path = idf_path or os.getenv("LOCAL_EMBED_IDF_PATH")
+        if path and os.path.exists(path):
+            idf = np.load(path).astype(np.float32).reshape(-1)
+            if idf.shape[0] == self.n_features:
+                self._idf = idf
+
+    def fingerprint(self) -> str:
+        """影响向量结果的配置标识（含 IDF 表内容）"""
+        idf = zlib.crc32(self._idf.tobytes()) if self._idf is not None else 0
+        return f"local:{self.dim}:{self.n_features}:{self.seed}:{idf:08x}"
+
+    def _features(self, text: str) -> List[str]:
+        feats: List[str] = []
+        words: List[str] = []
+        for m in _TOKEN_RE.finditer(text or ""):
+            t = m.group(0)
+            if t[0] >= "\u4e00":
+                if len(t) == 1:
+                    feats.append(t)
+                feats.extend(t[i:i + 2] for i in range(len(t) - 1))
+                continue
+            words.append(t.lower())
+        feats.extend(words)
+        feats.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        return feats
+
+    def _hashed_tf(self, text: str) -> tuple[np.ndarray, np.ndarray]:
+        """返回 (桶下标, 权重)，权重已做亚线性 TF、IDF 与 L2 归一化"""
+        feats = self._features(text)
+        if not feats:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in feats), dtype=np.int64, count=len(feats))
+        buckets, counts = np.unique(hashes % self.n_features, return_counts=True)
+        w = 1.0 + np.log(counts.astype(np.float32))
+        if self._idf is not None:
+            w = w * self._idf[buckets]
+        n = float(np.linalg.norm(w))
+        if n > 0:
+            w = w / n
+        return buckets, w.astype(np.float32)
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """批量生成文本嵌入，返回形状为 (n, d) 的 numpy 数组"""
+        if not texts:
+            return np.zeros((0, 0), dtype=float)
+        rows: List[np.ndarray] = []
+        cols: List[np.ndarray] = []
+        vals: List[np.ndarray] = []
+        for i, t in enumerate(texts):
+            b, w = self._hashed_tf(t)
+            rows.append(np.full(b.shape[0], i, dtype=np.int64))
+            cols.append(b)
+            vals.append(w)
+        r = np.concatenate(rows)
+        c = np.concatenate(cols)
+        v = np.concatenate(vals)
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(out, r, self._proj[c] * v[:, None])
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (out / norms).astype(float)
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """单条文本嵌入，返回一维向量"""
+        b, w = self._hashed_tf(text)
+        v = (w @ self._proj[b]).astype(float) if b.shape[0] else np.zeros(self.dim, dtype=float)
+        n = np.linalg.norm(v)
+        return v / n if n != 0 else v
+
+    def fit_idf(self, texts: List[str], out_path: Optional[str] = None) -> np.ndarray:
+        """基于语料统计哈希桶的平滑 IDF，可选保存为 `.npy` 供 `LOCAL_EMBED_IDF_PATH` 使用
+
+        - 注意：更换 IDF 会改变向量，需重建已入库的向量索引
+        """
+        df = np.zeros(self.n_features, dtype=np.float64)
+        for t in texts or []:
+            b, _ = self._hashed_tf(t)
+            df[b] += 1.0
+        n_docs = float(len(texts or []))
+        idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+        if out_path:
+            np.save(out_path, idf)
+        self._idf = idf
+        return idf
+
+
+class CircuitBreakingEmbedder:
+    """为任意嵌入提供器加上熔断保护：熔断打开时立即抛出 `CircuitOpenError`，不再等待超时"""
+
+    def __init__(self, provider: Any, breaker: CircuitBreaker):
+        self._provider = provider
+        self.breaker = breaker
+        self.name = getattr(provider, "name", type(provider).__name__)
+
+    def _call(self, fn: Callable[[], np.ndarray]) -> np.ndarray:
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"嵌入服务熔断中：{self.breaker.name}")
+        t0 = time.monotonic()
+        finished = False
+        try:
+            out = fn()
+            finished = True
+        except Exception:
+            finished = True
+            self.breaker.record_failure()
+            raise
+        finally:
+            # 被 BaseException（KeyboardInterrupt、SystemExit 等）中断时未记录成败，须释放探测名额，
+            # 否则半开状态的熔断器会一直拒绝调用
+            if not finished:
+                self.breaker.release_probe()
+        self.breaker.record_success(time.monotonic() - t0)
+        return out
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return self._provider.embed_texts(texts)
+        return self._call(lambda: self._provider.embed_texts(texts))
+
+    def embed_text(self, text: str) -> np.ndarray:
+        return self._call(lambda: self._provider.embed_text(text))
+
+    def __getattr__(self, item: str) -> Any:
+        if item.startswith("_"):
+            raise AttributeError(item)
+        return getattr(self._provider, item)
+
+
+def embedder_fingerprint(embedder: Any) -> str:
+    """嵌入器配置标识，用于判断已有向量能否复用；提供器没有 `fingerprint` 时退化为名称"""
+    provider = getattr(embedder, "_provider", embedder)
+    fp = getattr(provider, "fingerprint", None)
+    if callable(fp):
+        return str(fp())
+    return str(getattr(provider, "name", type(provider).__name__))
+
+
+_EMBEDDER_FACTORIES: Dict[str, Callable[[], Any]] = {}
+
+
+def register_embedder(name: str, factory: Callable[[], Any]) -> None:
+    """注册嵌入提供器工厂，`EMBEDDING_BACKEND` 按名称（不区分大小写）选择"""
+    _EMBEDDER_FACTORIES[str(name).strip().lower()] = factory
+
+
+def get_embedder(name: str) -> Any:
+    """按名称创建嵌入提供器，未注册时抛出 `ValueError`"""
+    factory = _EMBEDDER_FACTORIES.get(str(name or "").strip().lower())
+    if factory is None:
+        raise ValueError(f"未注册的嵌入后端：{name}")
+    return factory()
+
+
+register_embedder("ollama", OllamaEmbeddingProvider)
+register_embedder("local", HashingEmbeddingProvider)
+register_embedder("hashing", HashingEmbeddingProvider)
+
+
+def _default_provider() -> Any:
     backend = os.getenv("EMBEDDING_BACKEND", "sentence_transformers").lower()
-    if backend == "ollama":
-        return OllamaEmbeddingProvider()
-    return OllamaEmbeddingProvider()
+    factory = _EMBEDDER_FACTORIES.get(backend)
+    return factory() if factory is not None else OllamaEmbeddingProvider()
+
+
+def _with_breaker(provider: Any, suffix: str = "") -> Any:
+    if str(os.getenv("EMBED_CIRCUIT_BREAKER", "1")).lower() in {"0", "false", "no"}:
+        return provider
+    name = getattr(provider, "name", type(provider).__name__)
+    return CircuitBreakingEmbedder(provider, get_circuit_breaker(f"embedder:{name}{suffix}"))
+
+
+def get_default_embedder():
+    """根据环境变量选择默认嵌入提供器（入库批量嵌入使用）
+
+    - `EMBEDDING_BACKEND` 为已注册名称时使用对应提供器：`ollama`、`local`/`hashing`
+    - 其他取值（含历史默认值 `sentence_transformers`）回退到 `OllamaEmbeddingProvider`
+    - 默认包裹进程内共享的熔断器，`EMBED_CIRCUIT_BREAKER=0` 可关闭
+    """
+    return _with_breaker(_default_provider())
+
+
+def get_query_embedder():
+    """检索查询使用的嵌入提供器：与 `get_default_embedder` 同一后端，但熔断器与超时独立
+
+    - 熔断器名称带 `:query` 后缀，入库批次的失败不会打开交互检索的熔断
+    - 单次请求超时取 `EMBED_QUERY_TIMEOUT_S`，默认等于延迟 SLO（`EMBED_CB_SLO_MS`，默认 5 秒），
+      只对有 `timeout` 属性的提供器（如 Ollama）生效
+    """
+    provider = _default_provider()
+    slo_s = float(os.getenv("EMBED_CB_SLO_MS", "5000")) / 1000.0
+    timeout = float(os.getenv("EMBED_QUERY_TIMEOUT_S") or slo_s or 0)
+    if timeout > 0 and hasattr(provider, "timeout"):
+        provider.timeout = min(float(provider.timeout), timeout)
+    return _with_breaker(provider, ":query")
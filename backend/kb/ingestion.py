@@ -1,20 +1,260 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import hashlib
+import json
+import multiprocessing
 import os
 import re
 import html
+from html.parser import HTMLParser
+import shutil
+import tempfile
+import numpy as np
 from .splitters import (
     NormalSplitter,
     AdaptiveSplitter,
 )
-from .splitters.splitter_table import TableSplitter
+from .splitters.splitter_table import TableSplitter, markdown_row, table_width
 from .knowledge_base import FileInfo
+from .blob_store import file_sha256, link_or_copy
+from .embeddings import embedder_fingerprint
+from .rerank import sentence_vectors_enabled
 
-def read_pdf_markdown_with_images(pdf_path: str, image_dir: str) -> str:
+def _report(progress: Optional[Callable[[str, int, int], None]], stage: str, done: int, total: int) -> None:
+    """向任务进度回调报告阶段进度（未提供回调时忽略）"""
+    if progress is not None:
+        progress(stage, done, total)
+
+
+def _pdf_page_count(pdf_path: str) -> Optional[int]:
+    """读取 PDF 页数，PyMuPDF 不可用或打开失败时返回 None"""
+    try:
+        import pymupdf  # type: ignore
+    except Exception:
+        try:
+            import fitz as pymupdf  # type: ignore
+        except Exception:
+            return None
+    try:
+        with pymupdf.open(pdf_path) as doc:
+            return int(doc.page_count)
+    except Exception:
+        return None
+
+
+def _pdf_engine() -> Tuple[Callable[..., Any], Optional[Callable[..., Any]]]:
+    """返回 PyMuPDF4LLM 基于字号识别标题的转换函数及 `IdentifyHeaders`
+
+    - 新版默认的版面分析引擎按已解析页面统计标题字号，按页段分别转换会得到不一致的标题层级，
+      因此固定使用字号引擎（旧版中即为默认的 `to_markdown`），保证单进程与并行结果一致
+    """
+    import pymupdf4llm  # type: ignore
+
+    rag = getattr(getattr(pymupdf4llm, "helpers", None), "pymupdf_rag", None)
+    if rag is not None and hasattr(rag, "to_markdown"):
+        return rag.to_markdown, getattr(rag, "IdentifyHeaders", None)
+    return pymupdf4llm.to_markdown, getattr(pymupdf4llm, "IdentifyHeaders", None)
+
+
+# 每个进程缓存一份已统计标题字号的文档：{路径: ((mtime_ns, size), Document, hdr_info)}
+_PDF_DOCS: Dict[str, Tuple[Tuple[int, int], Any, Any]] = {}
+
+
+def _open_pdf(pdf_path: str) -> Tuple[Any, Any]:
+    """打开 PDF 并在同一文档对象上统计标题字号（`IdentifyHeaders`），同一进程内复用
+
+    - 整本转换时 `to_markdown` 会先在文档对象上执行 `IdentifyHeaders`，该扫描会改变文档对象的内部状态
+      并影响后续的表格识别；按页段转换也必须在扫描过的同一对象上进行，结果才与整本转换一致
+    """
+    st = os.stat(pdf_path)
+    version = (st.st_mtime_ns, st.st_size)
+    cached = _PDF_DOCS.get(pdf_path)
+    if cached is not None and cached[0] == version:
+        return cached[1], cached[2]
+    _close_pdf(pdf_path)
+    try:
+        import pymupdf  # type: ignore
+    except Exception:
+        import fitz as pymupdf  # type: ignore
+    _, identify = _pdf_engine()
+    doc = pymupdf.open(pdf_path)
+    hdr_info = identify(doc) if identify is not None else None
+    _PDF_DOCS[pdf_path] = (version, doc, hdr_info)
+    return doc, hdr_info
+
+
+def _close_pdf(pdf_path: str) -> None:
+    cached = _PDF_DOCS.pop(pdf_path, None)
+    if cached is not None:
+        try:
+            cached[1].close()
+        except Exception:
+            pass
+
+
+# 延后提取图片时，正文转换阶段以该分辨率渲染占位图，只为得到与正式渲染一致的图片引用
+_PLACEHOLDER_DPI = 10
+_IMAGE_DPI = 150
+_IMAGE_MODES = ("inline", "deferred", "off")
+
+
+def pdf_images_mode(mode: Optional[str] = None) -> str:
+    """PDF 图片提取方式（`KB_PDF_IMAGES`）：
+
+    - `inline`（默认）：转换正文时按 150 dpi 渲染图片，按内容哈希去重后改写 Markdown 引用
+    - `deferred`：正文只生成图片引用，图片由后台阶段（`render_pdf_images`）渲染
+    - `off`：不提取图片，正文不含图片引用
+    """
+    mode = str(mode or os.getenv("KB_PDF_IMAGES", "inline")).strip().lower()
+    return mode if mode in _IMAGE_MODES else "inline"
+
+
+def _store_image(src: str, image_dir: str) -> str:
+    """把渲染出的图片按内容哈希收入 `image_dir`（相同内容只保存一份），返回去重后的路径"""
+    dest = os.path.join(image_dir, file_sha256(src)[:32] + os.path.splitext(src)[1])
+    if os.path.exists(dest):
+        os.remove(src)
+    else:
+        os.replace(src, dest)
+    return dest
+
+
+def _pdf_markdown(pdf_path: str, image_dir: str, pages: Optional[List[int]] = None, images: str = "inline") -> str:
+    """将指定页（默认全部）转换为 Markdown，未去除首尾空白，便于按页段拼接
+
+    图片先渲染到临时目录：`inline` 时按内容哈希去重并改写引用；`deferred` 时丢弃占位图，
+    引用指向 `image_dir` 下的原始文件名（`{PDF 文件名}-{页}-{序号}.png`），由 `render_pdf_images` 补齐。
+    """
+    to_markdown, _ = _pdf_engine()
+    kwargs: Dict[str, Any] = {}
+    doc: Any = pdf_path
+    if pages is not None:
+        doc, hdr_info = _open_pdf(pdf_path)
+        kwargs["pages"] = pages
+        if hdr_info is not None:
+            kwargs["hdr_info"] = hdr_info
+    scratch = tempfile.mkdtemp(prefix=".render-", dir=image_dir) if images != "off" else ""
+    try:
+        md = to_markdown(
+            doc,
+            write_images=images != "off",
+            embed_images=False,
+            image_path=scratch,
+            dpi=_PLACEHOLDER_DPI if images == "deferred" else _IMAGE_DPI,
+            force_text=True,
+            page_chunks=False,
+            show_progress=False,
+            **kwargs,
+        )
+        if isinstance(md, list):
+            page_texts: List[str] = []
+            for page in md:
+                page_texts.append(str(page.get("text", "")).strip())
+            md = "\n\n".join(t for t in page_texts if t)
+        md = str(md)
+        if scratch:
+            prefix = os.path.join(scratch, "").replace("\\", "/")
+            if images == "deferred":
+                md = md.replace(prefix, os.path.join(image_dir, "").replace("\\", "/"))
+            else:
+                for name in sorted(os.listdir(scratch)):
+                    dest = _store_image(os.path.join(scratch, name), image_dir)
+                    md = md.replace(prefix + name, dest.replace("\\", "/"))
+        return md
+    finally:
+        if scratch:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+_IMAGE_REF = re.compile(r"!\[[^\]]*\]\(([^)\s]+)\)")
+
+
+def image_ref_pages(text: str, pdf_name: str) -> List[int]:
+    """从 `deferred` 方式生成的 Markdown 中找出引用了图片的页码（从 0 开始）"""
+    stem = re.escape(os.path.basename(pdf_name).replace(" ", "-"))
+    pat = re.compile(rf"/{stem}-(\d+)-\w+\.\w+$")
+    pages = set()
+    for ref in _IMAGE_REF.findall(text or ""):
+        m = pat.search(ref)
+        if m:
+            pages.add(int(m.group(1)))
+    return sorted(pages)
+
+
+def render_pdf_images(
+    pdf_path: str,
+    image_dir: str,
+    pages: Optional[List[int]] = None,
+    pages_per_task: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> Dict[str, int]:
+    """后台图片阶段：按 150 dpi 渲染 `deferred` 方式引用的图片，相同内容只保存一份
+
+    - 只渲染 `pages`（默认全部页）；图片以内容哈希命名保存，引用中的原始文件名以硬链接指向它，
+      已写入的片段无需改写
+    - 返回 `{"images": 引用数, "files": 去重后的文件数}`
+    """
+    n_pages = _pdf_page_count(pdf_path)
+    if pages is None:
+        pages = list(range(n_pages or 0))
+    pages_per_task = max(1, int(pages_per_task or os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "8")))
+    os.makedirs(image_dir, exist_ok=True)
+    to_markdown, _ = _pdf_engine()
+    refs = 0
+    stored = set()
+    _report(progress, "extract", 0, len(pages))
+    try:
+        for k in range(0, len(pages), pages_per_task):
+            window = pages[k:k + pages_per_task]
+            doc, hdr_info = _open_pdf(pdf_path)
+            scratch = tempfile.mkdtemp(prefix=".render-", dir=image_dir)
+            try:
+                to_markdown(
+                    doc,
+                    pages=window,
+                    write_images=True,
+                    embed_images=False,
+                    image_path=scratch,
+                    dpi=_IMAGE_DPI,
+                    force_text=True,
+                    page_chunks=False,
+                    show_progress=False,
+                    **({"hdr_info": hdr_info} if hdr_info is not None else {}),
+                )
+                for name in sorted(os.listdir(scratch)):
+                    dest = _store_image(os.path.join(scratch, name), image_dir)
+                    link_or_copy(dest, os.path.join(image_dir, name))
+                    stored.add(dest)
+                    refs += 1
+            finally:
+                shutil.rmtree(scratch, ignore_errors=True)
+            _report(progress, "extract", min(k + pages_per_task, len(pages)), len(pages))
+    finally:
+        _close_pdf(pdf_path)
+    return {"images": refs, "files": len(stored)}
+
+
+def read_pdf_markdown_with_images(
+    pdf_path: str,
+    image_dir: str,
+    workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    images: Optional[str] = None,
+) -> str:
     """使用 PyMuPDF4LLM 读取 PDF 为 Markdown，并将图片写入指定目录
 
     - 参数 `pdf_path`：PDF 文件路径
     - 参数 `image_dir`：图片输出目录（将自动创建）
+    - 参数 `workers`：并行进程数（`PDF_EXTRACT_WORKERS`，默认 min(4, CPU 数)），为 1 时单进程整本转换
+    - 参数 `pages_per_task`：每个任务处理的连续页数（`PDF_EXTRACT_PAGES_PER_TASK`，默认 8）
+    - 参数 `progress`：可选进度回调，按已完成页数报告 `extract` 阶段
+    - 参数 `images`：图片提取方式，默认读取 `KB_PDF_IMAGES`（见 `pdf_images_mode`）
     - 返回：Markdown 文本（包含图片引用与自动识别的表格）
+
+    并行时各工作进程在同一文档对象上先基于全文统计标题字号再转换页段（见 `_open_pdf`），
+    保证标题层级与表格识别与整本转换一致；各页段结果按页序拼接为连续文本。
     """
     if not os.path.isfile(pdf_path):
         raise FileNotFoundError(f"PDF 文件不存在：{pdf_path}")
@@ -28,32 +268,152 @@ def read_pdf_markdown_with_images(pdf_path: str, image_dir: str) -> str:
         )
 
     os.makedirs(image_dir, exist_ok=True)
-    md = pymupdf4llm.to_markdown(
-        pdf_path,
-        write_images=True,
-        embed_images=False,
-        image_path=image_dir,
-        dpi=150,
-        force_text=True,
-        page_chunks=False,
-        show_progress=False,
-    )
-    if isinstance(md, list):
-        page_texts: List[str] = []
-        for page in md:
-            page_texts.append(str(page.get("text", "")).strip())
-        return "\n\n".join(t for t in page_texts if t).strip()
-    return str(md).strip()
+    workers = int(workers or os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+    pages_per_task = max(1, int(pages_per_task or os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "8")))
+    n_pages = _pdf_page_count(pdf_path)
+    total = n_pages or 1
+    _report(progress, "extract", 0, total)
 
+    images = pdf_images_mode(images)
+    if workers <= 1 or n_pages is None or n_pages <= pages_per_task:
+        text = _pdf_markdown(pdf_path, image_dir, images=images)
+        _report(progress, "extract", total, total)
+        return text.strip()
 
-def read_excel_text(excel_path: str, max_rows_per_sheet: int = 2000, max_cols: int = 50) -> str:
-    """读取 Excel（.xlsx/.xlsm）文件为纯文本，适合后续拆分与索引
+    # 各页段按页序拼接，窗口调度与标题字号统计见 `iter_pdf_markdown`
+    return "".join(iter_pdf_markdown(pdf_path, image_dir, workers, pages_per_task, progress, images)).strip()
 
-    - 参数 `excel_path`：Excel 文件路径
-    - 参数 `max_rows_per_sheet`：每个工作表最多保留的非空行数，避免超大表格导致内存/时延问题
-    - 参数 `max_cols`：每行最多读取的列数，避免极宽表格影响可读性
-    - 返回：按工作表分隔的文本，其中表格以 Markdown 表格形式输出
+
+def iter_pdf_markdown(
+    pdf_path: str,
+    image_dir: str,
+    workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    images: Optional[str] = None,
+) -> Iterator[str]:
+    """按页窗口流式产出 PDF 的 Markdown 文本（按页序，首尾空白未去除），拼接后与整本转换一致
+
+    - 每个窗口为 `pages_per_task` 个连续页；多进程时最多 `2 × workers` 个窗口在途，
+      消费方处理慢时提取随之暂停，内存占用只与窗口大小有关
+    - 每个进程打开一次文档并基于全文统计标题字号（见 `_open_pdf`），其后各窗口复用
+    - 提前关闭生成器（如任务被取消）时撤销尚未开始的窗口
+    - `images`：图片提取方式，见 `pdf_images_mode`
     """
+    if not os.path.isfile(pdf_path):
+        raise FileNotFoundError(f"PDF 文件不存在：{pdf_path}")
+
+    try:
+        import pymupdf4llm  # type: ignore
+    except Exception:
+        raise RuntimeError(
+            "缺少依赖：请安装 pymupdf 与 pymupdf4llm。\n"
+            "pip install pymupdf pymupdf4llm"
+        )
+
+    os.makedirs(image_dir, exist_ok=True)
+    workers = int(workers or os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+    pages_per_task = max(1, int(pages_per_task or os.getenv("PDF_EXTRACT_PAGES_PER_TASK", "8")))
+    images = pdf_images_mode(images)
+    n_pages = _pdf_page_count(pdf_path)
+    total = n_pages or 1
+    _report(progress, "extract", 0, total)
+
+    if n_pages is None or n_pages <= pages_per_task:
+        yield _pdf_markdown(pdf_path, image_dir, images=images)
+        _report(progress, "extract", total, total)
+        return
+
+    ranges = [list(range(a, min(a + pages_per_task, n_pages))) for a in range(0, n_pages, pages_per_task)]
+    done_pages = 0
+
+    if workers <= 1:
+        try:
+            for pages in ranges:
+                yield _pdf_markdown(pdf_path, image_dir, pages, images)
+                done_pages += len(pages)
+                _report(progress, "extract", done_pages, total)
+        finally:
+            _close_pdf(pdf_path)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(ranges)), mp_context=ctx)
+    in_flight: deque = deque()
+    try:
+        pending = iter(ranges)
+        for pages in pending:
+            in_flight.append((pages, pool.submit(_pdf_markdown, pdf_path, image_dir, pages, images)))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            pages, fut = in_flight.popleft()
+            text = fut.result()
+            nxt = next(pending, None)
+            if nxt is not None:
+                in_flight.append((nxt, pool.submit(_pdf_markdown, pdf_path, image_dir, nxt, images)))
+            done_pages += len(pages)
+            _report(progress, "extract", done_pages, total)
+            yield text
+    finally:
+        for _, fut in in_flight:
+            fut.cancel()
+        pool.shutdown(wait=True)
+
+
+def iter_text_lines(pieces: Iterable[str]) -> Iterator[str]:
+    """把连续文本片段拼接后逐行产出，结果与 `"".join(pieces).strip().splitlines()` 一致
+
+    - 跨片段的半行会与下一片段拼接；末尾空白行暂缓输出，以便与整体去除首尾空白的结果一致
+    """
+    carry = ""
+    started = False
+    held: List[str] = []
+
+    def _emit(line: str) -> Iterator[str]:
+        nonlocal held
+        if line.strip():
+            yield from held
+            held = [line]
+        elif held:
+            held.append(line)
+
+    for piece in pieces:
+        if not started:
+            piece = piece.lstrip()
+            if not piece:
+                continue
+            started = True
+        parts = (carry + piece).splitlines(keepends=True)
+        if not parts:
+            continue
+        # 最后一段可能是半行（或以 \r 结尾、后续可能接 \n），留待下一片段
+        carry = parts.pop()
+        for part in parts:
+            yield from _emit(part.splitlines()[0] if part.splitlines() else "")
+    for line in carry.splitlines():
+        yield from _emit(line)
+    if held:
+        yield held[0].rstrip()
+
+
+def _table_to_markdown(rows: List[List[str]]) -> str:
+    """将二维单元格文本转换为 Markdown 表格：首行作为表头，列数按最宽行补齐，单元格内的 `|` 转义"""
+    width = table_width(rows)
+    if width == 0:
+        return ""
+    out = [markdown_row(rows[0], width), "| " + " | ".join(["---"] * width) + " |"]
+    out.extend(markdown_row(r, width) for r in rows[1:])
+    return "\n".join(out)
+
+
+def _cell_to_str(v: Any) -> str:
+    s = "" if v is None else str(v)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+
+def _open_workbook(excel_path: str):
     if not os.path.isfile(excel_path):
         raise FileNotFoundError(f"Excel 文件不存在：{excel_path}")
 
@@ -64,183 +424,697 @@ def read_excel_text(excel_path: str, max_rows_per_sheet: int = 2000, max_cols: i
             "缺少依赖：请安装 openpyxl 以读取 Excel 文件。\n"
             "pip install openpyxl"
         )
+    return load_workbook(excel_path, read_only=True, data_only=True)
 
-    def _cell_to_str(v: Any) -> str:
-        s = "" if v is None else str(v)
-        s = re.sub(r"\s+", " ", s).strip()
-        return s
 
-    wb = load_workbook(excel_path, read_only=True, data_only=True)
-    parts: List[str] = []
-    for sheet in wb.worksheets:
-        rows: List[List[Any]] = []
-        kept_rows = 0
-        try:
-            for row in sheet.iter_rows(values_only=True):
-                if kept_rows >= max_rows_per_sheet:
-                    break
-                cols = list(row[:max_cols]) if row else []
-                if not any((c is not None and str(c).strip() != "") for c in cols):
-                    continue
-                kept_rows += 1
-                rows.append([_cell_to_str(c) for c in cols])
-        except Exception:
-            continue
+def iter_excel_sheets(
+    excel_path: str,
+    max_rows_per_sheet: Optional[int] = None,
+    max_cols: int = 50,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    sheet_stats: Optional[List[Dict[str, Any]]] = None,
+    window_rows: Optional[int] = None,
+) -> Iterator[Tuple[str, Iterator[List[str]], int]]:
+    """逐个工作表流式读取 Excel（.xlsx/.xlsm）的非空行，产出 `(sheet_name, rows, width)`
 
-        if not rows:
-            continue
+    - 每个工作表读取两遍：第一遍只统计非空行数与表格列数（末尾全空的列不计），第二遍逐行产出单元格文本，
+      内存占用与表格行数无关；`rows` 必须在取下一个工作表之前消费完
+    - 单元格文本空白折叠为单个空格，每行最多 `max_cols` 列；`max_rows_per_sheet` 为 None 时不限行数
+    - `sheet_stats`：可选列表，每个工作表追加 `{"name", "rows", "cols"}`（`rows` 为含表头的非空行数）
+    - `progress` 按 `window_rows`（默认 `KB_EXCEL_ROW_WINDOW`，1000）行为一个窗口报告 extract 阶段已读取的行数，
+      总量在各表统计完成前未知（以 0 表示）
+    - 读取失败的工作表跳过
+    """
+    window = int(window_rows or os.getenv("KB_EXCEL_ROW_WINDOW", "1000"))
+    limit = max_rows_per_sheet if max_rows_per_sheet is not None else -1
 
-        md = _table_to_markdown(rows)
-        if not md:
-            continue
-        parts.append(f"[Sheet] {sheet.title}\n{md}")
+    def _nonempty(sheet) -> Iterator[Tuple[Any, ...]]:
+        n = 0
+        for row in sheet.iter_rows(values_only=True):
+            if n == limit:
+                return
+            cols = row[:max_cols] if row else ()
+            if any((c is not None and str(c).strip() != "") for c in cols):
+                n += 1
+                yield cols
+
+    def _rows(sheet, base: int) -> Iterator[List[str]]:
+        for k, cols in enumerate(_nonempty(sheet), start=1):
+            yield [_cell_to_str(c) for c in cols]
+            if k % window == 0:
+                _report(progress, "extract", base + k, 0)
+
+    wb = _open_workbook(excel_path)
+    done = 0
+    try:
+        _report(progress, "extract", 0, 0)
+        for sheet in wb.worksheets:
+            k_total = 0
+            width = 0
+            try:
+                for cols in _nonempty(sheet):
+                    k_total += 1
+                    last = max((i for i, c in enumerate(cols) if c is not None and _cell_to_str(c)), default=-1)
+                    width = max(width, last + 1)
+            except Exception:
+                continue
+            if sheet_stats is not None:
+                sheet_stats.append({"name": sheet.title, "rows": k_total, "cols": width})
+            if k_total:
+                yield sheet.title, _rows(sheet, done), width
+                done += k_total
+        _report(progress, "extract", done, done)
+    finally:
+        wb.close()
 
-    return "\n\n".join(parts).strip()
-    
-def read_chm_text(chm_path: str) -> str:
-    """读取 CHM 文件为纯文本（使用 pychm + beautifulsoup4；无系统命令回退）。
 
-    - 依赖：`pychm`（解析 CHM），`beautifulsoup4`（解析 HTML）
-    - 若未安装依赖，会抛出明确的错误提示以指导安装
-    - 文本解析：去除脚本/样式/注释，提取可读文本，适合后续拆分与索引
+def excel_sheet_headers(excel_path: str, max_cols: int = 50) -> List[Tuple[str, List[str]]]:
+    """只读取各工作表的第一个非空行，返回 `(sheet_name, header_cells)`（空单元格已去除）
+
+    表头与 `iter_excel_sheets` + `TableSplitter.iter_split_sheets` 使用的一致，用于提前请求表格摘要；
+    读取失败的工作表跳过。
     """
+    out: List[Tuple[str, List[str]]] = []
+    wb = _open_workbook(excel_path)
+    try:
+        for sheet in wb.worksheets:
+            try:
+                for row in sheet.iter_rows(values_only=True):
+                    cells = [_cell_to_str(c) for c in (row[:max_cols] if row else ())]
+                    if any(cells):
+                        out.append((sheet.title, [c for c in cells if c]))
+                        break
+            except Exception:
+                continue
+    finally:
+        wb.close()
+    return out
+
+
+def read_excel_text(excel_path: str, max_rows_per_sheet: int = 2000, max_cols: int = 50) -> str:
+    """读取 Excel（.xlsx/.xlsm）文件为纯文本，适合后续拆分与索引
+
+    - 参数 `excel_path`：Excel 文件路径
+    - 参数 `max_rows_per_sheet`：每个工作表最多保留的非空行数，避免超大表格导致内存/时延问题
+    - 参数 `max_cols`：每行最多读取的列数，避免极宽表格影响可读性
+    - 返回：按工作表分隔的文本，其中表格以 Markdown 表格形式输出
+    """
+    parts: List[str] = []
+    for title, rows, _ in iter_excel_sheets(excel_path, max_rows_per_sheet=max_rows_per_sheet, max_cols=max_cols):
+        md = _table_to_markdown(list(rows))
+        if md:
+            parts.append(f"[Sheet] {title}\n{md}")
+    return "\n\n".join(parts).strip()
+
+
+def _open_chm(chm_path: str):
+    """用 pychm 打开 CHM 文件，缺少依赖或打开失败时给出明确错误"""
     if not os.path.isfile(chm_path):
         raise FileNotFoundError(f"CHM 文件不存在：{chm_path}")
 
     try:
-        from pychm import ChmFile  # type: ignore
+        from chm.chm import CHMFile  # type: ignore
     except Exception:
         raise RuntimeError(
             "缺少依赖：请安装 pychm 和 beautifulsoup4。\n"
             "pip install pychm beautifulsoup4"
         )
+    chm = CHMFile()
+    if not chm.LoadCHM(chm_path):
+        raise RuntimeError(f"读取 CHM 内容失败：无法打开 {chm_path}")
+    return chm
+
 
-    chm = ChmFile(chm_path)
+def _chm_read(chm, path: str) -> Optional[bytes]:
+    """按 CHM 内部路径（如 `/html/topic.htm`）读取对象内容，不存在时返回 None"""
     try:
-        content = chm.get_content()
-    except Exception as e:
-        raise RuntimeError(f"读取 CHM 内容失败: {e}")
+        status, ui = chm.ResolveObject(path.encode("utf-8"))
+        if status != 0:
+            return None
+        size, data = chm.RetrieveObject(ui)
+    except Exception:
+        return None
+    return bytes(data) if size else None
+
+
+def _chm_html_paths(chm) -> List[str]:
+    """枚举 CHM 内的全部 HTML 文件（没有目录树时使用），按路径排序"""
+    from chm import chmlib  # type: ignore
+
+    paths: List[str] = []
+
+    def _collect(_chm, ui, _ctx):
+        path = ui.path.decode("utf-8", errors="replace") if isinstance(ui.path, bytes) else str(ui.path)
+        if path.lower().endswith((".htm", ".html")):
+            paths.append(path)
+        return chmlib.CHM_ENUMERATOR_CONTINUE
+
+    chmlib.chm_enumerate(chm.file, chmlib.CHM_ENUMERATE_NORMAL, _collect, None)
+    return sorted(paths)
+
+
+class _TopicsTreeParser(HTMLParser):
+    """解析 CHM 目录树（.hhc 站点地图），按出现顺序收集 `(标题路径, 内部路径)`"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.topics: List[Tuple[List[str], str]] = []
+        self._stack: List[str] = []
+        self._depth = 0
+        self._in_object = False
+        self._name = ""
+        self._local = ""
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        a = {k.lower(): (v or "") for k, v in attrs}
+        if tag == "ul":
+            self._depth += 1
+        elif tag == "object" and a.get("type", "").lower() == "text/sitemap":
+            self._in_object, self._name, self._local = True, "", ""
+        elif tag == "param" and self._in_object:
+            key = a.get("name", "").lower()
+            if key == "name" and not self._name:
+                self._name = a.get("value", "").strip()
+            elif key == "local" and not self._local:
+                self._local = a.get("value", "").strip()
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "ul":
+            self._depth = max(0, self._depth - 1)
+            del self._stack[self._depth:]
+        elif tag == "object" and self._in_object:
+            self._in_object = False
+            level = max(0, self._depth - 1)
+            del self._stack[level:]
+            self._stack.append(self._name)
+            if self._local:
+                self.topics.append((list(self._stack), self._local))
 
-    if not content:
-        return ""
 
-    if isinstance(content, (bytes, bytearray)):
+def chm_topics(chm_path: str) -> List[Tuple[List[str], str]]:
+    """列出 CHM 的主题 `(标题路径, 内部路径)`：按目录树顺序，同一页面只取第一次出现；
+    没有目录树时为全部 HTML 文件，标题路径为文件路径各段"""
+    chm = _open_chm(chm_path)
+    try:
+        tree = chm.GetTopicsTree()
+        parser = _TopicsTreeParser()
+        if tree:
+            parser.feed(_decode_html(tree))
+            parser.close()
+        topics: List[Tuple[List[str], str]] = []
+        seen = set()
+        for titles, local in parser.topics:
+            path = "/" + local.split("#", 1)[0].lstrip("/")
+            if path != "/" and path not in seen:
+                seen.add(path)
+                topics.append((titles, path))
+        if not topics:
+            topics = [([p for p in path.strip("/").split("/") if p], path) for path in _chm_html_paths(chm)]
+        return topics
+    finally:
+        chm.CloseCHM()
+
+
+def _decode_html(raw: bytes) -> str:
+    """按页面声明的字符集解码 HTML，未声明或解码失败时依次尝试 UTF-8 与 latin-1"""
+    if isinstance(raw, str):
+        return raw
+    m = re.search(rb"charset\s*=\s*[\"']?([A-Za-z0-9_\-]+)", raw[:2048], re.IGNORECASE)
+    encodings = ([m.group(1).decode("ascii")] if m else []) + ["utf-8"]
+    for enc in encodings:
         try:
-            html_str = content.decode("utf-8")
+            return raw.decode(enc)
         except Exception:
-            html_str = content.decode("latin-1", errors="replace")
-    else:
-        html_str = str(content)
+            continue
+    return raw.decode("latin-1", errors="replace")
+
 
+def _html_to_text(html_str: str) -> str:
+    """提取 HTML 的可读文本：去除脚本/样式/注释，块级元素之间换行"""
     try:
         from bs4 import BeautifulSoup  # type: ignore
         soup = BeautifulSoup(html_str, "html.parser")
-        text = soup.get_text(" ", strip=True)
-        return text
+        for tag in soup(["script", "style"]):
+            tag.decompose()
+        return soup.get_text("\n", strip=True)
     except Exception:
         # bs4 不可用时，回退为简单的正则去标签（仍不使用系统命令）
         text = re.sub(r"(?is)<script.*?>.*?</script>", "", html_str)
         text = re.sub(r"(?is)<style.*?>.*?</style>", "", text)
         text = re.sub(r"(?is)<!--.*?-->", "", text)
+        text = re.sub(r"(?is)<(br|/p|/div|/h\d|/li|/tr|/title)\b[^>]*>", "\n", text)
         text = re.sub(r"(?is)<[^>]+>", " ", text)
         text = html.unescape(text)
-        text = re.sub(r"\s+", " ", text).strip()
-        return text
+        lines = [re.sub(r"[ \t\r\f\v]+", " ", ln).strip() for ln in text.split("\n")]
+        return "\n".join(ln for ln in lines if ln)
+
+
+def _chm_topic_texts(raws: List[Optional[bytes]]) -> List[str]:
+    """（工作进程）把一批主题页面解析为文本"""
+    return [_html_to_text(_decode_html(raw)) if raw else "" for raw in raws]
+
+
+def iter_chm_topics(
+    chm_path: str,
+    workers: Optional[int] = None,
+    topics_per_task: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> Iterator[Tuple[List[str], str, str]]:
+    """按目录顺序流式产出 CHM 主题 `(标题路径, 内部路径, 文本)`
+
+    - 主进程顺序读取页面原文，HTML 解析按 `topics_per_task`（`KB_CHM_TOPICS_PER_TASK`，默认 32）个主题一批
+      交给进程池（`KB_CHM_WORKERS`，默认 min(4, CPU 数)；为 1 时单进程），见 `_parse_topics`
+    """
+    topics = chm_topics(chm_path)
+    chm = _open_chm(chm_path)
+    try:
+        yield from _parse_topics(topics, lambda path: _chm_read(chm, path), workers, topics_per_task, progress)
+    finally:
+        chm.CloseCHM()
+
+
+def _parse_topics(
+    topics: List[Tuple[List[str], str]],
+    read_raw: Callable[[str], Optional[bytes]],
+    workers: Optional[int] = None,
+    topics_per_task: Optional[int] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> Iterator[Tuple[List[str], str, str]]:
+    """以 `read_raw(内部路径)` 顺序读取主题原文，分批交给进程池解析为文本，按原顺序产出
 
-def ingest_pdf(kb_controller, kb_id: int, pdf_path: str, chunk_size: int = 500, overlap: int = 100, use_llm_headings: Optional[bool] = None):
+    - 最多 `2 × workers` 批在途，消费方处理慢时读取随之暂停；`progress` 按已解析主题数报告 extract 阶段
+    """
+    workers = int(workers or os.getenv("KB_CHM_WORKERS", str(min(4, os.cpu_count() or 1))))
+    per_task = max(1, int(topics_per_task or os.getenv("KB_CHM_TOPICS_PER_TASK", "32")))
+    batches = [topics[k:k + per_task] for k in range(0, len(topics), per_task)]
+    total = len(topics)
+    done = 0
+    _report(progress, "extract", 0, total)
+
+    def _raws(batch: List[Tuple[List[str], str]]) -> List[Optional[bytes]]:
+        return [read_raw(path) for _, path in batch]
+
+    if workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            texts = _chm_topic_texts(_raws(batch))
+            done += len(batch)
+            _report(progress, "extract", done, total)
+            for (titles, path), text in zip(batch, texts):
+                yield titles, path, text
+        return
+
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(batches)), mp_context=multiprocessing.get_context("spawn"))
+    in_flight: deque = deque()
+    try:
+        pending = iter(batches)
+        for batch in pending:
+            in_flight.append((batch, pool.submit(_chm_topic_texts, _raws(batch))))
+            if len(in_flight) >= 2 * workers:
+                break
+        while in_flight:
+            batch, fut = in_flight.popleft()
+            texts = fut.result()
+            nxt = next(pending, None)
+            if nxt is not None:
+                in_flight.append((nxt, pool.submit(_chm_topic_texts, _raws(nxt))))
+            done += len(batch)
+            _report(progress, "extract", done, total)
+            for (titles, path), text in zip(batch, texts):
+                yield titles, path, text
+    finally:
+        for _, fut in in_flight:
+            fut.cancel()
+        pool.shutdown(wait=True)
+
+
+def read_chm_text(chm_path: str) -> str:
+    """读取 CHM 文件为纯文本（使用 pychm + beautifulsoup4；无系统命令回退）。
+
+    - 依赖：`pychm`（解析 CHM），`beautifulsoup4`（解析 HTML，未安装时回退为正则去标签）
+    - 若未安装 pychm，会抛出明确的错误提示以指导安装
+    - 按目录顺序拼接各主题的可读文本，主题之间空一行；按主题入库见 `ingest_chm`
+    """
+    return "\n\n".join(text for _, _, text in iter_chm_topics(chm_path, workers=1) if text)
+
+
+def _chm_topic_chunks(
+    topics: Iterable[Tuple[List[str], str, str]], chunk_size: int, overlap: int
+) -> Iterator[Dict[str, Any]]:
+    """每个主题单独定长切分，片段以标题路径开头，元数据带标题路径与主题在 CHM 内的路径"""
+    splitter = NormalSplitter(chunk_size=chunk_size, overlap=overlap)
+    for titles, path, text in topics:
+        if not text.strip():
+            continue
+        parts = splitter.split(text)
+        heading = " > ".join(titles)
+        for idx, part in enumerate(parts, start=1):
+            yield {
+                "content": f"{heading}\n{part['content']}" if heading else part["content"],
+                "metadata": {
+                    "number": "",
+                    "title": titles[-1] if titles else "",
+                    "path": list(titles),
+                    "type": "chm_topic",
+                    "topic": path,
+                    "part_index": idx,
+                    "part_count": len(parts),
+                },
+            }
+
+
+def ingest_chm(
+    kb_controller,
+    kb_id: int,
+    chm_path: str,
+    chunk_size: int = 500,
+    overlap: int = 100,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    incremental: Optional[bool] = None,
+):
+    """解析 CHM 并更新已存在文件的片段信息，不再创建文件记录
+
+    - 每个主题（目录树中的页面）单独按 `chunk_size` / `overlap` 切分，片段元数据 `path` 为主题的标题路径
+    - 主题按目录顺序并行解析（见 `iter_chm_topics`），逐批进入嵌入与写入，不拼接整本文本
+    - `progress`、`incremental` 同 `ingest_pdf`；返回更新后的文件元信息对象（FileInfo）
+    """
+    filename = chm_path.split("/")[-1].split("\\")[-1]
+    record = kb_controller._file_by_name(kb_id, filename)
+    if record is None:
+        raise RuntimeError(f"文件未在知识库中登记：{filename}")
+    file_id = int(record.get("id"))
+    key = _ingest_key(kb_controller, record, chm_path, {"splitter": "chm", "chunk_size": chunk_size, "overlap": overlap})
+    reused = _reuse_derived(kb_controller, kb_id, file_id, filename, key, progress, incremental)
+    if reused is not None:
+        return reused
+    chunks = _chm_topic_chunks(iter_chm_topics(chm_path, progress=progress), chunk_size, overlap)
+    info = _save_file_chunks(kb_controller, kb_id, file_id, filename, _count_split(chunks, progress), progress, incremental)
+    _record_derived(kb_controller, kb_id, file_id, key)
+    return info
+
+
+def ingest_pdf(
+    kb_controller,
+    kb_id: int,
+    pdf_path: str,
+    chunk_size: int = 500,
+    overlap: int = 100,
+    use_llm_headings: Optional[bool] = None,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    incremental: Optional[bool] = None,
+):
     """解析 PDF 并更新已存在文件的片段信息，不再创建文件记录
 
     - `kb_controller`：持久化知识库控制器实例
     - `kb_id`：知识库ID
     - `pdf_path`：PDF文件路径
     - `chunk_size` 与 `overlap`：回退分割参数
-    - 返回：更新后的文件元信息对象（FileInfo）
+    - 章节片段超过 `KB_SECTION_MAX_CHARS` 个字符（默认 4000，0 为不限制）时按段落/句子边界再切分
+    - `progress`：可选进度回调 `(stage, done, total)`，阶段为 extract/split/embed/index；
+      流式处理中 split/embed/index 的总量未知，以 0 表示，结束时报告最终数量
+    - `incremental`：增量入库，只嵌入新增或改动的片段（默认读取 `KB_INCREMENTAL_INGEST`，见 `ChunkSink`）
+    - 返回：更新后的文件元信息对象（FileInfo），`stats` 为新增/保留/删除的片段数
+
+    流水线逐级拉取：页窗口 → 文本行 → 拆分片段 → 嵌入批次 → 存储写入，峰值内存由页窗口与嵌入批次大小决定。
+    未识别到目录与编号标题时回退为定长拆分，与整本读取后再拆分的结果一致。
     """
     filename = pdf_path.split("/")[-1].split("\\")[-1]
-    meta = kb_controller._load_files(kb_id)
-    files = meta.get("files", [])
-    record = None
-    for f in files:
-        if str(f.get("filename")) == filename:
-            record = f
-            break
+    record = kb_controller._file_by_name(kb_id, filename)
     if record is None:
         raise RuntimeError(f"文件未在知识库中登记：{filename}")
     file_id = int(record.get("id"))
 
     assets_dir = os.path.join(kb_controller._kb_dir(kb_id), "assets", "images", str(file_id))
-    text = read_pdf_markdown_with_images(pdf_path, assets_dir)
     use_llm = (
         bool(str(os.getenv("INGEST_USE_LLM_HEADING", "")).lower() in {"1", "true", "yes"})
         if use_llm_headings is None else bool(use_llm_headings)
     )
-    adaptive_chunks = AdaptiveSplitter(use_llm=use_llm).split(text)
-    if adaptive_chunks and adaptive_chunks[0].get("metadata", {}).get("number") == "" and adaptive_chunks[0].get("metadata", {}).get("type") == "toc":
-        chunks = adaptive_chunks
-    else:
-        if adaptive_chunks and adaptive_chunks[0].get("metadata", {}).get("number"):
-            chunks = adaptive_chunks
-        else:
-            chunks = NormalSplitter(chunk_size=chunk_size, overlap=overlap).split(text)
-    record["chunk_count"] = len(chunks)
-    record["status"] = "done"
-    kb_controller._save_files(kb_id, meta)
-    kb_controller.save_chunks(kb_id, file_id=file_id, chunks=chunks)
-    return FileInfo(id=file_id, filename=filename, chunk_count=len(chunks), status="done")
+    images = pdf_images_mode()
+    max_section_chars = int(os.getenv("KB_SECTION_MAX_CHARS", "4000"))
+    key = _ingest_key(kb_controller, record, pdf_path, {
+        "splitter": "adaptive", "chunk_size": chunk_size, "overlap": overlap, "use_llm": use_llm, "images": images,
+        "max_section_chars": max_section_chars,
+    })
+    reused = _reuse_derived(kb_controller, kb_id, file_id, filename, key, progress, incremental)
+    if reused is not None:
+        return reused
+    pieces = iter_pdf_markdown(pdf_path, assets_dir, progress=progress, images=images)
+    pending: set = set()
+    if images == "deferred":
+        pieces = _collect_image_pages(pieces, filename, pending)
+    lines = iter_text_lines(pieces)
+    chunks = AdaptiveSplitter(use_llm=use_llm, max_section_chars=max_section_chars).iter_split(
+        lines, fallback=NormalSplitter(chunk_size=chunk_size, overlap=overlap)
+    )
+    info = _save_file_chunks(kb_controller, kb_id, file_id, filename, _count_split(chunks, progress), progress, incremental)
+    kb_controller._update_file(kb_id, file_id, images_pending=sorted(pending) or None)
+    _record_derived(kb_controller, kb_id, file_id, key)
+    return info
+
+
+def _collect_image_pages(pieces: Iterable[str], filename: str, pages: set) -> Iterator[str]:
+    """透传页窗口文本，同时记下引用了图片的页码（页窗口边界即页边界，引用不会跨窗口）"""
+    for text in pieces:
+        pages.update(image_ref_pages(text, filename))
+        yield text
+
+
+def render_file_images(
+    kb_controller,
+    kb_id: int,
+    pdf_path: str,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+) -> Dict[str, int]:
+    """渲染某个已入库 PDF 延后提取的图片（文件记录中的 `images_pending` 页），完成后清除该标记
+
+    - 返回 `{"images": 引用数, "files": 去重后的文件数}`，同时写入文件记录的 `images`
+    """
+    filename = pdf_path.split("/")[-1].split("\\")[-1]
+    record = kb_controller._file_by_name(kb_id, filename)
+    if record is None:
+        raise RuntimeError(f"文件未在知识库中登记：{filename}")
+    file_id = int(record.get("id"))
+    pages = [int(p) for p in (record.get("images_pending") or [])]
+    stats = {"images": 0, "files": 0}
+    if pages:
+        assets_dir = os.path.join(kb_controller._kb_dir(kb_id), "assets", "images", str(file_id))
+        stats = render_pdf_images(pdf_path, assets_dir, pages, progress=progress)
+    kb_controller._update_file(kb_id, file_id, images_pending=None, images=stats)
+    return stats
+
+
+def _ingest_key(kb_controller, record: Dict[str, Any], path: str, split_config: Dict[str, Any]) -> str:
+    """入库键：源文件内容（sha256）+ 拆分配置 + 嵌入配置，相同键的入库结果可以直接复用"""
+    payload = {
+        "blob": record.get("sha256") or file_sha256(path),
+        "split": split_config,
+        "embedder": embedder_fingerprint(kb_controller._embedder),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _reuse_enabled() -> bool:
+    return str(os.getenv("KB_REUSE_DERIVED", "1")).lower() not in {"0", "false", "no"}
+
+
+def _record_derived(kb_controller, kb_id: int, file_id: int, key: str) -> None:
+    kb_controller._update_file(kb_id, file_id, ingest_key=key)
+    kb_controller._derived.record(key, kb_id, file_id)
+
+
+def _reuse_derived(
+    kb_controller,
+    kb_id: int,
+    file_id: int,
+    filename: str,
+    key: str,
+    progress: Optional[Callable[[str, int, int], None]],
+    incremental: Optional[bool],
+) -> Optional[FileInfo]:
+    """已有同键的入库结果（任意知识库）时复制其片段、向量与图片，跳过解析、拆分与嵌入；没有时返回 None
+
+    - `KB_REUSE_DERIVED=0` 关闭复用
+    - 片段正文中指向源文件图片目录的路径改写为本文件的图片目录，图片以硬链接复制
+    """
+    if not _reuse_enabled():
+        return None
+    for skb, sfid in kb_controller._derived.candidates(key):
+        if (skb, sfid) == (int(kb_id), int(file_id)):
+            continue
+        if not os.path.isdir(kb_controller._kb_dir(skb)):
+            kb_controller._derived.forget(skb, sfid)
+            continue
+        src = kb_controller._files_snapshot(skb).by_id.get(int(sfid))
+        if not src or src.get("ingest_key") != key or src.get("status") != "done":
+            kb_controller._derived.forget(skb, sfid)
+            continue
+        src_assets = os.path.join(kb_controller._kb_dir(skb), "assets", "images", str(sfid))
+        dst_assets = os.path.join(kb_controller._kb_dir(kb_id), "assets", "images", str(file_id))
+        _report(progress, "extract", 0, 1)
+        if os.path.isdir(src_assets):
+            shutil.copytree(src_assets, dst_assets, copy_function=link_or_copy, dirs_exist_ok=True)
+        _report(progress, "extract", 1, 1)
+        chunks = _copied_chunks(kb_controller, skb, sfid, src_assets, dst_assets)
+        info = _save_file_chunks(kb_controller, kb_id, file_id, filename, _count_split(chunks, progress), progress, incremental)
+        if src.get("sheets") is not None:
+            kb_controller._update_file(kb_id, file_id, sheets=src["sheets"])
+            info.sheets = src["sheets"]
+        # 源文件延后提取的图片尚未渲染时，本文件同样待渲染
+        kb_controller._update_file(kb_id, file_id, images_pending=src.get("images_pending"))
+        _record_derived(kb_controller, kb_id, file_id, key)
+        return info
+    return None
+
+
+def _copied_chunks(kb_controller, kb_id: int, file_id: int, src_assets: str, dst_assets: str, batch: int = 256) -> Iterator[Dict[str, Any]]:
+    """逐条读出某个文件的片段并附上其向量与句子向量，供 `ChunkSink` 直接写入"""
+    rows, embs = kb_controller._vstore.file_vector_rows(kb_id, file_id)
+    sentences = sentence_vectors_enabled()
+    buf: List[Dict[str, Any]] = []
+
+    def _emit() -> Iterator[Dict[str, Any]]:
+        sent = kb_controller._vstore.load_sentence_vectors(
+            kb_id, [(file_id, int(r["chunk_index"])) for r in buf]
+        ) if sentences else {}
+        for r in buf:
+            idx = int(r["chunk_index"])
+            content = r.get("content", "")
+            if src_assets != dst_assets:
+                content = content.replace(src_assets, dst_assets)
+            c: Dict[str, Any] = {"content": content, "metadata": r.get("metadata")}
+            row = rows.get(idx)
+            if row is not None:
+                c["embedding"] = np.asarray(embs[row], dtype=float)
+                c["sentence_vectors"] = sent.get((int(file_id), idx))
+            yield c
+        buf.clear()
+
+    for r in kb_controller._store.iter_file_chunks(kb_id, file_id):
+        buf.append(r)
+        if len(buf) >= batch:
+            yield from _emit()
+    if buf:
+        yield from _emit()
+
+
+def _save_file_chunks(
+    kb_controller,
+    kb_id: int,
+    file_id: int,
+    filename: str,
+    chunks: Iterable[Any],
+    progress: Optional[Callable[[str, int, int], None]],
+    incremental: Optional[bool],
+) -> FileInfo:
+    """写入片段并把文件标记为已完成；`incremental` 为 None 时读取 `KB_INCREMENTAL_INGEST`（默认关闭）"""
+    if incremental is None:
+        incremental = str(os.getenv("KB_INCREMENTAL_INGEST", "")).lower() in {"1", "true", "yes"}
+    with kb_controller.open_chunk_sink(kb_id, file_id, progress=progress, incremental=incremental) as sink:
+        for c in chunks:
+            sink.add(c)
+    kb_controller._update_file(kb_id, file_id, chunk_count=sink.count, status="done")
+    return FileInfo(id=file_id, filename=filename, chunk_count=sink.count, status="done", stats=dict(sink.stats))
+
+
+def _count_split(chunks: Iterable[Dict[str, Any]], progress: Optional[Callable[[str, int, int], None]]) -> Iterator[Dict[str, Any]]:
+    """透传拆分结果并报告 split 阶段进度"""
+    n = 0
+    _report(progress, "split", 0, 0)
+    for c in chunks:
+        n += 1
+        _report(progress, "split", n, 0)
+        yield c
+    _report(progress, "split", n, n)
 
 
 def ingest_excel(
     kb_controller,
     kb_id: int,
     excel_path: str,
-    max_rows_per_sheet: int = 5000,
+    max_rows_per_sheet: Optional[int] = None,
     max_cols: int = 50,
     use_llm_summary: Optional[bool] = None,
     max_rows_per_chunk: int = 80,
     max_chars_per_chunk: int = 8000,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    incremental: Optional[bool] = None,
 ):
     """解析 Excel 并更新已存在文件的片段信息，不再创建文件记录
 
     - 拆分结构：表格名称（Excel 文件名） + Sheet 名称 + Sheet 内容（Markdown 表格）
     - 可选：基于“表格名称 + Sheet 名称 + 表头字段”调用 LLM 生成摘要并放在片段开头
-    - 返回：更新后的文件元信息对象（FileInfo）
+    - `progress`：可选进度回调 `(stage, done, total)`，阶段为 extract/split/embed/index
+    - `max_rows_per_sheet`：每个工作表最多读取的非空行数，默认不限
+    - `incremental`：增量入库，同 `ingest_pdf`
+    - 返回：更新后的文件元信息对象（FileInfo），`sheets` 为各工作表的行数与列数（同时写入文件记录）
+
+    逐个工作表流式读取单元格行，直接渲染并切分为表格片段后写入（见 `iter_excel_sheets`），
+    片段与嵌入按批落盘，峰值内存与表格行数无关。
     """
-    text = read_excel_text(
-        excel_path,
-        max_rows_per_sheet=max_rows_per_sheet,
-        max_cols=max_cols,
-    )
+    filename = excel_path.split("/")[-1].split("\\")[-1]
+    record = kb_controller._file_by_name(kb_id, filename)
+    if record is None:
+        raise RuntimeError(f"文件未在知识库中登记：{filename}")
+    file_id = int(record.get("id"))
+    table_name = os.path.splitext(filename)[0]
     use_llm = (
         bool(str(os.getenv("INGEST_USE_LLM_TABLE_SUMMARY", "")).lower() in {"1", "true", "yes"})
         if use_llm_summary is None else bool(use_llm_summary)
     )
-    filename = excel_path.split("/")[-1].split("\\")[-1]
-    table_name = os.path.splitext(filename)[0]
-
-    chunks = TableSplitter(
+    key = _ingest_key(kb_controller, record, excel_path, {
+        "splitter": "table", "max_rows_per_sheet": max_rows_per_sheet, "max_cols": max_cols, "use_llm": use_llm,
+        "max_rows_per_chunk": max_rows_per_chunk, "max_chars_per_chunk": max_chars_per_chunk,
+    })
+    reused = _reuse_derived(kb_controller, kb_id, file_id, filename, key, progress, incremental)
+    if reused is not None:
+        return reused
+    sheet_stats: List[Dict[str, Any]] = []
+    sheets = iter_excel_sheets(
+        excel_path, max_rows_per_sheet=max_rows_per_sheet, max_cols=max_cols, progress=progress, sheet_stats=sheet_stats
+    )
+    splitter = TableSplitter(
         table_name=table_name,
         use_llm_summary=use_llm,
         max_rows_per_chunk=max_rows_per_chunk,
         max_chars_per_chunk=max_chars_per_chunk,
-    ).split(text)
-    if not chunks:
-        chunks = [{
+    )
+    if use_llm:
+        # 先只读各表表头，所有工作表的摘要并发请求，与逐表的读取、切分与嵌入重叠
+        splitter.prefetch_summaries(excel_sheet_headers(excel_path, max_cols=max_cols))
+    chunks = splitter.iter_split_sheets(sheets)
+    chunks = _count_split(_or_empty_table(chunks, table_name), progress)
+    info = _save_file_chunks(kb_controller, kb_id, file_id, filename, chunks, progress, incremental)
+    kb_controller._update_file(kb_id, file_id, sheets=sheet_stats)
+    info.sheets = sheet_stats
+    _record_derived(kb_controller, kb_id, file_id, key)
+    return info
+
+
+def _or_empty_table(chunks: Iterable[Dict[str, Any]], table_name: str) -> Iterator[Dict[str, Any]]:
+    """透传表格片段；一个片段都没有时产出占位片段，保证文件可被检索到"""
+    empty = True
+    for c in chunks:
+        empty = False
+        yield c
+    if empty:
+        yield {
             "content": f"[Table] {table_name}\n[ExcelEmpty] 未读取到任何非空表格数据",
             "metadata": {"type": "table", "table_name": table_name, "sheet_name": "", "part_index": 1, "part_count": 1, "header": []},
-        }]
-
-    meta = kb_controller._load_files(kb_id)
-    files = meta.get("files", [])
-    record = None
-    for f in files:
-        if str(f.get("filename")) == filename:
-            record = f
-            break
-    if record is None:
-        raise RuntimeError(f"文件未在知识库中登记：{filename}")
-    file_id = int(record.get("id"))
-    record["chunk_count"] = len(chunks)
-    record["status"] = "done"
-    kb_controller._save_files(kb_id, meta)
-    kb_controller.save_chunks(kb_id, file_id=file_id, chunks=chunks)
-    return FileInfo(id=file_id, filename=filename, chunk_count=len(chunks), status="done")
+        }
+
+
+def ingest_file(
+    kb_controller,
+    kb_id: int,
+    path: str,
+    progress: Optional[Callable[[str, int, int], None]] = None,
+    incremental: Optional[bool] = None,
+):
+    """按扩展名分派到对应的入库流程（PDF / Excel / CHM），不支持的类型抛出 `ValueError`"""
+    lower = path.lower()
+    if lower.endswith(".pdf"):
+        return ingest_pdf(kb_controller, kb_id, path, progress=progress, incremental=incremental)
+    if lower.endswith(".xlsx"):
+        return ingest_excel(kb_controller, kb_id, path, progress=progress, incremental=incremental)
+    if lower.endswith(".chm"):
+        return ingest_chm(kb_controller, kb_id, path, progress=progress, incremental=incremental)
+    raise ValueError("仅支持 PDF、Excel(xlsx) 或 CHM")
@@ -0,0 +1,421 @@
+from typing import List, Dict, Any, Optional, Callable
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("extract", "split", "embed", "index")
+
+ProgressCallback = Callable[[str, int, int], None]
+
+
+class JobCancelled(Exception):
+    """入库任务在执行过程中被取消"""
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kb_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    options TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_kb ON jobs(kb_id, created_at);
+"""
+
+
+class IngestJobStore:
+    """基于 SQLite 的持久化入库任务队列
+
+    - 状态：`queued` → `running` → `done` / `failed` / `cancelled`
+    - `progress` 以 JSON 保存各阶段 `{"done": n, "total": m}`，阶段见 `STAGES`
+    - 服务重启后，遗留的 `running` 任务由 `recover` 重新置为 `queued`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # 旧版本队列库没有 options 列
+            cols = {r["name"] for r in conn.execute("PRAGMA table_info(jobs)")}
+            if "options" not in cols:
+                conn.execute("ALTER TABLE jobs ADD COLUMN options TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "kb_id": int(row["kb_id"]),
+            "filename": row["filename"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "progress": json.loads(row["progress"] or "{}"),
+            "error": row["error"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "options": json.loads(row["options"]) if row["options"] else {},
+            "cancel_requested": bool(row["cancel_requested"]),
+            "created_at": float(row["created_at"]),
+            "started_at": float(row["started_at"]) if row["started_at"] is not None else None,
+            "finished_at": float(row["finished_at"]) if row["finished_at"] is not None else None,
+        }
+
+    def enqueue(self, kb_id: int, filename: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """提交任务；`options` 为传给入库流程的参数（如 `{"incremental": true}`）
+
+        - 同一文件已有同类（`options.task`）排队中或运行中的任务时不再新建，直接返回该任务，
+          避免两个工作进程同时写同一文件的片段与向量
+        """
+        options = options or {}
+        task = options.get("task")
+        job_id = uuid.uuid4().hex
+        progress = {s: {"done": 0, "total": 0} for s in STAGES}
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, options FROM jobs WHERE kb_id = ? AND filename = ? AND status IN ('queued', 'running') "
+                    "ORDER BY created_at",
+                    (int(kb_id), str(filename)),
+                ).fetchall()
+                active = next((r["id"] for r in rows if json.loads(r["options"] or "{}").get("task") == task), None)
+                if active is None:
+                    conn.execute(
+                        "INSERT INTO jobs(id, kb_id, filename, status, progress, options, created_at) VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                        (job_id, int(kb_id), str(filename), json.dumps(progress), json.dumps(options), time.time()),
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(active or job_id)  # type: ignore[return-value]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (str(job_id),)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list(self, kb_id: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            if kb_id is None:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (int(limit),)).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM jobs WHERE kb_id = ? ORDER BY created_at DESC LIMIT ?", (int(kb_id), int(limit))
+                ).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def claim_next(self) -> Optional[Dict[str, Any]]:
+        """原子地取出最早的排队任务并置为 `running`"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row["id"])
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return self.get(row["id"])
+
+    def requeue(self, job_id: str) -> None:
+        """把已领取但未能交给工作进程执行的任务放回队列（保留提交时间，下次优先领取）"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE id = ? AND status = 'running'", (str(job_id),)
+            )
+
+    def update_progress(self, job_id: str, stage: str, done: int, total: int) -> None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT progress FROM jobs WHERE id = ?", (str(job_id),)).fetchone()
+            if row is None:
+                return
+            progress = json.loads(row["progress"] or "{}")
+            progress[stage] = {"done": int(done), "total": int(total)}
+            conn.execute(
+                "UPDATE jobs SET stage = ?, progress = ? WHERE id = ?", (stage, json.dumps(progress), str(job_id))
+            )
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None, result: Optional[Dict[str, Any]] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, result = ?, finished_at = ? WHERE id = ?",
+                (status, error, json.dumps(result, ensure_ascii=False) if result is not None else None, time.time(), str(job_id)),
+            )
+
+    def request_cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """排队中的任务直接取消；运行中的任务打上取消标记，由执行方在下一个进度点停止"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), str(job_id)),
+            )
+            conn.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (str(job_id),)
+            )
+        return self.get(job_id)
+
+    def is_cancel_requested(self, job_id: str) -> bool:
+        with self._connect() as conn:
+            row = conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (str(job_id),)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def recover(self) -> int:
+        """将上次进程退出时遗留的 `running` 任务重新排队，返回数量"""
+        with self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running' AND cancel_requested = 0"
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'running' AND cancel_requested = 1",
+                (time.time(),),
+            )
+        return int(cur.rowcount or 0)
+
+
+class JobProgress:
+    """任务进度回调：节流写入进度并检查取消标记，被取消时抛出 `JobCancelled`
+
+    - `total` 为 0 表示总量未知（流式入库时各阶段交替推进），此时只按间隔节流
+    """
+
+    def __init__(self, store: IngestJobStore, job_id: str, min_interval: float = 0.5):
+        self.store = store
+        self.job_id = job_id
+        self.min_interval = float(min_interval)
+        self._last_write: Dict[str, float] = {}
+        self._last_cancel_check = 0.0
+
+    def __call__(self, stage: str, done: int, total: int) -> None:
+        now = time.monotonic()
+        # 阶段开始与结束必定写入，中间进度按间隔节流
+        finished = total > 0 and done >= total
+        if done <= 0 or finished or now - self._last_write.get(stage, 0.0) >= self.min_interval:
+            self.store.update_progress(self.job_id, stage, done, total)
+            self._last_write[stage] = now
+        if now - self._last_cancel_check >= self.min_interval or finished:
+            self._last_cancel_check = now
+            if self.store.is_cancel_requested(self.job_id):
+                raise JobCancelled(self.job_id)
+
+
+def default_queue_path(base_dir: str) -> str:
+    """任务队列数据库位置：`KB_INGEST_QUEUE_PATH`，默认与知识库根目录同级的 `ingest_jobs.sqlite`"""
+    return os.getenv("KB_INGEST_QUEUE_PATH") or os.path.join(os.path.dirname(os.path.abspath(base_dir)), "ingest_jobs.sqlite")
+
+
+_WORKER_CONTROLLERS: Dict[str, Any] = {}
+
+
+def enqueue_image_job(store: IngestJobStore, ctrl: Any, kb_id: int, filename: str) -> Optional[Dict[str, Any]]:
+    """文件有延后提取的图片（`KB_PDF_IMAGES=deferred`）时提交后台图片任务，否则返回 None"""
+    record = ctrl._file_by_name(kb_id, filename)
+    if not record or not record.get("images_pending"):
+        return None
+    return store.enqueue(kb_id, filename, options={"task": "images"})
+
+
+def run_ingest_job(base_dir: str, queue_path: str, job_id: str) -> Dict[str, Any]:
+    """在工作进程中执行单个入库任务，并维护文件状态 `running` / `done` / `failed`
+
+    - 被取消时文件状态恢复为 `uploaded`，可重新提交
+    - 入库完成后如有延后提取的图片，提交 `{"task": "images"}` 任务；该任务只渲染图片，不改变文件状态
+    - 返回最终任务状态，供调度方记录
+    """
+    from .ingestion import ingest_file, render_file_images
+    from .knowledge_base import PersistentKnowledgeBaseController
+
+    store = IngestJobStore(queue_path)
+    job = store.get(job_id)
+    if job is None:
+        return {"id": job_id, "status": "failed"}
+    ctrl = _WORKER_CONTROLLERS.get(base_dir)
+    if ctrl is None:
+        ctrl = PersistentKnowledgeBaseController(base_dir=base_dir)
+        _WORKER_CONTROLLERS[base_dir] = ctrl
+
+    kb_id = int(job["kb_id"])
+    src_path = os.path.join(ctrl._kb_dir(kb_id), "uploads", job["filename"])
+    if job["options"].get("task") == "images":
+        # 后台图片阶段：不改变文件状态，片段已可检索
+        try:
+            stats = render_file_images(ctrl, kb_id, src_path, progress=JobProgress(store, job_id))
+        except JobCancelled:
+            store.finish(job_id, "cancelled")
+            return {"id": job_id, "status": "cancelled"}
+        except Exception as e:
+            store.finish(job_id, "failed", error=str(e))
+            return {"id": job_id, "status": "failed"}
+        store.finish(job_id, "done", result=stats)
+        return {"id": job_id, "status": "done"}
+
+    record = ctrl._file_by_name(kb_id, job["filename"])
+    fid = int(record["id"]) if record else None
+    if fid is not None:
+        ctrl._update_file(kb_id, fid, status="running")
+    try:
+        if not os.path.exists(src_path):
+            raise FileNotFoundError("文件不存在，请先上传")
+        info = ingest_file(
+            ctrl, kb_id, src_path, progress=JobProgress(store, job_id), incremental=job["options"].get("incremental")
+        )
+    except JobCancelled:
+        if fid is not None:
+            ctrl._update_file(kb_id, fid, status="uploaded")
+        store.finish(job_id, "cancelled")
+        return {"id": job_id, "status": "cancelled"}
+    except Exception as e:
+        if fid is not None:
+            ctrl._update_file(kb_id, fid, status="failed")
+        store.finish(job_id, "failed", error=str(e))
+        return {"id": job_id, "status": "failed"}
+    result = {"file_id": int(info.id), "chunk_count": int(info.chunk_count)}
+    if info.stats is not None:
+        result["stats"] = info.stats
+    if info.sheets is not None:
+        result["sheets"] = info.sheets
+    enqueue_image_job(store, ctrl, kb_id, job["filename"])
+    store.finish(job_id, "done", result=result)
+    return {"id": job_id, "status": "done"}
+
+
+class IngestionWorkerPool:
+    """入库任务调度器：后台线程从持久化队列取任务，交给进程池执行
+
+    - 工作进程数由 `KB_INGEST_WORKERS` 控制（默认 2）
+    - 使用 spawn 启动工作进程，避免在已有线程的服务进程中 fork
+    - `wake()` 在提交新任务后立即唤醒调度线程，否则按 `poll_interval` 轮询（也可接收其他进程提交的任务）
+    """
+
+    def __init__(self, base_dir: str, queue_path: Optional[str] = None, workers: Optional[int] = None, poll_interval: float = 1.0):
+        self.base_dir = base_dir
+        self.queue_path = queue_path or default_queue_path(base_dir)
+        self.workers = max(1, int(workers or os.getenv("KB_INGEST_WORKERS", "2")))
+        self.poll_interval = float(poll_interval)
+        self.store = IngestJobStore(self.queue_path)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.store.recover()
+        self._executor = self._new_executor()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="ingest-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _rebuild_executor(self) -> None:
+        """进程池损坏（工作进程被杀死等）后换用新的进程池；旧池中的任务由 `_on_done` 记为失败"""
+        old = self._executor
+        self._executor = self._new_executor()
+        if old is not None:
+            old.shutdown(wait=False, cancel_futures=True)
+
+    def _on_done(self, job_id: str, fut: Future) -> None:
+        with self._lock:
+            self._in_flight.pop(job_id, None)
+        if fut.cancelled():
+            # 进程池关闭或重建时尚未开始执行的任务被取消，`fut.exception()` 此时会抛出 CancelledError
+            status, error = "cancelled", "调度器停止，任务未执行"
+        else:
+            exc = fut.exception()
+            # 工作进程异常退出（如被系统杀死），任务本身未能记录结果
+            status, error = ("failed", f"工作进程异常退出: {exc}") if exc is not None else (None, None)
+        if status is not None:
+            job = self.store.get(job_id)
+            if job and job["status"] == "running":
+                self.store.finish(job_id, status, error=error)
+        self._wake.set()
+
+    def _dispatch_once(self) -> bool:
+        """领取一个任务交给进程池，返回是否提交成功；提交失败时任务放回队列，进程池损坏时重建"""
+        with self._lock:
+            free = self.workers - len(self._in_flight)
+        if free <= 0 or self._executor is None:
+            return False
+        job = self.store.claim_next()
+        if job is None:
+            return False
+        try:
+            fut = self._executor.submit(run_ingest_job, self.base_dir, self.queue_path, job["id"])
+        except Exception as e:
+            self.store.requeue(job["id"])
+            if not isinstance(e, BrokenProcessPool):
+                raise
+            logger.warning("入库进程池已损坏，重建后重试任务 %s", job["id"])
+            self._rebuild_executor()
+            return False
+        with self._lock:
+            self._in_flight[job["id"]] = fut
+        fut.add_done_callback(lambda f, jid=job["id"]: self._on_done(jid, f))
+        return True
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                submitted = self._dispatch_once()
+            except Exception:
+                # 队列库暂时不可用等：调度线程不退出，等待后重试
+                logger.exception("入库任务调度失败")
+                submitted = False
+            if not submitted:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
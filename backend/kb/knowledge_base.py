@@ -1,17 +1,30 @@
 from dataclasses import dataclass
-from typing import List, Dict, Tuple, Any, Optional
+from typing import List, Dict, Tuple, Any, Optional, Callable, Iterable
 import numpy as np
-from .embeddings import get_default_embedder
-from .rerank import get_default_reranker, Reranker
-from .vector_store import LocalVectorStore
+from .embeddings import EMBEDDING_UNAVAILABLE_ERRORS, get_default_embedder, get_query_embedder
+from .rerank import get_default_reranker, Reranker, split_sentences, sentence_vectors_enabled
+from .vector_store import LocalVectorStore, RowSpool
+from .chunk_store import ChunkStore, FilesMetaCache, FilesSnapshot, get_chunk_store
+from .blob_store import BlobStore, DerivedIndex
+from .jobs import JobCancelled
 from .types import FileMeta
-import json
+from collections import deque
+import hashlib
 import os
 import re
 import heapq
+import logging
 import shutil
 
 
+logger = logging.getLogger(__name__)
+
+
+def _content_hash(content: str) -> str:
+    """片段正文的内容哈希，用于增量入库时与上一版本对齐"""
+    return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+
 @dataclass
 class FileChunk:
     """文件片段数据结构"""
@@ -31,22 +44,41 @@ class FileInfo:
     filename: str
     chunk_count: int
     status: str = "done"
+    stats: Optional[Dict[str, int]] = None
+    sheets: Optional[List[Dict[str, Any]]] = None
 
 
 class PersistentKnowledgeBaseController:
     """持久化知识库控制器：基于文件系统存储文件与片段
 
     - 根目录结构：`data/kb/{kb_id}/`
-      - `files.json`：文件列表与元信息
-      - `chunks/{file_id}.json`：对应文件的片段内容数组
+      - 默认（JSON 后端）：`files.json` 文件列表与元信息，`chunks/{file_id}.jsonl` 片段记录及其偏移索引
+      - SQLite 后端（`KB_STORAGE_BACKEND=sqlite`）：`kb.sqlite` 单库保存文件、片段与全文索引
+      - `vector_store/`：向量索引
+    - `data/kb/_blobs/`：按 sha256 内容寻址的上传文件与派生产物登记表（跨知识库共享）
     """
 
-    def __init__(self, base_dir: str = "data/kb", embedder: Optional[Any] = None):
-        """初始化控制器并确保基础目录存在"""
+    def __init__(
+        self,
+        base_dir: str = "data/kb",
+        embedder: Optional[Any] = None,
+        store: Optional[ChunkStore] = None,
+        query_embedder: Optional[Any] = None,
+    ):
+        """初始化控制器并确保基础目录存在
+
+        - `embedder` 用于入库；`query_embedder` 用于检索查询，默认为独立熔断、短超时的 `get_query_embedder()`，
+          仅传入 `embedder` 时两者共用
+        """
         self.base_dir = base_dir
         os.makedirs(self.base_dir, exist_ok=True)
         self._embedder = embedder or get_default_embedder()
+        self._query_embedder = query_embedder or (embedder if embedder is not None else get_query_embedder())
         self._vstore = LocalVectorStore(base_dir=self.base_dir)
+        self._store = store or get_chunk_store(self.base_dir)
+        self._files_cache = FilesMetaCache(self._store)
+        self._blobs = BlobStore(os.path.join(self.base_dir, "_blobs"))
+        self._derived = DerivedIndex(os.path.join(self.base_dir, "_blobs", "derived.sqlite"))
 
     def _kb_dir(self, kb_id: int) -> str:
         """获取指定知识库的根目录路径"""
@@ -62,155 +94,125 @@ class PersistentKnowledgeBaseController:
 
     def _ensure_kb(self, kb_id: int) -> None:
         """确保知识库目录与必要文件存在"""
-        kb_dir = self._kb_dir(kb_id)
-        chunks_dir = self._chunks_dir(kb_id)
-        os.makedirs(chunks_dir, exist_ok=True)
-        files_path = self._files_path(kb_id)
-        if not os.path.exists(files_path):
-            with open(files_path, "w", encoding="utf-8") as f:
-                json.dump({"files": [], "next_id": 1}, f, ensure_ascii=False, indent=2)
+        os.makedirs(self._kb_dir(kb_id), exist_ok=True)
+        self._store.ensure_kb(kb_id)
 
     def createKnowledgeBase(self, kb_id: int) -> None:
         """创建或重置一个知识库的基础目录与索引"""
         os.makedirs(self._kb_dir(kb_id), exist_ok=True)
-        self._ensure_kb(kb_id)
-        with open(self._files_path(kb_id), "w", encoding="utf-8") as f:
-            json.dump({"files": [], "next_id": 1}, f, ensure_ascii=False, indent=2)
+        with self._store.files_lock(kb_id):
+            self._store.reset_kb(kb_id)
+            self._files_cache.invalidate(kb_id)
         self._vstore.clear(kb_id)
 
     def deleteKnowledgeBase(self, kb_id: int) -> None:
         """删除整个知识库目录，包括文件索引、片段与向量存储"""
         shutil.rmtree(self._kb_dir(kb_id), ignore_errors=True)
+        self._files_cache.invalidate(kb_id)
+        self._derived.forget(kb_id)
 
-    def _load_files(self, kb_id: int) -> Dict:
-        """加载文件列表与下一个可用ID"""
+    def _files_snapshot(self, kb_id: int) -> FilesSnapshot:
+        """获取文件元信息的缓存快照（只读），过期时自动重新加载"""
         self._ensure_kb(kb_id)
-        with open(self._files_path(kb_id), "r", encoding="utf-8") as f:
-            return json.load(f)
+        return self._files_cache.get(kb_id)
+
+    def _load_files(self, kb_id: int) -> Dict:
+        """加载文件列表与下一个可用ID（返回可修改的副本）"""
+        data = self._files_snapshot(kb_id).data
+        return {**data, "files": [dict(f) for f in data.get("files", []) or []]}
 
     def _save_files(self, kb_id: int, data: Dict) -> None:
-        """保存文件列表与下一个可用ID"""
-        with open(self._files_path(kb_id), "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        """保存文件列表与下一个可用ID，并写穿元信息缓存"""
+        self._store.save_files(kb_id, data)
+        self._files_cache.put(kb_id, {**data, "files": [dict(f) for f in data.get("files", []) or []]})
+
+    def _file_by_name(self, kb_id: int, filename: str) -> Optional[Dict[str, Any]]:
+        """按文件名查找文件记录（返回副本），不存在时返回 None"""
+        rec = self._files_snapshot(kb_id).by_name.get(str(filename))
+        return dict(rec) if rec is not None else None
+
+    def _update_file(self, kb_id: int, file_id: int, **fields: Any) -> bool:
+        """更新指定文件记录的字段并保存，文件不存在时返回 False；读-改-写在 `files_lock` 内完成"""
+        self._ensure_kb(kb_id)
+        with self._store.files_lock(kb_id):
+            meta = self._load_files(kb_id)
+            for f in meta.get("files", []):
+                if int(f["id"]) == int(file_id):
+                    f.update(fields)
+                    self._save_files(kb_id, meta)
+                    return True
+        return False
+
+    def _chunks_mtime(self, kb_id: int, file_id: int) -> Optional[float]:
+        """返回文件片段的最后写入时间（秒），尚未写入时返回 None"""
+        return self._store.chunks_mtime(kb_id, file_id)
 
     def add_file(self, kb_id: int, filename: str, chunk_count: int, status: str = "done") -> FileInfo:
         """新增文件元信息并返回创建后的 `FileInfo`"""
-        meta = self._load_files(kb_id)
-        file_id = meta.get("next_id", 1)
-        info = FileInfo(id=file_id, filename=filename, chunk_count=chunk_count, status=status)
-        meta["files"].append(FileMeta(id=info.id, filename=info.filename, chunk_count=info.chunk_count, status=info.status).to_dict())
-        meta["next_id"] = file_id + 1
-        self._save_files(kb_id, meta)
+        self._ensure_kb(kb_id)
+        with self._store.files_lock(kb_id):
+            meta = self._load_files(kb_id)
+            file_id = meta.get("next_id", 1)
+            info = FileInfo(id=file_id, filename=filename, chunk_count=chunk_count, status=status)
+            meta["files"].append(FileMeta(id=info.id, filename=info.filename, chunk_count=info.chunk_count, status=info.status).to_dict())
+            meta["next_id"] = file_id + 1
+            self._save_files(kb_id, meta)
         return info
 
     def deleteFile(self, kb_id: int, file_id: int) -> bool:
         """删除指定文件的元信息、片段与其向量索引"""
-        meta = self._load_files(kb_id)
-        files = meta.get("files", [])
-        new_files = [f for f in files if int(f.get("id")) != int(file_id)]
-        if len(new_files) == len(files):
+        self._ensure_kb(kb_id)
+        with self._store.files_lock(kb_id):
+            deleted = self._store.delete_file(kb_id, int(file_id))
+            self._files_cache.invalidate(kb_id)
+        if not deleted:
             return False
-        meta["files"] = new_files
-        self._save_files(kb_id, meta)
-        chunk_path = os.path.join(self._chunks_dir(kb_id), f"{int(file_id)}.json")
-        if os.path.exists(chunk_path):
-            os.remove(chunk_path)
         self._vstore.delete_items(kb_id, {"file_id": int(file_id)})
+        self._vstore.delete_sentence_vectors(kb_id, int(file_id))
+        self._derived.forget(kb_id, int(file_id))
         return True
 
-    def save_chunks(self, kb_id: int, file_id: int, chunks: List[Any]) -> None:
-        """将片段内容持久化到 `chunks/{file_id}.json`
-
-        - 支持字符串片段或包含 `content` 与可选 `metadata` 的字典
+    def save_chunks(
+        self,
+        kb_id: int,
+        file_id: int,
+        chunks: Iterable[Any],
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        embed_batch_size: Optional[int] = None,
+        incremental: bool = False,
+    ) -> int:
+        """将片段内容持久化到存储后端（默认 `chunks/{file_id}.jsonl`），返回片段数
+
+        - 支持字符串片段或包含 `content` 与可选 `metadata` 的字典；`chunks` 可以是生成器
+        - 嵌入按 `KB_EMBED_BATCH`（默认 64）分批生成，`progress` 回调报告 embed/index 阶段进度
+        - `incremental=True` 时只嵌入新增或改动的片段，见 `ChunkSink`
         """
+        sink = self.open_chunk_sink(kb_id, file_id, progress=progress, embed_batch_size=embed_batch_size, incremental=incremental)
+        with sink:
+            for c in chunks:
+                sink.add(c)
+        return sink.count
+
+    def open_chunk_sink(
+        self,
+        kb_id: int,
+        file_id: int,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        embed_batch_size: Optional[int] = None,
+        incremental: bool = False,
+    ) -> "ChunkSink":
+        """打开某个文件的流式片段写入器，见 `ChunkSink`"""
         self._ensure_kb(kb_id)
-        path = os.path.join(self._chunks_dir(kb_id), f"{file_id}.json")
-        texts: List[str] = []
-        normalized: List[Dict[str, Any]] = []
-        vitems: List[Dict[str, Any]] = []
-        non_empty_indices: List[int] = []
-        for i, c in enumerate(chunks):
-            if isinstance(c, str):
-                normalized.append({"file_id": file_id, "chunk_index": i, "content": c})
-                texts.append(c)
-                if c.strip():
-                    non_empty_indices.append(i)
-                vitems.append({
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "filename": self._filename_of(kb_id, file_id),
-                    "metadata": None,
-                    "preview": (c[:200] + "...") if len(c) > 200 else c,
-                })
-            elif isinstance(c, dict):
-                content = c.get("content", "")
-                normalized.append({
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "content": content,
-                    "metadata": c.get("metadata"),
-                })
-                texts.append(content)
-                if content.strip():
-                    non_empty_indices.append(i)
-                vitems.append({
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "filename": self._filename_of(kb_id, file_id),
-                    "metadata": c.get("metadata"),
-                    "preview": (content[:200] + "...") if len(content) > 200 else content,
-                })
-            else:
-                s = str(c)
-                normalized.append({"file_id": file_id, "chunk_index": i, "content": s})
-                texts.append(s)
-                if s.strip():
-                    non_empty_indices.append(i)
-                vitems.append({
-                    "file_id": file_id,
-                    "chunk_index": i,
-                    "filename": self._filename_of(kb_id, file_id),
-                    "metadata": None,
-                    "preview": (s[:200] + "...") if len(s) > 200 else s,
-                })
-        try:
-            if non_empty_indices:
-                # 仅对非空文本进行嵌入，避免服务端拒绝空字符串导致失败
-                to_embed = [normalized[i]["content"] for i in non_empty_indices]
-                embs = self._embedder.embed_texts(to_embed)
-                for k, i in enumerate(non_empty_indices):
-                    normalized[i]["embedding"] = embs[k].tolist()
-                    vitems[i]["embedding"] = embs[k].tolist()
-        except Exception:
-            # 失败时跳过嵌入，不影响片段持久化
-            pass
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(normalized, f, ensure_ascii=False, indent=2)
-        try:
-            # 仅追加有嵌入的条目，避免全部因嵌入失败而不写入向量库
-            vitems_embedded = [vi for vi in vitems if "embedding" in vi]
-            if vitems_embedded:
-                # 先删除旧的向量数据，支持重新解析
-                self._vstore.delete_items(kb_id, {"file_id": int(file_id)})
-                self._vstore.add_items(kb_id, vitems_embedded)
-        except Exception:
-            pass
+        return ChunkSink(self, kb_id, file_id, progress=progress, embed_batch_size=embed_batch_size, incremental=incremental)
 
     def _filename_of(self, kb_id: int, file_id: int) -> str:
         """根据文件ID获取文件名"""
-        meta = self._load_files(kb_id)
-        for f in meta.get("files", []):
-            if int(f["id"]) == int(file_id):
-                return f["filename"]
-        return ""
+        rec = self._files_snapshot(kb_id).by_id.get(int(file_id))
+        return rec["filename"] if rec else ""
 
     def _load_file_chunks(self, kb_id: int, file_id: int) -> List[FileChunk]:
         """加载某个文件的全部片段为 `FileChunk` 列表"""
-        path = os.path.join(self._chunks_dir(kb_id), f"{file_id}.json")
-        if not os.path.exists(path):
-            return []
-        with open(path, "r", encoding="utf-8") as f:
-            raw = json.load(f)
+        raw = self._store.read_chunks(kb_id, file_id)
         out: List[FileChunk] = []
         for r in raw:
             out.append(FileChunk(
@@ -250,94 +252,95 @@ class PersistentKnowledgeBaseController:
         if not tokens:
             return []
 
-        meta = self._load_files(kb_id)
-        name_map = {int(f["id"]): f["filename"] for f in meta.get("files", [])}
-        chunks_dir = self._chunks_dir(kb_id)
-        if not os.path.exists(chunks_dir):
-            return []
+        by_id = self._files_snapshot(kb_id).by_id
 
         exclude_set: set[Tuple[int, int]] = exclude or set()
-        heap: List[Tuple[float, int, int, Dict[str, Any]]] = []
-        counter = 0
+        heap: List[Tuple[float, int, int, int, Dict[str, Any]]] = []
 
         q_lower = q.lower()
         token_lowers = [t.lower() for t in tokens]
         is_ascii = [bool(re.fullmatch(r"[A-Za-z0-9_]+", t)) for t in tokens]
 
-        for fname in os.listdir(chunks_dir):
-            if not fname.endswith(".json"):
-                continue
-            fpath = os.path.join(chunks_dir, fname)
+        # 后端支持全文索引时只扫描预筛候选，否则全量扫描全部片段
+        rows = self._store.keyword_candidates(kb_id, tokens)
+        if rows is None:
+            rows = self._store.iter_chunks(kb_id)
+        for r in rows:
             try:
-                with open(fpath, "r", encoding="utf-8") as f:
-                    raw = json.load(f) or []
+                fid = int(r.get("file_id"))
+                idx = int(r.get("chunk_index"))
             except Exception:
                 continue
-            for r in raw:
-                try:
-                    fid = int(r.get("file_id"))
-                    idx = int(r.get("chunk_index"))
-                except Exception:
-                    continue
-                if (fid, idx) in exclude_set:
-                    continue
-                content = str(r.get("content", "") or "")
-                if not content.strip():
-                    continue
-                content_lower = content.lower()
-
-                score = 0.0
-                for i, t in enumerate(tokens):
-                    if is_ascii[i]:
-                        c = content_lower.count(token_lowers[i])
-                    else:
-                        c = content.count(t)
-                    score += float(min(c, 3))
-                if q_lower and q_lower in content_lower:
-                    score += 5.0
-                if score <= 0:
-                    continue
-
-                preview = (content[:200] + "...") if len(content) > 200 else content
-                item = {
-                    "file_id": fid,
-                    "chunk_index": idx,
-                    "filename": name_map.get(fid, "unknown"),
-                    "score": score,
-                    "preview": preview,
-                    "metadata": r.get("metadata"),
-                }
+            if (fid, idx) in exclude_set:
+                continue
+            content = str(r.get("content", "") or "")
+            if not content.strip():
+                continue
+            content_lower = content.lower()
 
-                counter += 1
-                key = (score, -len(content), counter, item)
-                if len(heap) < int(top_k):
-                    heapq.heappush(heap, key)
+            score = 0.0
+            for i, t in enumerate(tokens):
+                if is_ascii[i]:
+                    c = content_lower.count(token_lowers[i])
                 else:
-                    if key > heap[0]:
-                        heapq.heapreplace(heap, key)
+                    c = content.count(t)
+                score += float(min(c, 3))
+            if q_lower and q_lower in content_lower:
+                score += 5.0
+            if score <= 0:
+                continue
 
-        heap.sort(reverse=True)
-        return [it for _, __, ___, it in heap]
+            preview = (content[:200] + "...") if len(content) > 200 else content
+            item = {
+                "file_id": fid,
+                "chunk_index": idx,
+                "filename": by_id[fid]["filename"] if fid in by_id else "unknown",
+                "score": score,
+                "preview": preview,
+                "metadata": r.get("metadata"),
+            }
+
+            # 同分同长时按 (file_id, chunk_index) 较小者优先，结果与存储后端的遍历顺序无关
+            key = (score, -len(content), -fid, -idx, item)
+            if len(heap) < int(top_k):
+                heapq.heappush(heap, key)
+            else:
+                if key > heap[0]:
+                    heapq.heapreplace(heap, key)
+
+        heap.sort(key=lambda k: k[:4], reverse=True)
+        return [k[4] for k in heap]
 
     def search(self, kb_id: int, query: str) -> List[Dict]:
         """混合召回：语义检索 5 条 + 关键词检索 5 条，合并后 rerank 输出 8 条。
 
-        - Reranker 通过 `get_default_reranker()` 选择：Noop 或 CrossEncoder。
+        - Reranker 通过 `get_default_reranker()` 选择：Noop 或（级联包装的）CrossEncoder。
         - 使用 provider 模式统一封装，便于扩展与替换实现。
+        - 嵌入服务不可用（熔断打开、网络错误或超时、响应异常）时记录原因并退化为纯关键词检索（10 条）；
+          查询嵌入使用独立的熔断器与短超时，不受入库批次失败影响
         """
         q = (query or "").strip()
         if not q:
             return []
-        q_vec = self._embedder.embed_text(q)
+        try:
+            q_vec: Optional[np.ndarray] = self._query_embedder.embed_text(q)
+        except EMBEDDING_UNAVAILABLE_ERRORS as e:
+            logger.warning("查询嵌入不可用，退化为关键词检索：%s: %s", type(e).__name__, e)
+            q_vec = None
 
         reranker: Reranker = get_default_reranker()
-        semantic = self._vstore.query_embeddings(kb_id, q_vec, top_k=5)
-        seen_pairs = {(int(r["file_id"]), int(r["chunk_index"])) for r in semantic}
-        keyword = self._keyword_search(kb_id, q, top_k=5, exclude=seen_pairs)
-
+        if q_vec is not None:
+            semantic = self._vstore.query_embeddings(kb_id, q_vec, top_k=5)
+            seen_pairs = {(int(r["file_id"]), int(r["chunk_index"])) for r in semantic}
+            keyword = self._keyword_search(kb_id, q, top_k=5, exclude=seen_pairs)
+        else:
+            semantic = []
+            keyword = self._keyword_search(kb_id, q, top_k=10)
+
+        # 标注召回来源，供级联重排区分可比的语义分数与关键词分数
         combined: List[Dict[str, Any]] = []
-        combined.extend(semantic)
-        combined.extend(keyword)
+        combined.extend(dict(r, source="semantic") for r in semantic)
+        combined.extend(dict(r, source="keyword") for r in keyword)
         if not combined:
             return []
 
@@ -353,14 +356,22 @@ class PersistentKnowledgeBaseController:
         def _load_content(fid: int, idx: int) -> str:
             return content_map.get((fid, idx), "")
 
-        return reranker.rerank(q, combined, _load_content, top_k=8)
+        # 句子向量旁路仅在存在时按需内存映射读取
+        vec_map: Dict[tuple[int, int], np.ndarray] = {}
+        if q_vec is not None and sentence_vectors_enabled():
+            vec_map = self._vstore.load_sentence_vectors(kb_id, list(content_map.keys()))
+
+        def _load_vectors(fid: int, idx: int) -> Optional[np.ndarray]:
+            return vec_map.get((fid, idx))
+
+        return reranker.rerank(q, combined, _load_content, top_k=8, query_vec=q_vec, load_vectors=_load_vectors)
 
     def getFilesMeta(self, kb_id: int, file_ids: List[int]) -> List[Dict]:
         """根据文件ID数组返回对应的元信息"""
-        meta = self._load_files(kb_id)
+        snap = self._files_snapshot(kb_id)
         idset = set(int(i) for i in (file_ids or []))
         res = []
-        for f in meta.get("files", []):
+        for f in snap.data.get("files", []):
             if int(f["id"]) in idset:
                 res.append(FileMeta(id=int(f["id"]), filename=f["filename"], chunk_count=int(f["chunk_count"]), status=f.get("status", "done")).to_dict())
         return res
@@ -389,28 +400,302 @@ class PersistentKnowledgeBaseController:
                 continue
             by_file.setdefault(fid, []).append(idx)
 
-        meta = self._load_files(kb_id)
-        name_map = {int(f["id"]): f["filename"] for f in meta.get("files", [])}
+        by_id = self._files_snapshot(kb_id).by_id
         for fid, indices in by_file.items():
-            chunks_all = self._load_file_chunks(kb_id, fid)
-            want = set(indices)
-            for ch in chunks_all:
-                if ch.chunk_index in want:
-                    item = {
-                        "file_id": fid,
-                        "chunk_index": ch.chunk_index,
-                        "content": ch.content,
-                        "filename": name_map.get(fid, "unknown"),
-                    }
-                    if ch.metadata:
-                        item["metadata"] = ch.metadata
-                    results.append(item)
+            for r in self._store.read_chunks(kb_id, fid, indices):
+                item = {
+                    "file_id": fid,
+                    "chunk_index": r.get("chunk_index"),
+                    "content": r.get("content", ""),
+                    "filename": by_id[fid]["filename"] if fid in by_id else "unknown",
+                }
+                if r.get("metadata"):
+                    item["metadata"] = r.get("metadata")
+                results.append(item)
         return results
 
     def listFilesPaginated(self, kb_id: int, page: int, page_size: int) -> List[Dict]:
         """分页列出文件元信息"""
-        meta = self._load_files(kb_id)
-        files = meta.get("files", [])
+        files = self._files_snapshot(kb_id).data.get("files", [])
         start = page * page_size
         end = start + page_size
         return [FileMeta(id=int(f["id"]), filename=f["filename"], chunk_count=int(f["chunk_count"]), status=f.get("status", "done")).to_dict() for f in files[start:end]]
+
+
+class ChunkSink:
+    """流式写入某个文件的片段：凑满一批即嵌入并落盘，内存中只保留当前批次
+
+    - 片段正文经存储后端的写入器（`ChunkStore.open_writer`）逐批写入，提交前读取方仍看到旧数据
+    - 向量与句子向量先追加到临时缓冲文件，`close` 时各以一次重写替换该文件的旧向量
+    - 嵌入失败时跳过剩余嵌入，不影响片段持久化；此时若没有任何向量，保留旧向量不动
+    - 作为上下文管理器使用时，块内抛出异常（包括 `JobCancelled`）会放弃本次写入，旧数据保持不变
+    - 增量模式（`incremental=True`）：按正文哈希与上一版本的片段对齐
+      - chunk_index 始终按文档顺序从 0 连续编号，与整体替换一致，`range(chunk_count)` 可读到全部片段
+      - 内容未变的片段沿用原向量行，只把其元信息改到新编号，不重新嵌入
+      - 新增或改动的片段嵌入后追加
+      - 上一版本中未匹配的片段在向量存储中标记墓碑
+      - `stats` 报告 `added` / `kept` / `removed` 片段数；整体替换时 `added` 为全部片段数，`removed` 为被替换的旧向量数
+    """
+
+    def __init__(
+        self,
+        controller: "PersistentKnowledgeBaseController",
+        kb_id: int,
+        file_id: int,
+        progress: Optional[Callable[[str, int, int], None]] = None,
+        embed_batch_size: Optional[int] = None,
+        incremental: bool = False,
+    ):
+        self._kb = controller
+        self.kb_id = kb_id
+        self.file_id = file_id
+        self.progress = progress
+        self.batch_size = int(embed_batch_size or os.getenv("KB_EMBED_BATCH", "64"))
+        rec = controller._files_snapshot(kb_id).by_id.get(int(file_id)) or {}
+        self.filename = rec.get("filename", "")
+        self.count = 0
+        self.embedded = 0
+        self.stats = {"added": 0, "kept": 0, "removed": 0}
+        self._pending: List[Dict[str, Any]] = []
+        self._pending_embed: List[bool] = []
+        self._pending_given: List[Optional[Tuple[Any, Any]]] = []
+        self._old: Dict[str, deque] = {}
+        self._old_rows: Dict[int, int] = {}
+        self._old_embs: Optional[np.ndarray] = None
+        self._updates: Dict[int, Dict[str, Any]] = {}
+        self._remap: Dict[int, int] = {}
+        self._stale: List[int] = []
+        self.incremental = bool(incremental) and self._load_previous()
+        self._embed_failed = False
+        self._sentences = sentence_vectors_enabled()
+        spool_dir = controller._store.kb_dir(kb_id)
+        os.makedirs(spool_dir, exist_ok=True)
+        self._writer = controller._store.open_writer(kb_id, file_id)
+        self._vectors = RowSpool(spool_dir)
+        self._vitems: List[Dict[str, Any]] = []
+        self._sent_vectors = RowSpool(spool_dir, dtype=np.float16) if self._sentences else None
+        self._sent_spans: List[Tuple[int, int, int]] = []
+        self._closed = False
+
+    def __enter__(self) -> "ChunkSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.abort()
+        elif not self._closed:
+            self.close()
+
+    def _load_previous(self) -> bool:
+        """读取上一版本的片段哈希与向量行；没有旧片段时返回 False（退化为整体替换）"""
+        n = 0
+        for r in self._kb._store.iter_file_chunks(self.kb_id, self.file_id):
+            idx = int(r["chunk_index"])
+            self._old.setdefault(_content_hash(r.get("content", "")), deque()).append(idx)
+            n += 1
+        if not n:
+            return False
+        self._old_rows, self._old_embs = self._kb._vstore.file_vector_rows(self.kb_id, self.file_id)
+        return True
+
+    def add(self, chunk: Any) -> None:
+        if isinstance(chunk, dict):
+            content = chunk.get("content", "")
+            rec = {"file_id": self.file_id, "chunk_index": self.count, "content": content, "metadata": chunk.get("metadata")}
+        else:
+            content = chunk if isinstance(chunk, str) else str(chunk)
+            rec = {"file_id": self.file_id, "chunk_index": self.count, "content": content}
+        # 仅对非空文本进行嵌入，避免服务端拒绝空字符串导致失败
+        embed = bool(content.strip())
+        given = None
+        if isinstance(chunk, dict) and chunk.get("embedding") is not None:
+            # 复制已有索引时片段自带向量（及可选的句子向量），不再嵌入
+            given = (chunk["embedding"], chunk.get("sentence_vectors"))
+            embed = False
+        if self.incremental:
+            same = self._old.get(_content_hash(content))
+            if same:
+                i = same.popleft()
+                row = self._old_rows.get(i)
+                if row is not None:
+                    rec["embedding"] = np.asarray(self._old_embs[row], dtype=float).tolist()
+                    self._updates[i] = self._vitem(rec)
+                    self._remap[i] = self.count
+                    embed = False
+                    given = None
+                else:
+                    # 旧版本没有向量：重新嵌入，旧编号的残留数据随删除一并清理
+                    self._stale.append(i)
+                self.stats["kept"] += 1
+            else:
+                self.stats["added"] += 1
+        if given is not None:
+            rec["embedding"] = np.asarray(given[0], dtype=float).tolist()
+        self._pending.append(rec)
+        self._pending_embed.append(embed)
+        self._pending_given.append(given)
+        self.count += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _vitem(self, r: Dict[str, Any]) -> Dict[str, Any]:
+        content = r["content"]
+        return {
+            "file_id": self.file_id,
+            "chunk_index": r["chunk_index"],
+            "filename": self.filename,
+            "metadata": r.get("metadata"),
+            "preview": (content[:200] + "...") if len(content) > 200 else content,
+        }
+
+    def _flush(self) -> None:
+        batch = self._pending
+        flags = self._pending_embed
+        given = self._pending_given
+        self._pending = []
+        self._pending_embed = []
+        self._pending_given = []
+        if not batch:
+            return
+        copied = [(r, g) for r, g in zip(batch, given) if g is not None]
+        if copied:
+            self._vectors.append(np.asarray([r["embedding"] for r, _ in copied], dtype=float))
+            self._vitems.extend(self._vitem(r) for r, _ in copied)
+            if self._sentences:
+                self._add_given_sentence_vectors(copied)
+        part = [r for r, e in zip(batch, flags) if e]
+        if part and not self._embed_failed:
+            try:
+                embs = np.asarray(self._kb._embedder.embed_texts([r["content"] for r in part]), dtype=float)
+                for k, r in enumerate(part):
+                    r["embedding"] = embs[k].tolist()
+                self._vectors.append(embs)
+                self._vitems.extend(self._vitem(r) for r in part)
+                self.embedded += len(part)
+            except JobCancelled:
+                raise
+            except Exception:
+                # 失败时跳过剩余嵌入，不影响片段持久化
+                self._embed_failed = True
+        if self.progress is not None:
+            self.progress("embed", self.embedded, 0)
+        if self._sentences and part:
+            self._add_sentence_vectors(part)
+        self._writer.write(batch)
+        if self.progress is not None:
+            self.progress("index", self._writer.count, 0)
+
+    def _add_sentence_vectors(self, part: List[Dict[str, Any]]) -> None:
+        """为片段生成句子向量旁路（late-interaction 重排使用），失败时不影响片段与主向量"""
+        try:
+            sents: List[str] = []
+            spans: List[Tuple[int, int, int]] = []
+            for r in part:
+                ss = split_sentences(r["content"])
+                spans.append((r["chunk_index"], len(sents), len(sents) + len(ss)))
+                sents.extend(ss)
+            if not sents:
+                return
+            vecs = np.vstack([self._kb._embedder.embed_texts(sents[k:k + 64]) for k in range(0, len(sents), 64)])
+            base, _ = self._sent_vectors.append(vecs)
+            self._sent_spans.extend((i, base + a, base + b) for i, a, b in spans if b > a)
+        except JobCancelled:
+            raise
+        except Exception:
+            self._sentences = False
+
+    def _add_given_sentence_vectors(self, copied: List[Tuple[Dict[str, Any], Tuple[Any, Any]]]) -> None:
+        for r, (_, sv) in copied:
+            if sv is not None and len(sv):
+                start, end = self._sent_vectors.append(np.asarray(sv, dtype=np.float16))
+                self._sent_spans.append((r["chunk_index"], start, end))
+
+    def close(self) -> int:
+        """写入剩余批次并提交，返回片段数"""
+        if self._closed:
+            return self.count
+        try:
+            self._flush()
+            self._writer.commit()
+            if self.progress is not None:
+                self.progress("embed", self.embedded, self.embedded)
+            if self.incremental:
+                self._close_incremental()
+            else:
+                self._close_replace()
+            if self.progress is not None:
+                self.progress("index", self.count, self.count)
+        finally:
+            self._closed = True
+            self._release()
+        return self.count
+
+    def _close_incremental(self) -> None:
+        removed = [i for q in self._old.values() for i in q]
+        self.stats["removed"] = len(removed)
+        removed += self._stale
+        self._old_embs = None
+        try:
+            self._kb._vstore.apply_file_delta(
+                self.kb_id, self.file_id, removed, self._vectors.array(), self._vitems, updates=self._updates
+            )
+        except Exception:
+            pass
+        if self._sent_vectors is not None:
+            try:
+                vecs = self._sent_vectors.array() if self._sentences else None
+                self._kb._vstore.apply_file_sentence_delta(
+                    self.kb_id, self.file_id, removed, vecs, self._sent_spans if vecs is not None else [],
+                    remap=self._remap,
+                )
+                del vecs
+            except Exception:
+                pass
+
+    def _close_replace(self) -> None:
+        self.stats["added"] = self.count
+        try:
+            # 仅写入有嵌入的条目；全部嵌入失败时保留旧向量
+            embeddings = self._vectors.array()
+            if embeddings is not None:
+                self.stats["removed"] = self._kb._vstore.replace_file_items(self.kb_id, self.file_id, embeddings, self._vitems)
+                del embeddings
+        except Exception:
+            pass
+        if self._sent_vectors is not None:
+            try:
+                if self._sentences:
+                    vecs = self._sent_vectors.array()
+                    if vecs is not None:
+                        self._kb._vstore.replace_file_sentence_vectors(self.kb_id, self.file_id, vecs, self._sent_spans)
+                        del vecs
+                    else:
+                        self._kb._vstore.delete_sentence_vectors(self.kb_id, int(self.file_id))
+                else:
+                    self._kb._vstore.delete_sentence_vectors(self.kb_id, int(self.file_id))
+            except Exception:
+                pass
+
+    def abort(self) -> None:
+        """放弃本次写入，已落盘的临时数据全部删除"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._writer.abort()
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        self._pending = []
+        self._pending_embed = []
+        self._pending_given = []
+        self._vitems = []
+        self._old = {}
+        self._old_embs = None
+        self._updates = {}
+        self._remap = {}
+        self._stale = []
+        self._vectors.close()
+        if self._sent_vectors is not None:
+            self._sent_vectors.close()
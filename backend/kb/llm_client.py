@@ -0,0 +1,193 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from types import SimpleNamespace
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+Messages = Sequence[Tuple[str, str]]
+
+
+class PromptCache:
+    """LLM 响应的持久化缓存：键为（模型标识 + 消息）的 sha256，值为响应文本
+
+    - 位置由 `KB_LLM_CACHE_PATH` 指定（默认 `data/kb/_llm_cache.sqlite`）
+    - 只缓存成功的调用；失败不写入，下次重新请求
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        return None if row is None else str(row[0])
+
+    def put(self, key: str, response: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache(key, response, created_at) VALUES (?, ?, ?)",
+                (key, str(response), time.time()),
+            )
+
+
+class StubLLM:
+    """本地桩 LLM，不访问网络，供测试与离线环境使用（`KB_LLM_BACKEND=stub`）
+
+    - `responder(messages) -> str` 决定响应内容；默认返回 `[stub] ` 加用户消息的前 80 个字符
+    - `calls` 记录实际调用次数
+    """
+
+    name = "stub"
+
+    def __init__(self, responder: Optional[Callable[[Messages], str]] = None):
+        self.responder = responder
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, messages: Messages) -> Any:
+        with self._lock:
+            self.calls += 1
+        if self.responder is not None:
+            content = self.responder(messages)
+        else:
+            user = next((text for role, text in reversed(list(messages)) if role == "user"), "")
+            content = f"[stub] {' '.join(str(user).split())[:80]}"
+        return SimpleNamespace(content=content)
+
+
+def _deepseek_llm() -> Optional[Any]:
+    """DeepSeek 对话模型（OpenAI 兼容接口）；未配置 `DEEPSEEK_API_KEY` 或缺少 langchain_openai 时返回 None"""
+    api_key = os.getenv("DEEPSEEK_API_KEY")
+    if not api_key:
+        return None
+    try:
+        from langchain_openai import ChatOpenAI  # 延迟导入，避免在冻结环境中不必要的依赖加载
+    except Exception:
+        return None
+    return ChatOpenAI(
+        temperature=0,
+        max_retries=2,
+        base_url="https://api.deepseek.com/v1",
+        model="deepseek-chat",
+        api_key=api_key,
+    )
+
+
+_LLM_FACTORIES: Dict[str, Callable[[], Optional[Any]]] = {}
+
+
+def register_llm(name: str, factory: Callable[[], Optional[Any]]) -> None:
+    """注册入库增强用 LLM 的工厂（返回带 `invoke(messages)` 的对象，不可用时返回 None），`KB_LLM_BACKEND` 按名称选择"""
+    _LLM_FACTORIES[str(name).strip().lower()] = factory
+
+
+register_llm("deepseek", _deepseek_llm)
+register_llm("stub", StubLLM)
+
+
+class LLMClient:
+    """入库增强（目录解析、表格摘要）共用的 LLM 客户端：并发上限 + 持久化缓存
+
+    - `complete` 同步调用，`submit` 交给内部线程池并返回 Future；同时进行的实际调用不超过 `max_concurrency`
+    - 命中缓存时不调用 LLM；LLM 不可用或调用失败时返回 None
+    - `model` 参与缓存键，切换模型后不会命中旧的响应
+    """
+
+    def __init__(
+        self,
+        llm: Optional[Any],
+        model: Optional[str] = None,
+        cache: Optional[PromptCache] = None,
+        max_concurrency: int = 4,
+    ):
+        self.llm = llm
+        self.model = str(model or getattr(llm, "name", None) or type(llm).__name__)
+        self.cache = cache
+        self.max_concurrency = max(1, int(max_concurrency))
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def cache_key(self, messages: Messages) -> str:
+        payload = {"model": self.model, "messages": [[str(r), str(t)] for r, t in messages]}
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def complete(self, messages: Messages) -> Optional[str]:
+        key = self.cache_key(messages)
+        if self.cache is not None:
+            hit = self.cache.get(key)
+            if hit is not None:
+                return hit
+        if self.llm is None:
+            return None
+        try:
+            with self._slots:
+                msg = self.llm.invoke(list(messages))
+        except Exception:
+            return None
+        content = str(getattr(msg, "content", "") or "")
+        if self.cache is not None:
+            self.cache.put(key, content)
+        return content
+
+    def submit(self, messages: Messages) -> "Future[Optional[str]]":
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="kb-llm")
+        return self._pool.submit(self.complete, list(messages))
+
+    def complete_many(self, batch: List[Messages]) -> List[Optional[str]]:
+        """并发完成一批请求，按输入顺序返回"""
+        return [f.result() for f in [self.submit(m) for m in batch]]
+
+
+_DEFAULT_CLIENT: Optional[LLMClient] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_default_llm_client() -> LLMClient:
+    """进程内共享的入库增强 LLM 客户端
+
+    - `KB_LLM_BACKEND`：已注册的 LLM 名称，默认 `deepseek`；`stub` 为本地桩
+    - `KB_LLM_CONCURRENCY`：同时进行的调用数上限（默认 4）
+    - `KB_LLM_CACHE`：为 0 时不使用持久化缓存；`KB_LLM_CACHE_PATH` 为缓存文件位置
+    """
+    global _DEFAULT_CLIENT
+    with _DEFAULT_LOCK:
+        if _DEFAULT_CLIENT is None:
+            backend = os.getenv("KB_LLM_BACKEND", "deepseek").strip().lower()
+            factory = _LLM_FACTORIES.get(backend)
+            llm = factory() if factory is not None else None
+            cache = None
+            if str(os.getenv("KB_LLM_CACHE", "1")).lower() not in {"0", "false", "no"}:
+                cache = PromptCache(os.getenv("KB_LLM_CACHE_PATH", os.path.join("data", "kb", "_llm_cache.sqlite")))
+            _DEFAULT_CLIENT = LLMClient(
+                llm, model=backend, cache=cache, max_concurrency=int(os.getenv("KB_LLM_CONCURRENCY", "4"))
+            )
+        return _DEFAULT_CLIENT
+
+
+def set_default_llm_client(client: Optional[LLMClient]) -> None:
+    """替换共享客户端（如测试中注入 `StubLLM`）；传入 None 时下次按环境变量重新创建"""
+    global _DEFAULT_CLIENT
+    with _DEFAULT_LOCK:
+        _DEFAULT_CLIENT = client
@@ -1,16 +1,231 @@
 from typing import List, Dict, Any, Callable, Optional
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import queue
 import os
+import re
+import threading
+import time
+import numpy as np
+
+
+# (file_id, chunk_index) -> 句子向量矩阵 (S, D)，不存在时返回 None
+VectorLoader = Callable[[int, int], Optional[np.ndarray]]
 
 
 def _truthy(s: Optional[str]) -> bool:
     return str(s or "").lower() in {"1", "true", "yes"}
 
 
+class RerankMetrics:
+    """重排模型的运行指标：模型加载耗时、逐批推理延迟与级联重排的决策计数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.model_name: str = ""
+        self.load_seconds: Optional[float] = None
+        self.warmed_up = False
+        self.batches = 0
+        self.pairs = 0
+        self.total_seconds = 0.0
+        self.last_ms = 0.0
+        self.max_ms = 0.0
+        self.decisions: Dict[str, int] = {}
+
+    def record_load(self, model_name: str, seconds: float) -> None:
+        with self._lock:
+            self.model_name = model_name
+            self.load_seconds = seconds
+
+    def record_warmup(self) -> None:
+        with self._lock:
+            self.warmed_up = True
+
+    def record_batch(self, n_pairs: int, seconds: float) -> None:
+        with self._lock:
+            self.batches += 1
+            self.pairs += int(n_pairs)
+            self.total_seconds += seconds
+            self.last_ms = seconds * 1000.0
+            self.max_ms = max(self.max_ms, self.last_ms)
+
+    def record_decision(self, decision: str) -> None:
+        with self._lock:
+            self.decisions[decision] = self.decisions.get(decision, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "load_seconds": self.load_seconds,
+                "warmed_up": self.warmed_up,
+                "batches": self.batches,
+                "pairs": self.pairs,
+                "avg_batch_ms": (self.total_seconds * 1000.0 / self.batches) if self.batches else 0.0,
+                "last_batch_ms": self.last_ms,
+                "max_batch_ms": self.max_ms,
+                "decisions": dict(self.decisions),
+            }
+
+
+RERANK_METRICS = RerankMetrics()
+
+
+class RerankScoreCache:
+    """重排分数的有界 LRU 缓存：键为 (模型名, 归一化查询, 片段内容哈希)，由 `make_key` 生成。
+
+    - 容量由 `KB_RERANK_CACHE_SIZE` 控制（默认 4096），为 0 时关闭缓存
+    - 键含模型名，更换模型后不会复用旧模型的分数
+    """
+
+    def __init__(self, max_size: Optional[int] = None):
+        self.max_size = int(max_size if max_size is not None else os.getenv("KB_RERANK_CACHE_SIZE", "4096"))
+        self._data: "OrderedDict[tuple[str, str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        return re.sub(r"\s+", " ", (query or "").strip().lower())
+
+    @staticmethod
+    def content_hash(content: str) -> str:
+        return hashlib.sha1((content or "").encode("utf-8")).hexdigest()
+
+    @classmethod
+    def make_key(cls, model_name: str, query: str, content: str) -> tuple[str, str, str]:
+        return (str(model_name), cls.normalize_query(query), cls.content_hash(content))
+
+    def get_many(self, keys: List[tuple[str, str, str]]) -> Dict[tuple[str, str, str], float]:
+        """批量查找，命中的键会移到 LRU 尾部"""
+        out: Dict[tuple[str, str, str], float] = {}
+        if self.max_size <= 0:
+            return out
+        with self._lock:
+            for k in keys:
+                v = self._data.get(k)
+                if v is None:
+                    self.misses += 1
+                    continue
+                self._data.move_to_end(k)
+                out[k] = v
+                self.hits += 1
+        return out
+
+    def put_many(self, items: Dict[tuple[str, str, str], float]) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            for k, v in items.items():
+                self._data[k] = float(v)
+                self._data.move_to_end(k)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"size": len(self._data), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class RerankBudgetExceeded(RuntimeError):
+    """重排超出单次请求的时间预算"""
+
+
+class RerankUnavailable(RuntimeError):
+    """重排模型不可用（加载或推理失败），未实际重排"""
+
+
+class RerankBatcher:
+    """跨请求微批：在几毫秒窗口内收集并发请求的 (query, passage) 对，合并为一个批次推理后按请求分发分数。
+
+    - `window_ms`：首个请求到达后等待凑批的时间窗口（`KB_RERANK_BATCH_WINDOW_MS`，默认 0 即不开启微批；
+      窗口会给每个请求增加至多 `window_ms` 的延迟，仅在并发较高时按需开启，如 4）
+    - `max_batch`：单批最多的 pair 数（`KB_RERANK_MAX_BATCH`，默认 64）；单个请求不会被拆开
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[List[tuple[str, str]]], List[float]],
+        window_ms: Optional[float] = None,
+        max_batch: Optional[int] = None,
+    ):
+        self._predict_fn = predict_fn
+        self.window_ms = float(window_ms if window_ms is not None else os.getenv("KB_RERANK_BATCH_WINDOW_MS", "0"))
+        self.max_batch = max(1, int(max_batch or os.getenv("KB_RERANK_MAX_BATCH", "64")))
+        self._queue: "queue.Queue[tuple[List[tuple[str, str]], Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, pairs: List[tuple[str, str]]) -> "Future[List[float]]":
+        """提交一组 pair，返回可等待其分数列表的 Future"""
+        fut: "Future[List[float]]" = Future()
+        if not pairs:
+            fut.set_result([])
+            return fut
+        self._ensure_worker()
+        self._queue.put((list(pairs), fut))
+        return fut
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _run(self) -> None:
+        pending: Optional[tuple[List[tuple[str, str]], Future]] = None
+        while True:
+            first = pending or self._queue.get()
+            pending = None
+            batch = [first]
+            size = len(first[0])
+            deadline = time.monotonic() + self.window_ms / 1000.0
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(nxt[0]) > self.max_batch:
+                    # 放不下的请求留给下一批，保证单请求不被拆分
+                    pending = nxt
+                    break
+                batch.append(nxt)
+                size += len(nxt[0])
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List[tuple[List[tuple[str, str]], Future]]) -> None:
+        live = [(p, f) for p, f in batch if f.set_running_or_notify_cancel()]
+        if not live:
+            return
+        flat: List[tuple[str, str]] = [pair for p, _ in live for pair in p]
+        try:
+            scores = self._predict_fn(flat)
+        except Exception as e:
+            for _, f in live:
+                f.set_exception(e)
+            return
+        pos = 0
+        for p, f in live:
+            f.set_result([float(x) for x in scores[pos:pos + len(p)]])
+            pos += len(p)
+
+
 class Reranker:
     """Reranker 接口：对初筛候选做二次排序。
 
     - `rerank(query, initial, load_content, top_k)` 返回重排后的前 `top_k` 结果。
     - `pre_k` 表示需要的预候选条数（向量检索阶段的 top_k）。
+    - `deadline`（`time.monotonic()` 时刻，可选）：超过时抛出 `RerankBudgetExceeded`。
+    - `query_vec` 与 `load_vectors(file_id, chunk_index)`（可选）：查询向量与片段句子向量加载器，
+      供基于向量的重排实现使用。
     """
 
     pre_k: int = 5
@@ -21,6 +236,9 @@ class Reranker:
         initial: List[Dict[str, Any]],
         load_content: Callable[[int, int], str],
         top_k: int = 5,
+        deadline: Optional[float] = None,
+        query_vec: Optional[np.ndarray] = None,
+        load_vectors: Optional[VectorLoader] = None,
     ) -> List[Dict[str, Any]]:
         return initial[:top_k]
 
@@ -30,33 +248,98 @@ class NoopReranker(Reranker):
 
     pre_k = 5
 
-    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5) -> List[Dict[str, Any]]:
+    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5, deadline: Optional[float] = None, query_vec: Optional[np.ndarray] = None, load_vectors: Optional[VectorLoader] = None) -> List[Dict[str, Any]]:
         return initial[:top_k]
 
 
 class CrossEncoderReranker(Reranker):
-    """基于 sentence-transformers CrossEncoder 的重排实现。"""
+    """基于 sentence-transformers CrossEncoder 的重排实现。
+
+    - 模型不可用时默认回退初始顺序；`fallback_on_error=False` 时改为抛出 `RerankUnavailable`，
+      由外层（如 `CascadeReranker`）记录回退决策
+    - 模型加载失败后 `KB_RERANK_RETRY_S` 秒（默认 60）内直接复用该错误，之后的调用重新尝试加载
+    """
 
-    def __init__(self, model_name: Optional[str] = None, pre_k: Optional[int] = None):
+    def __init__(self, model_name: Optional[str] = None, pre_k: Optional[int] = None, fallback_on_error: bool = True):
+        self.fallback_on_error = bool(fallback_on_error)
         self.model_name = model_name or os.getenv("KB_RERANK_MODEL", "dengcao/Qwen3-Reranker-8B:Q3_K_M")
         self.pre_k = int(pre_k or os.getenv("KB_RERANK_PRE_K", "20"))
         self._model = None
+        self._load_error: Optional[Exception] = None
+        self._load_failed_at = 0.0
+        self.retry_seconds = float(os.getenv("KB_RERANK_RETRY_S", "60"))
+        self._load_lock = threading.Lock()
+        self.score_cache = RerankScoreCache()
+        self._batcher: Optional[RerankBatcher] = None
+        # 跨请求微批需显式开启（见 `RerankBatcher`），默认逐请求直接推理
+        window = float(os.getenv("KB_RERANK_BATCH_WINDOW_MS", "0"))
+        if window > 0:
+            self._batcher = RerankBatcher(self._predict, window_ms=window)
 
     def _ensure_model(self):
-        if self._model is None:
-            from sentence_transformers import CrossEncoder  # type: ignore
-            self._model = CrossEncoder(self.model_name)
+        if self._model is not None:
+            return
+        with self._load_lock:
+            if self._load_error is not None:
+                # 加载失败后在退避时间内不再每次检索都重试加载
+                if time.monotonic() - self._load_failed_at < self.retry_seconds:
+                    raise self._load_error
+                self._load_error = None
+            if self._model is None:
+                try:
+                    from sentence_transformers import CrossEncoder  # type: ignore
+                    t0 = time.perf_counter()
+                    self._model = CrossEncoder(self.model_name)
+                except Exception as e:
+                    self._load_error = e
+                    self._load_failed_at = time.monotonic()
+                    raise
+                RERANK_METRICS.record_load(self.model_name, time.perf_counter() - t0)
+
+    def _predict(self, pairs: List[tuple[str, str]]) -> List[float]:
+        t0 = time.perf_counter()
+        # 整批作为一个填充批次推理，充分利用向量化
+        scores = self._model.predict(pairs, batch_size=max(1, len(pairs)))
+        RERANK_METRICS.record_batch(len(pairs), time.perf_counter() - t0)
+        return [float(s) for s in scores]
+
+    def _score(self, pairs: List[tuple[str, str]], keys: List[tuple[str, str, str]], deadline: Optional[float] = None) -> List[float]:
+        """对 pair 打分并写入分数缓存：开启微批时经由共享批处理器，否则直接推理
+
+        - 给定 `deadline` 时等待超时即抛出 `RerankBudgetExceeded`；已在推理中的批次完成后仍会写入缓存
+        """
+        if deadline is not None and time.monotonic() >= deadline:
+            raise RerankBudgetExceeded("重排时间预算已耗尽")
+        if self._batcher is None:
+            scores = self._predict(pairs)
+            self.score_cache.put_many(dict(zip(keys, scores)))
+            return scores
+        fut = self._batcher.submit(pairs)
 
-    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5) -> List[Dict[str, Any]]:
+        def _cache(f: "Future[List[float]]") -> None:
+            if not f.cancelled() and f.exception() is None:
+                self.score_cache.put_many(dict(zip(keys, f.result())))
+
+        fut.add_done_callback(_cache)
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            return fut.result(timeout=timeout)
+        except TimeoutError:
+            fut.cancel()
+            raise RerankBudgetExceeded("重排时间预算已耗尽")
+
+    def warmup(self) -> None:
+        """加载模型并用一个哑批次预热推理路径"""
+        self._ensure_model()
+        self._predict([("warmup query", "warmup passage")])
+        RERANK_METRICS.record_warmup()
+
+    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5, deadline: Optional[float] = None, query_vec: Optional[np.ndarray] = None, load_vectors: Optional[VectorLoader] = None) -> List[Dict[str, Any]]:
         if not initial:
             return []
-        try:
-            self._ensure_model()
-        except Exception:
-            # 模型不可用则直接回退初始结果
-            return initial[:top_k]
 
         pairs = []
+        keys: List[tuple[str, str, str]] = []
         keep_idx: List[int] = []
         for i, r in enumerate(initial):
             fid = int(r.get("file_id"))
@@ -65,30 +348,234 @@ class CrossEncoderReranker(Reranker):
             if not content:
                 continue
             pairs.append((query, content))
+            keys.append(self.score_cache.make_key(self.model_name, query, content))
             keep_idx.append(i)
         if not pairs:
             return initial[:top_k]
 
-        try:
-            scores = self._model.predict(pairs)
-        except Exception:
-            return initial[:top_k]
+        # 仅对缓存未命中的 (查询, 片段) 调用模型，再与缓存分数合并
+        cached = self.score_cache.get_many(keys)
+        miss = [k for k, key in enumerate(keys) if key not in cached]
+        if miss:
+            try:
+                self._ensure_model()
+                fresh = self._score([pairs[k] for k in miss], [keys[k] for k in miss], deadline)
+            except RerankBudgetExceeded:
+                raise
+            except Exception as e:
+                # 模型不可用则直接回退初始结果
+                if not self.fallback_on_error:
+                    raise RerankUnavailable(str(e)) from e
+                return initial[:top_k]
+            cached.update({keys[k]: fresh[j] for j, k in enumerate(miss)})
 
         ranked: List[Dict[str, Any]] = []
         for k, i in enumerate(keep_idx):
             item = dict(initial[i])
-            item["rerank_score"] = float(scores[k])
+            item["rerank_score"] = float(cached[keys[k]])
             ranked.append(item)
         ranked.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
         return ranked[:top_k]
 
 
+_SENTENCE_RE = re.compile(r"(?<=[\.\!\?。！？；;])\s+|\n{2,}|\n(?=\s*(?:[-*•]|\d+[\.\)]|\|))")
+
+
+def split_sentences(text: str, max_sentences: int = 16, min_chars: int = 24) -> List[str]:
+    """将片段切分为用于句子向量的短句：过短的句子并入前一句，最多保留 `max_sentences` 句"""
+    out: List[str] = []
+    for part in _SENTENCE_RE.split(text or ""):
+        p = re.sub(r"\s+", " ", part or "").strip()
+        if not p:
+            continue
+        if out and (len(p) < min_chars or len(out[-1]) < min_chars):
+            out[-1] = f"{out[-1]} {p}"
+        else:
+            out.append(p)
+    if len(out) > max_sentences:
+        # 超出部分并入最后一句，保证全文仍被覆盖
+        out = out[:max_sentences - 1] + [" ".join(out[max_sentences - 1:])]
+    return out
+
+
+class LateInteractionReranker(Reranker):
+    """轻量 late-interaction 重排：以查询向量与片段句子向量的最大余弦相似度（MaxSim）打分。
+
+    - 句子向量在入库时生成并存入向量库旁路（`sentences.npy`），查询时纯 NumPy 计算，无需加载模型
+    - 缺少句子向量的候选沿用其语义初筛分数；未提供查询向量时直接返回初筛顺序
+    """
+
+    def __init__(self, pre_k: Optional[int] = None):
+        self.pre_k = int(pre_k or os.getenv("KB_RERANK_PRE_K", "20"))
+
+    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5, deadline: Optional[float] = None, query_vec: Optional[np.ndarray] = None, load_vectors: Optional[VectorLoader] = None) -> List[Dict[str, Any]]:
+        if not initial:
+            return []
+        if query_vec is None or load_vectors is None:
+            return initial[:top_k]
+        q = np.asarray(query_vec, dtype=np.float32).reshape(-1)
+        qn = float(np.linalg.norm(q))
+        if qn == 0:
+            return initial[:top_k]
+        q = q / qn
+
+        ranked: List[Dict[str, Any]] = []
+        for r in initial:
+            item = dict(r)
+            vecs = load_vectors(int(r.get("file_id")), int(r.get("chunk_index")))
+            if vecs is not None and len(vecs) and vecs.shape[1] == q.shape[0]:
+                norms = np.linalg.norm(vecs, axis=1)
+                norms[norms == 0] = 1.0
+                item["rerank_score"] = float(np.max((vecs @ q) / norms))
+            elif r.get("source") == "semantic":
+                item["rerank_score"] = float(r.get("score", 0.0))
+            else:
+                item["rerank_score"] = -1.0
+            ranked.append(item)
+        ranked.sort(key=lambda x: x.get("rerank_score", 0.0), reverse=True)
+        return ranked[:top_k]
+
+
+class CascadeReranker(Reranker):
+    """级联重排策略：包装一个开销较大的 Reranker，按初筛分数决定是否/对哪些候选调用它。
+
+    - 语义 Top1 与 Top2 的分差 ≥ `gap`（`KB_CASCADE_GAP`，默认 0.15）时认为初筛已足够可信，跳过重排
+    - 否则只重排“模糊中段”：与 Top1 分差在 `gap` 以内的语义候选 + 关键词候选，最多 `band` 条（`KB_CASCADE_BAND`，默认 8），
+      其余候选保持初筛顺序接在其后
+    - 单次重排超过 `budget_ms`（`KB_RERANK_BUDGET_MS`，默认 1500，0 表示不限）时放弃并返回初筛顺序
+    - 内层抛出 `RerankUnavailable`（模型不可用）时返回初筛顺序，决策记为 `fallback`
+    - 实际采取的决策写入每条结果的 `rerank_decision`：`skipped_gap` / `band` / `full` / `budget_exceeded` / `fallback`，
+      并计入 `RERANK_METRICS` 的决策计数
+    """
+
+    def __init__(
+        self,
+        inner: Reranker,
+        gap: Optional[float] = None,
+        band: Optional[int] = None,
+        budget_ms: Optional[float] = None,
+    ):
+        self.inner = inner
+        self.pre_k = inner.pre_k
+        self.gap = float(gap if gap is not None else os.getenv("KB_CASCADE_GAP", "0.15"))
+        self.band = max(1, int(band or os.getenv("KB_CASCADE_BAND", "8")))
+        self.budget_ms = float(budget_ms if budget_ms is not None else os.getenv("KB_RERANK_BUDGET_MS", "1500"))
+
+    @staticmethod
+    def _tag(items: List[Dict[str, Any]], decision: str) -> List[Dict[str, Any]]:
+        RERANK_METRICS.record_decision(decision)
+        out: List[Dict[str, Any]] = []
+        for it in items:
+            item = dict(it)
+            item["rerank_decision"] = decision
+            out.append(item)
+        return out
+
+    def rerank(self, query: str, initial: List[Dict[str, Any]], load_content: Callable[[int, int], str], top_k: int = 5, deadline: Optional[float] = None, query_vec: Optional[np.ndarray] = None, load_vectors: Optional[VectorLoader] = None) -> List[Dict[str, Any]]:
+        if not initial:
+            return []
+        semantic = [r for r in initial if r.get("source") == "semantic"]
+        scores = [float(r.get("score", 0.0)) for r in semantic]
+        if len(scores) >= 2 and scores[0] - scores[1] >= self.gap:
+            return self._tag(initial[:top_k], "skipped_gap")
+
+        top = scores[0] if scores else 0.0
+        band: List[Dict[str, Any]] = []
+        rest: List[Dict[str, Any]] = []
+        for r in initial:
+            ambiguous = r.get("source") != "semantic" or top - float(r.get("score", 0.0)) < self.gap
+            if ambiguous and len(band) < self.band:
+                band.append(r)
+            else:
+                rest.append(r)
+        decision = "band" if rest else "full"
+
+        if self.budget_ms > 0:
+            budget_deadline = time.monotonic() + self.budget_ms / 1000.0
+            deadline = budget_deadline if deadline is None else min(deadline, budget_deadline)
+        try:
+            ranked = self.inner.rerank(
+                query, band, load_content, top_k=len(band), deadline=deadline,
+                query_vec=query_vec, load_vectors=load_vectors,
+            )
+        except RerankBudgetExceeded:
+            return self._tag(initial[:top_k], "budget_exceeded")
+        except RerankUnavailable:
+            return self._tag(initial[:top_k], "fallback")
+        return self._tag((ranked + rest)[:top_k], decision)
+
+
+_RERANKER: Optional[Reranker] = None
+_RERANKER_KEY: Optional[tuple] = None
+_RERANKER_LOCK = threading.Lock()
+
+
 def get_default_reranker() -> Reranker:
-    """根据环境变量返回默认 Reranker。
+    """根据环境变量返回进程内共享的默认 Reranker。
 
-    - 当 `KB_RERANK` 为真（1/true/yes）时，使用 `CrossEncoderReranker`。
+    - 当 `KB_RERANK` 为真（1/true/yes）时，使用 `CrossEncoderReranker`，
+      并默认包裹 `CascadeReranker`（`KB_RERANK_CASCADE=0` 可关闭）。
+    - 当 `KB_RERANK=late`（或 `maxsim`）时，使用 `LateInteractionReranker`。
     - 否则，使用 `NoopReranker`。
+    - 实例按配置缓存，模型权重在进程内只加载一次。
     """
-    if _truthy(os.getenv("KB_RERANK")):
-        return CrossEncoderReranker()
-    return NoopReranker()
\ No newline at end of file
+    global _RERANKER, _RERANKER_KEY
+    key = (
+        str(os.getenv("KB_RERANK") or "").lower(),
+        os.getenv("KB_RERANK_MODEL"),
+        os.getenv("KB_RERANK_PRE_K"),
+        _truthy(os.getenv("KB_RERANK_CASCADE", "1")),
+    )
+    with _RERANKER_LOCK:
+        if _RERANKER is None or _RERANKER_KEY != key:
+            if key[0] in {"late", "maxsim"}:
+                _RERANKER = LateInteractionReranker()
+            elif _truthy(key[0]):
+                if key[3]:
+                    # 级联包装需要得知模型不可用，以记录 `fallback` 决策
+                    _RERANKER = CascadeReranker(CrossEncoderReranker(fallback_on_error=False))
+                else:
+                    _RERANKER = CrossEncoderReranker()
+            else:
+                _RERANKER = NoopReranker()
+            _RERANKER_KEY = key
+        return _RERANKER
+
+
+def _unwrap(reranker: Optional[Reranker]) -> Optional[Reranker]:
+    while isinstance(reranker, CascadeReranker):
+        reranker = reranker.inner
+    return reranker
+
+
+def init_default_reranker(warmup: Optional[bool] = None) -> Reranker:
+    """服务启动时调用：提前加载默认 Reranker 的模型，并可选预热（`KB_RERANK_WARMUP`，默认开启）"""
+    reranker = get_default_reranker()
+    model = _unwrap(reranker)
+    if isinstance(model, CrossEncoderReranker):
+        do_warmup = _truthy(os.getenv("KB_RERANK_WARMUP", "1")) if warmup is None else bool(warmup)
+        try:
+            if do_warmup:
+                model.warmup()
+            else:
+                model._ensure_model()
+        except Exception:
+            # 模型不可用时不阻止服务启动，检索阶段会自动回退初始排序
+            pass
+    return reranker
+
+
+def get_rerank_metrics() -> Dict[str, Any]:
+    """返回重排模型的加载与推理指标快照（含分数缓存命中情况）"""
+    out = RERANK_METRICS.snapshot()
+    reranker = _unwrap(_RERANKER)
+    if isinstance(reranker, CrossEncoderReranker):
+        out["score_cache"] = reranker.score_cache.stats()
+    return out
+
+
+def sentence_vectors_enabled() -> bool:
+    """入库时是否生成句子向量旁路：`KB_SENTENCE_VECTORS` 为真，或默认 Reranker 为 late-interaction"""
+    if _truthy(os.getenv("KB_SENTENCE_VECTORS")):
+        return True
+    return str(os.getenv("KB_RERANK") or "").lower() in {"late", "maxsim"}
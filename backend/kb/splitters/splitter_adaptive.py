@@ -1,40 +1,33 @@
-from typing import List, Dict, Any, Optional
-import os
-import re
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from itertools import chain, islice
 from dotenv import load_dotenv
 from backend.prompts.system import get_toc_parser_system_prompt, get_toc_parser_user_prompt
 from .splitter_base import Splitter
-from .splitter_utils import parse_json_array, normalize_title, is_toc_line, detect_toc_bounds
+from ..llm_client import get_default_llm_client
+from .splitter_utils import parse_json_array, normalize_title, is_toc_line, detect_toc_bounds, TOC_TITLE_RE
 from .splitter_headings import HeadingsSplitter, HeadingItem
 
 
-def get_toc_parsing_llm() -> Optional[object]:
-    """获取用于解析目录的专用LLM对象"""
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        return None
-    try:
-        from langchain_openai import ChatOpenAI
-    except Exception:
-        return None
-    return ChatOpenAI(
-        temperature=0,
-        max_retries=2,
-        base_url="https://api.deepseek.com/v1",
-        model="deepseek-chat",
-        api_key=api_key,
-    )
 # 加载 .env 环境变量，确保在独立调用拆分器时也能读取到密钥
 load_dotenv()
 
 
+# 与 `detect_toc_bounds` 的探测行数一致；目录末尾之后至少再缓冲这么多行，覆盖跨页噪声的容忍范围
+_TOC_PROBE_LINES = 5000
+_TOC_TAIL_LINES = 200
+
+
 class AdaptiveSplitter(Splitter):
-    """自适应拆分器：识别目录块并按编号标题拆分正文，可选使用LLM解析目录。"""
+    """自适应拆分器：识别目录块并按编号标题拆分正文，可选使用LLM解析目录。
+
+    - `max_section_chars` 交给 `HeadingsSplitter`，限制正文章节片段的长度；目录片段不受限制
+    """
 
     name = "adaptive"
 
-    def __init__(self, use_llm: bool = False):
+    def __init__(self, use_llm: bool = False, max_section_chars: int = 0):
         self.use_llm = bool(use_llm)
+        self.max_section_chars = int(max_section_chars or 0)
 
     def _is_toc_line(self, line: str) -> bool:
         return is_toc_line(line)
@@ -47,19 +40,14 @@ class AdaptiveSplitter(Splitter):
         if not sample:
             return []
         
-        llm = get_toc_parsing_llm()
-        if not llm:
+        content = get_default_llm_client().complete([
+            ("system", get_toc_parser_system_prompt()),
+            ("user", get_toc_parser_user_prompt(sample)),
+        ])
+        if content is None:
             return []
-
-        sys_prompt = get_toc_parser_system_prompt()
-        user_prompt = get_toc_parser_user_prompt(sample)
-        
         try:
-            msg = llm.invoke([
-                ("system", sys_prompt),
-                ("user", user_prompt),
-            ])
-            arr = parse_json_array(getattr(msg, "content", "") or "")
+            arr = parse_json_array(content)
             out: List[HeadingItem] = []
             seen = set()
             for h in arr:
@@ -76,29 +64,30 @@ class AdaptiveSplitter(Splitter):
         except Exception:
             return []
 
-    def split(self, text: str) -> List[Dict[str, Any]]:
-        lines = (text or "").splitlines()
-        bounds = self._detect_toc_bounds(lines)
-        if not bounds:
-            return HeadingsSplitter().split(text)
-        s, e, title = bounds
-        toc_text = "\n".join(
+    @staticmethod
+    def _toc_text(lines: List[str], s: int, e: int) -> str:
+        return "\n".join(
             [
                 ln
                 for ln in lines[s:e]
                 if (ln or "").strip()
-                and (
-                    re.match(r"^\s*(table\s+of\s+contents|contents|目录)\b", (ln or ""), re.IGNORECASE)
-                    or is_toc_line(ln)
-                )
+                and (TOC_TITLE_RE.match(ln or "") or is_toc_line(ln))
             ]
         ).replace(".....", "").strip()
+
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        lines = (text or "").splitlines()
+        bounds = self._detect_toc_bounds(lines)
+        if not bounds:
+            return HeadingsSplitter(max_section_chars=self.max_section_chars).split(text)
+        s, e, title = bounds
+        toc_text = self._toc_text(lines, s, e)
         rest = "\n".join(lines[:s] + lines[e:])
         allowed: Optional[List[HeadingItem]] = None
         if self.use_llm:
             allowed = self._llm_extract_toc_headings(toc_text)
 
-        chunks_rest = HeadingsSplitter(allowed_headings=allowed).split(rest)
+        chunks_rest = HeadingsSplitter(allowed_headings=allowed, max_section_chars=self.max_section_chars).split(rest)
         out: List[Dict[str, Any]] = []
         out.append({
             "content": toc_text,
@@ -106,3 +95,34 @@ class AdaptiveSplitter(Splitter):
         })
         out.extend(chunks_rest)
         return out
+
+    def iter_split(self, lines: Iterable[str], fallback: Optional[Splitter] = None) -> Iterator[Dict[str, Any]]:
+        """流式拆分：只缓冲开头用于目录识别的若干行，其余逐行交给 `HeadingsSplitter.iter_split`
+
+        - 目录识别只探测前 5000 行，缓冲同样行数即可；若目录延伸到缓冲末尾附近，则倍增缓冲后重新识别
+        - 未识别到目录且全文没有标题时，`fallback`（如定长拆分器）接管全文；有目录时与 `split` 一致
+        """
+        it = iter(lines)
+        buf = list(islice(it, _TOC_PROBE_LINES))
+        exhausted = len(buf) < _TOC_PROBE_LINES
+        bounds = self._detect_toc_bounds(buf)
+        while bounds and not exhausted and bounds[1] + _TOC_TAIL_LINES >= len(buf):
+            more = list(islice(it, len(buf)))
+            exhausted = len(more) < len(buf)
+            buf.extend(more)
+            bounds = self._detect_toc_bounds(buf)
+        if not bounds:
+            yield from HeadingsSplitter(max_section_chars=self.max_section_chars).iter_split(chain(buf, it), fallback=fallback)
+            return
+        s, e, title = bounds
+        toc_text = self._toc_text(buf, s, e)
+        allowed: Optional[List[HeadingItem]] = None
+        if self.use_llm:
+            allowed = self._llm_extract_toc_headings(toc_text)
+        yield {
+            "content": toc_text,
+            "metadata": {"number": "", "title": title, "path": [], "type": "toc"},
+        }
+        rest = chain(buf[:s], buf[e:], it)
+        del buf
+        yield from HeadingsSplitter(allowed_headings=allowed, max_section_chars=self.max_section_chars).iter_split(rest)
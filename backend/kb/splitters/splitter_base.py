@@ -1,4 +1,4 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 
 
 class Splitter:
@@ -18,4 +18,12 @@ class Splitter:
     name: str = "base"
 
     def split(self, text: str) -> List[Dict[str, Any]]:  # pragma: no cover - interface
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def iter_split(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """流式拆分：逐行读入文本（行不含换行符），片段一经确定即产出，调用方可边拆分边嵌入、写入
+
+        - 结果与 `split("\\n".join(lines))` 一致（各子类注明的差异除外）
+        - 默认实现先拼接全文再调用 `split`；Normal/Headings/Adaptive/Table 拆分器均有逐行实现
+        """
+        yield from self.split("\n".join(lines))
@@ -1,8 +1,13 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
 import re
+import tempfile
 from pydantic import BaseModel
 from .splitter_base import Splitter
-from .splitter_utils import normalize_title
+from .splitter_utils import normalize_title, split_oversized
+
+
+# 流式拆分时首个标题之前内容的内存暂存上限，超过后落盘
+_SPOOL_MAX_BYTES = 4 << 20
 
 
 class HeadingItem(BaseModel):
@@ -14,39 +19,75 @@ class HeadingItem(BaseModel):
 
 
 class HeadingsSplitter(Splitter):
-    """编号/附录标题拆分器。"""
+    """编号/附录标题拆分器。
+
+    - `max_section_chars` > 0 时，超过该字符数的章节在段落/句子边界再切分（见 `split_oversized`），
+      各段保留章节的 `path` 并带 `part_index` / `part_count`
+    """
 
     name = "headings"
 
-    def __init__(self, allowed_headings: Optional[List[HeadingItem]] = None):
+    def __init__(self, allowed_headings: Optional[List[HeadingItem]] = None, max_section_chars: int = 0):
         self.allowed_headings = allowed_headings or []
+        self.max_section_chars = int(max_section_chars or 0)
 
     def _scan_with_allowed(self, lines: List[str]) -> List[Dict[str, Any]]:
         """严格在行中扫描匹配允许的编号标题，先匹配编号再匹配标题，兼容 Markdown 前缀与强调标记"""
-        heads: List[Dict[str, Any]] = []
-        matchers = []
-        for h in self.allowed_headings:
+        return [
+            {"index": i, **head}
+            for i, (_, head) in enumerate(self._iter_allowed_heads(lines))
+            if head is not None
+        ]
+
+    def _iter_allowed_heads(self, lines: Iterable[str]) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """逐行产出 `(行, 标题或 None)`，标题匹配规则同 `_scan_with_allowed`
+
+        - 允许的标题按编号的首个单词（casefold）建立索引，每行只取出行内单词命中的候选，
+          再按原顺序用编号的整词模式与归一化标题确认，结果与逐个标题匹配一致
+        """
+        by_token: Dict[str, List[Tuple[int, Any, str, str, str]]] = {}
+        always: List[Tuple[int, Any, str, str, str]] = []
+        for order, h in enumerate(self.allowed_headings):
             n = str(h.number).strip()
-            t = normalize_title(h.title)
             if not n:
                 continue
             # 在整行中查找编号（不再要求行首），使用单词边界提高鲁棒性
             pat = re.compile(r"\b" + re.escape(n) + r"\b", re.IGNORECASE)
-            matchers.append((pat, t, n, h.title))
+            matcher = (order, pat, normalize_title(h.title), n, h.title)
+            first = _WORD_RE.match(n)
+            if first is not None and first.group(0).isascii():
+                by_token.setdefault(first.group(0).casefold(), []).append(matcher)
+            else:
+                always.append(matcher)
 
-        for i, line in enumerate(lines):
+        for line in lines:
             s = (line or "")
             # 去掉 Markdown 标题前缀与全局强调标记
-            s = re.sub(r"^\s*(?:#{1,6}\s*)", "", s)
-            s = re.sub(r"[\*_]+", "", s)
-            line_norm = normalize_title(s)
-            for (pat, t_norm, n_raw, t_raw) in matchers:
-                # 先匹配编号，再确认标题（归一化后）在行中出现
-                if pat.search(s):
-                    if t_norm in line_norm:
-                        heads.append({"index": i, "number": n_raw, "title": t_raw})
-                        break
-        return heads
+            s = _EMPHASIS_RE.sub("", _MD_HEADING_PREFIX_RE.sub("", s, count=1))
+            head: Optional[Dict[str, Any]] = None
+            candidates = [m for t in set(_WORD_RE.findall(s.casefold())) for m in by_token.get(t, ())]
+            if candidates or always:
+                line_norm = normalize_title(s)
+                for (_, pat, t_norm, n_raw, t_raw) in sorted(candidates + always, key=lambda m: m[0]):
+                    # 先匹配编号，再确认标题（归一化后）在行中出现
+                    if pat.search(s):
+                        if t_norm in line_norm:
+                            head = {"number": n_raw, "title": t_raw}
+                            break
+            yield line, head
+
+    @staticmethod
+    def _path(number: str, title: str, number_to_title: Dict[str, str]) -> List[Dict[str, Any]]:
+        segs = number.split(".")
+        path: List[Dict[str, Any]] = []
+        for j in range(1, len(segs) + 1):
+            key = ".".join(segs[:j])
+            if key in number_to_title:
+                path.append({"number": key, "title": number_to_title[key]})
+            else:
+                if j == len(segs):
+                    path.append({"number": key, "title": title})
+        return path
 
     def _chunk(self, lines: List[str], heads: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if not heads:
@@ -60,175 +101,207 @@ class HeadingsSplitter(Splitter):
             start = h["index"]
             end = ordered[idx + 1]["index"] if idx + 1 < len(ordered) else len(lines)
             content = "\n".join(lines[start:end]).strip()
-            segs = h["number"].split(".")
-            path: List[Dict[str, Any]] = []
-            for j in range(1, len(segs) + 1):
-                key = ".".join(segs[:j])
-                if key in number_to_title:
-                    path.append({"number": key, "title": number_to_title[key]})
-                else:
-                    if j == len(segs):
-                        path.append({"number": key, "title": h["title"]})
             chunks.append({
                 "content": content,
-                "metadata": {"number": h["number"], "title": h["title"], "path": path},
+                "metadata": {"number": h["number"], "title": h["title"], "path": self._path(h["number"], h["title"], number_to_title)},
             })
         return chunks
 
     def split(self, text: str) -> List[Dict[str, Any]]:
         lines = (text or "").splitlines()
+        heads = [
+            {"index": i, **head}
+            for i, (_, head) in enumerate(self._iter_heads(lines))
+            if head is not None
+        ]
+        return list(split_oversized(self._chunk(lines, heads), self.max_section_chars))
 
+    def iter_split(self, lines: Iterable[str], fallback: Optional[Splitter] = None) -> Iterator[Dict[str, Any]]:
+        """流式拆分：逐行扫描标题，每遇到下一个标题即产出上一节，内存中只保留当前一节
+
+        - 各节内容、`number`、`title` 与 `split` 一致，`path` 的取值规则不同：
+          - `iter_split`：每一级取该编号在当前标题之前（含当前标题）最近一次出现的标题；此前未出现的上级编号不进入 `path`
+          - `split`：每一级取该编号在全文中最后一次出现的标题，包括出现在当前标题之后的
+          - 因此上级标题出现在下级之后（如 "1.1 Scope" 先于 "1 Intro"：`split` 的 path 含 "1 Intro"，此处不含），
+            或同一编号出现多次时，两者的 `path` 不同；其余情况一致
+        - 首个标题之前的内容与 `split` 一样被丢弃，扫描期间暂存在临时文件中（超过 4MB 落盘）
+        - 全文未识别到任何标题时：默认整体作为一个片段（同 `split`）；提供 `fallback` 时改由其 `iter_split` 拆分全文
+        - 超长章节的再切分同 `split`
+        """
+        return split_oversized(self._iter_sections(lines, fallback), self.max_section_chars)
+
+    def _iter_sections(self, lines: Iterable[str], fallback: Optional[Splitter]) -> Iterator[Dict[str, Any]]:
+        number_to_title: Dict[str, str] = {}
+        pre = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES, mode="w+", encoding="utf-8", newline="\n")
+        current: Optional[Dict[str, Any]] = None
+        section: List[str] = []
+        try:
+            for line, head in self._iter_heads(lines):
+                if head is None:
+                    if current is not None:
+                        section.append(line)
+                    elif not pre.closed:
+                        pre.write(line + "\n")
+                    continue
+                if current is not None:
+                    yield {"content": "\n".join(section).strip(), "metadata": current}
+                elif not pre.closed:
+                    pre.close()
+                number_to_title[head["number"]] = head["title"]
+                current = {
+                    "number": head["number"],
+                    "title": head["title"],
+                    "path": self._path(head["number"], head["title"], number_to_title),
+                }
+                section = [line]
+            if current is not None:
+                yield {"content": "\n".join(section).strip(), "metadata": current}
+                return
+            pre.seek(0)
+            rest = (ln[:-1] if ln.endswith("\n") else ln for ln in pre)
+            if fallback is not None:
+                yield from fallback.iter_split(rest)
+            else:
+                yield {"content": "\n".join(rest).strip(), "metadata": {"number": "", "title": "", "path": []}}
+        finally:
+            pre.close()
+
+    def _iter_heads(self, lines: Iterable[str]) -> Iterator[Tuple[str, Optional[Dict[str, Any]]]]:
+        """逐行产出 `(行, 标题或 None)`；标题为 `{"number", "title"}`
+
+        每行只经 `classify_heading_line` 分类一次；附录内的编号标题还需通过表格行与编号连续性检查。
+        """
         if self.allowed_headings:
-            heads = self._scan_with_allowed(lines)
-            return self._chunk(lines, heads)
-
-        heading_re = re.compile(r"^\s*(\d+(?:\.\d+)*)(?:\s+|\s*[\-\u2013]\s*)(.+?)\s*$")
-        appendix_re = re.compile(r"^\s*(?:Appendix\s+)(\d+|[A-Za-z])(?:\.|\-|\s)+(.+?)\s*$", re.IGNORECASE)
-        appendix_letter_re = re.compile(r"^\s*([A-Za-z])(?:\.|\-|\s)+(.+?)\s*$")
-
-        def looks_like_table_row(title: str) -> bool:
-            """
-            判断一行是否更像表格行而非章节标题。
-
-            在 PDF 文本中，表格行常包含多个数值列（如 RGB、LOD 等），例如：
-            "Ramps 175-175-175 300 500"
-            这种行如果被当作章节会造成错误拆分。
-            """
-            t = (title or "").strip()
-            if not t:
-                return False
-            numeric_tokens = re.findall(r"\b\d+(?:[,\-]\d+)*\b", t)
-            if len(numeric_tokens) >= 2:
-                return True
-            if re.search(r"\b\d{1,4}(?:-\d{1,4}){2,}\b", t):
-                return True
-            return False
-
-        def norm_num(n: str) -> str:
-            n = (n or "").strip()
-            if n.endswith("."):
-                n = n[:-1]
-            return n
-
-        heads: List[Dict[str, Any]] = []
-        allowed_pairs: set[tuple[str, str]] = set()
-        allowed_map: Dict[str, str] = {}
-        if self.allowed_headings:
-            for h in self.allowed_headings:
-                # Use attribute access for Pydantic model
-                raw_n = str(h.number).strip()
-                m_app = re.match(r"^\s*Appendix\s+(\d+|[A-Za-z])\s*$", raw_n, flags=re.IGNORECASE)
-                if m_app:
-                    n = f"Appendix {norm_num(m_app.group(1).strip().upper())}"
-                else:
-                    n = norm_num(raw_n)
-                t = normalize_title(h.title)
-                if t:
-                    allowed_map[n] = t
-                    allowed_pairs.add((n, t))
-
-        current_appendix: Optional[tuple[str, str]] = None
+            yield from self._iter_allowed_heads(lines)
+            return
+
+        current_appendix: Optional[str] = None
         last_appendix_segments: Optional[List[int]] = None
 
-        def _parse_num_segments(s: str) -> Optional[List[int]]:
-            s = (s or "").strip()
-            if not s:
-                return None
-            try:
-                parts = s.split(".")
-                segs = [int(p) for p in parts if p != ""]
-                return segs if segs else None
-            except Exception:
-                return None
-
-        def _is_plausible_next(last: Optional[List[int]], cur: List[int]) -> bool:
-            if not last:
-                return len(cur) >= 1 and cur[0] == 1
-            Ln, Cn = len(last), len(cur)
-            if Cn == Ln and cur[:-1] == last[:-1] and cur[-1] == last[-1] + 1:
-                return True
-            if Cn == Ln + 1 and cur[:Ln] == last and cur[-1] == 1:
-                return True
-            if Cn < Ln:
-                prefix = last[:Cn]
-                if cur[:-1] == prefix[:-1] and cur[-1] == prefix[-1] + 1:
-                    return True
-            return False
-
-        for i, raw in enumerate(lines):
-            line = raw or ""
-            s = re.sub(r"^\s*(?:#{1,6}\s*)", "", line)
-            s = re.sub(r"^\s*(?:\*\*|\*|_)\s*", "", s)
-            s = re.sub(r"\s*(?:\*\*|\*|_)\s*$", "", s)
-
-            ma = appendix_re.match(s)
-            if ma:
-                a_id = f"Appendix {norm_num(ma.group(1).strip().upper())}"
-                a_title = ma.group(2).strip()
-                if normalize_title(a_title) in {"contents", "table of contents", "目录"}:
-                    continue
-                if allowed_pairs:
-                    pair = (a_id, normalize_title(a_title))
-                    if pair not in allowed_pairs:
-                        ref = allowed_map.get(a_id)
-                        if not ref or not (
-                            normalize_title(a_title) == ref
-                            or normalize_title(a_title).startswith(ref)
-                            or ref in normalize_title(a_title)
-                        ):
-                            continue
-                current_appendix = (a_id, a_title)
-                last_appendix_segments = None
-                heads.append({"index": i, "number": a_id, "title": a_title})
-                continue
-            mb = appendix_letter_re.match(s)
-            if mb:
-                a_id = norm_num(mb.group(1).strip().upper())
-                a_title = mb.group(2).strip()
-                if normalize_title(a_title) in {"contents", "table of contents", "目录"}:
-                    continue
-                if allowed_pairs:
-                    pair = (a_id, normalize_title(a_title))
-                    if pair not in allowed_pairs:
-                        ref = allowed_map.get(a_id)
-                        if not ref or not (
-                            normalize_title(a_title) == ref
-                            or normalize_title(a_title).startswith(ref)
-                            or ref in normalize_title(a_title)
-                        ):
-                            continue
-                current_appendix = (a_id, a_title)
-                last_appendix_segments = None
-                heads.append({"index": i, "number": a_id, "title": a_title})
-                continue
+        for raw in lines:
+            cand = classify_heading_line(raw)
+            head: Optional[Dict[str, Any]] = None
+            if cand is not None:
+                kind, number, title = cand
+                if kind == "appendix":
+                    current_appendix = number
+                    last_appendix_segments = None
+                    head = {"number": number, "title": title}
+                elif current_appendix is None:
+                    head = {"number": number, "title": title}
+                elif not _looks_like_table_row(title):
+                    segs = _parse_num_segments(number)
+                    if segs is not None and _is_plausible_next(last_appendix_segments, segs):
+                        last_appendix_segments = segs
+                        head = {"number": f"{current_appendix}.{number}", "title": title}
+            yield raw, head
 
-            m = heading_re.match(s)
-            if not m:
-                continue
-            num_raw = m.group(1).strip()
-            title = m.group(2).strip()
-            if title.lower() in {"contents", "table of contents", "目录"}:
-                continue
-            if re.match(r"^\s*\d+\)\s+", s):
-                continue
-            if re.search(r"\b\d{1,5}\s*$", s) and re.search(r"[\.·\-]{3,}", s):
-                continue
 
-            num_norm = norm_num(num_raw)
-            cand_pair = (num_norm, normalize_title(title))
-            if allowed_pairs and cand_pair not in allowed_pairs and current_appendix is None:
-                continue
-            if current_appendix is not None and looks_like_table_row(title):
-                continue
-            if current_appendix is not None:
-                segs = _parse_num_segments(num_norm)
-                if segs is None:
-                    continue
-                if not _is_plausible_next(last_appendix_segments, segs):
-                    continue
-                last_appendix_segments = segs
+_WORD_RE = re.compile(r"\w+")
+_MD_HEADING_PREFIX_RE = re.compile(r"^\s*(?:#{1,6}\s*)")
+_EMPHASIS_RE = re.compile(r"[\*_]+")
+# 依次去掉 Markdown 标题前缀、行首强调标记（二者合并为一次匹配）与行尾强调标记
+_LINE_PREFIX_RE = re.compile(r"^\s*(?:#{1,6}\s*)?(?:(?:\*\*|\*|_)\s*)?")
+_LINE_SUFFIX_RE = re.compile(r"\s*(?:\*\*|\*|_)\s*$")
+_HEADING_RE = re.compile(r"^\s*(\d+(?:\.\d+)*)(?:\s+|\s*[\-\u2013]\s*)(.+?)\s*$")
+_APPENDIX_RE = re.compile(r"^\s*(?:Appendix\s+)(\d+|[A-Za-z])(?:\.|\-|\s)+(.+?)\s*$", re.IGNORECASE)
+_APPENDIX_LETTER_RE = re.compile(r"^\s*([A-Za-z])(?:\.|\-|\s)+(.+?)\s*$")
+_LIST_ITEM_RE = re.compile(r"^\s*\d+\)\s+")
+_TRAILING_PAGE_RE = re.compile(r"\b\d{1,5}\s*$")
+_LEADER_RE = re.compile(r"[\.·\-]{3,}")
+_NUMERIC_TOKEN_RE = re.compile(r"\b\d+(?:[,\-]\d+)*\b")
+_NUMERIC_TRIPLE_RE = re.compile(r"\b\d{1,4}(?:-\d{1,4}){2,}\b")
+_TOC_TITLES = {"contents", "table of contents", "目录"}
+
+
+def _norm_num(n: str) -> str:
+    n = (n or "").strip()
+    if n.endswith("."):
+        n = n[:-1]
+    return n
+
+
+def classify_heading_line(raw: str) -> Optional[Tuple[str, str, str]]:
+    """对一行做一次归一化与分类，返回 `(kind, number, title)` 或 None
+
+    - `kind` 为 `appendix`（`Appendix 1` / `Appendix A` / 单字母附录，编号已归一化）或 `numbered`（编号标题）
+    - 只做与上下文无关的判断（目录标题、`1) ` 列表项、带引导符与页码的目录行）；
+      附录内编号标题的表格行与连续性检查由调用方完成
+    """
+    s = _LINE_PREFIX_RE.sub("", raw or "", count=1)
+    first = s.lstrip()[:1]
+    if not first:
+        return None
+    if first.isdigit():
+        s = _LINE_SUFFIX_RE.sub("", s, count=1)
+        m = _HEADING_RE.match(s)
+        if not m:
+            return None
+        title = m.group(2).strip()
+        if title.lower() in _TOC_TITLES:
+            return None
+        if _LIST_ITEM_RE.match(s):
+            return None
+        if _TRAILING_PAGE_RE.search(s) and _LEADER_RE.search(s):
+            return None
+        return "numbered", _norm_num(m.group(1).strip()), title
+    if not ("a" <= first.lower() <= "z"):
+        return None
+    s = _LINE_SUFFIX_RE.sub("", s, count=1)
+    m = _APPENDIX_RE.match(s)
+    if m:
+        number = f"Appendix {_norm_num(m.group(1).strip().upper())}"
+    else:
+        m = _APPENDIX_LETTER_RE.match(s)
+        if not m:
+            return None
+        number = _norm_num(m.group(1).strip().upper())
+    title = m.group(2).strip()
+    if normalize_title(title) in _TOC_TITLES:
+        return None
+    return "appendix", number, title
+
+
+def _looks_like_table_row(title: str) -> bool:
+    """
+    判断一行是否更像表格行而非章节标题。
+
+    在 PDF 文本中，表格行常包含多个数值列（如 RGB、LOD 等），例如：
+    "Ramps 175-175-175 300 500"
+    这种行如果被当作章节会造成错误拆分。
+    """
+    t = (title or "").strip()
+    if not t:
+        return False
+    if len(_NUMERIC_TOKEN_RE.findall(t)) >= 2:
+        return True
+    if _NUMERIC_TRIPLE_RE.search(t):
+        return True
+    return False
+
+
+def _parse_num_segments(s: str) -> Optional[List[int]]:
+    s = (s or "").strip()
+    if not s:
+        return None
+    try:
+        parts = s.split(".")
+        segs = [int(p) for p in parts if p != ""]
+        return segs if segs else None
+    except Exception:
+        return None
 
-            final_num = num_norm if current_appendix is None else f"{current_appendix[0]}.{num_norm}"
-            heads.append({"index": i, "number": final_num, "title": title})
 
-        return self._chunk(lines, heads)
+def _is_plausible_next(last: Optional[List[int]], cur: List[int]) -> bool:
+    if not last:
+        return len(cur) >= 1 and cur[0] == 1
+    Ln, Cn = len(last), len(cur)
+    if Cn == Ln and cur[:-1] == last[:-1] and cur[-1] == last[-1] + 1:
+        return True
+    if Cn == Ln + 1 and cur[:Ln] == last and cur[-1] == 1:
+        return True
+    if Cn < Ln:
+        prefix = last[:Cn]
+        if cur[:-1] == prefix[:-1] and cur[-1] == prefix[-1] + 1:
+            return True
+    return False
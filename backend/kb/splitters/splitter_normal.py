@@ -1,7 +1,11 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
+import re
 from .splitter_base import Splitter
 
 
+_NON_SPACE = re.compile(r"\S")
+
+
 class NormalSplitter(Splitter):
     """定长切片拆分器：返回标准片段字典列表。"""
 
@@ -32,3 +36,38 @@ class NormalSplitter(Splitter):
             start = end - self.overlap
         return chunks
 
+    def iter_split(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """流式定长切片：结果与 `split("\\n".join(lines))` 一致，内存中只保留约一个片段长度的文本
+
+        - 缓冲超过 `chunk_size` 且其后仍有非空白内容时才产出片段（与整段去除首尾空白后的切分边界一致）
+        """
+        buf = ""
+        started = False
+        first = True
+        for line in lines:
+            piece = line if first else "\n" + line
+            first = False
+            if not started:
+                piece = piece.lstrip()
+                if not piece:
+                    continue
+                started = True
+            buf += piece
+            pos = 0
+            while len(buf) - pos > self.chunk_size and _NON_SPACE.search(buf, pos + self.chunk_size):
+                yield {
+                    "content": buf[pos:pos + self.chunk_size],
+                    "metadata": {"number": "", "title": "", "path": []},
+                }
+                pos += self.chunk_size - self.overlap
+            if pos:
+                buf = buf[pos:]
+        buf = buf.rstrip()
+        while buf:
+            yield {
+                "content": buf[:self.chunk_size],
+                "metadata": {"number": "", "title": "", "path": []},
+            }
+            if len(buf) <= self.chunk_size:
+                break
+            buf = buf[self.chunk_size - self.overlap:]
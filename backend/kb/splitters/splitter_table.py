@@ -1,16 +1,21 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any, Optional, Tuple
-import os
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
+from itertools import chain
+from concurrent.futures import Future
 import re
 
 from .splitter_base import Splitter
+from ..llm_client import get_default_llm_client
 from backend.prompts.system import (
     get_table_summary_system_prompt,
     get_table_summary_user_prompt,
 )
 
 
+_SHEET_RE = re.compile(r"^\[Sheet\]\s*(.+?)\s*$")
+
+
 def _split_sheets(text: str) -> List[Tuple[str, str]]:
     """将 `read_excel_text` 生成的文本按 `[Sheet]` 分块为 (sheet_name, sheet_text) 列表。"""
     lines = (text or "").splitlines()
@@ -19,7 +24,7 @@ def _split_sheets(text: str) -> List[Tuple[str, str]]:
     current_lines: List[str] = []
 
     for line in lines:
-        m = re.match(r"^\[Sheet\]\s*(.+?)\s*$", line)
+        m = _SHEET_RE.match(line)
         if m:
             if current_name is not None:
                 blocks.append((current_name, current_lines))
@@ -51,6 +56,18 @@ def _extract_markdown_table_lines(sheet_text: str) -> List[str]:
     return table_lines
 
 
+def _iter_sheet_table_lines(lines: Iterator[str], next_sheet: List[str]) -> Iterator[str]:
+    """逐行产出当前工作表的 Markdown 表格行，遇到下一个 `[Sheet]` 行时停止并把其表名放入 `next_sheet`"""
+    for line in lines:
+        m = _SHEET_RE.match(line)
+        if m:
+            next_sheet.append(m.group(1).strip())
+            return
+        s = line.rstrip()
+        if s.lstrip().startswith("|"):
+            yield s.strip()
+
+
 def _parse_markdown_header(table_lines: List[str]) -> List[str]:
     """从 Markdown 表格行中解析表头单元格文本（第 1 行）。"""
     if not table_lines:
@@ -62,6 +79,69 @@ def _parse_markdown_header(table_lines: List[str]) -> List[str]:
     return [c for c in raw if c != ""]
 
 
+def table_width(rows: List[List[str]]) -> int:
+    """表格列数：按最宽行计，并去掉所有行末尾都为空的列"""
+    width = max((len(r) for r in rows), default=0)
+    while width > 0 and all((len(r) < width or not r[width - 1]) for r in rows):
+        width -= 1
+    return width
+
+
+def markdown_row(cells: List[str], width: int) -> str:
+    """将一行单元格文本渲染为 Markdown 表格行：按 `width` 截断或补齐，单元格内的 `|` 转义"""
+    padded = list(cells[:width]) + [""] * (width - len(cells[:width]))
+    return "| " + " | ".join(c.replace("|", "\\|") for c in padded) + " |"
+
+
+class TableChunkBuilder:
+    """逐行累积 Markdown 表格行，按行数/字符数上限切出带表头的表格片段
+
+    - 维护当前片段的累计字符数，追加一行为 O(1)，不再每行重新拼接整段文本
+    - 行数达到 `max_rows` 时切出；追加后字符数达到 `max_chars` 时，该行留给下一个片段
+    """
+
+    def __init__(self, header: str, sep: str, max_rows: int, max_chars: int):
+        self.header = header
+        self.sep = sep
+        self.max_rows = max_rows if max_rows > 0 else 50
+        self.max_chars = max_chars if max_chars > 0 else 6000
+        self.parts = 0
+        self._base = len(header) + (len(sep) + 1 if sep else 0)
+        self._rows: List[str] = []
+        self._chars = self._base
+
+    def add(self, row: str) -> Optional[str]:
+        """追加一行，凑满一个片段时返回该片段的 Markdown 文本"""
+        self._rows.append(row)
+        self._chars += len(row) + 1
+        if len(self._rows) >= self.max_rows:
+            return self._flush()
+        if self._chars >= self.max_chars:
+            self._rows.pop()
+            out = self._flush()
+            self._rows.append(row)
+            self._chars += len(row) + 1
+            return out
+        return None
+
+    def finish(self) -> Optional[str]:
+        """切出剩余行；整张表没有数据行时返回只含表头的片段"""
+        out = self._flush()
+        if out is None and self.parts == 0 and (self.header or self.sep):
+            self.parts = 1
+            out = "\n".join([self.header] + ([self.sep] if self.sep else [])).strip()
+        return out
+
+    def _flush(self) -> Optional[str]:
+        if not self._rows:
+            return None
+        md = "\n".join([self.header] + ([self.sep] if self.sep else []) + self._rows).strip()
+        self._rows = []
+        self._chars = self._base
+        self.parts += 1
+        return md
+
+
 def _build_table_chunks(
     table_lines: List[str],
     max_rows_per_chunk: int,
@@ -73,94 +153,51 @@ def _build_table_chunks(
 
     header = table_lines[0]
     sep = table_lines[1] if len(table_lines) >= 2 else ""
-    body = table_lines[2:] if len(table_lines) >= 3 else []
-
-    if max_rows_per_chunk <= 0:
-        max_rows_per_chunk = 50
-    if max_chars_per_chunk <= 0:
-        max_chars_per_chunk = 6000
-
+    builder = TableChunkBuilder(header, sep, max_rows_per_chunk, max_chars_per_chunk)
     chunks: List[str] = []
-    cur_rows: List[str] = []
-
-    def _flush() -> None:
-        if not cur_rows:
-            return
-        md_lines = [header]
-        if sep:
-            md_lines.append(sep)
-        md_lines.extend(cur_rows)
-        chunks.append("\n".join(md_lines).strip())
-        cur_rows.clear()
-
-    for row in body:
-        cur_rows.append(row)
-        if len(cur_rows) >= max_rows_per_chunk:
-            _flush()
-            continue
-        md_lines = [header]
-        if sep:
-            md_lines.append(sep)
-        md_lines.extend(cur_rows)
-        if len("\n".join(md_lines)) >= max_chars_per_chunk:
-            cur_rows.pop()
-            _flush()
-            cur_rows.append(row)
-
-    _flush()
-
-    if not chunks and (header or sep):
-        md_lines = [header]
-        if sep:
-            md_lines.append(sep)
-        chunks = ["\n".join(md_lines).strip()]
-
+    for row in table_lines[2:]:
+        md = builder.add(row)
+        if md is not None:
+            chunks.append(md)
+    md = builder.finish()
+    if md is not None:
+        chunks.append(md)
     return chunks
 
 
-def _llm_summarize_table(
+def _table_summary_messages(
     table_name: str,
     sheet_name: str,
     header_cells: List[str],
-) -> str:
-    """基于表格名称、Sheet 名称与表头文本调用 LLM 生成表格摘要（无 Key 或失败则返回空）。"""
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        return ""
-
+) -> Optional[List[Tuple[str, str]]]:
+    """表格摘要的提示消息；表头为空时返回 None（不生成摘要）"""
     header_text = " | ".join([c for c in (header_cells or []) if c]).strip()
     if not header_text:
-        return ""
+        return None
+    return [
+        ("system", get_table_summary_system_prompt()),
+        ("user", get_table_summary_user_prompt(
+            table_name=table_name,
+            sheet_name=sheet_name,
+            header_text=header_text,
+        )),
+    ]
+
+
+def _clean_summary(content: Optional[str]) -> str:
+    return re.sub(r"\s+\n", "\n", (content or "").strip()).strip()
 
-    try:
-        from langchain_openai import ChatOpenAI  # 延迟导入，避免在冻结环境中不必要的依赖加载
-    except Exception:
-        return ""
 
-    llm = ChatOpenAI(
-        temperature=0,
-        max_retries=2,
-        base_url="https://api.deepseek.com/v1",
-        model="deepseek-chat",
-        api_key=api_key,
-    )
-
-    sys_prompt = get_table_summary_system_prompt()
-    user_prompt = get_table_summary_user_prompt(
-        table_name=table_name,
-        sheet_name=sheet_name,
-        header_text=header_text,
-    )
-    try:
-        msg = llm.invoke([
-            ("system", sys_prompt),
-            ("user", user_prompt),
-        ])
-        summary = (getattr(msg, "content", "") or "").strip()
-        summary = re.sub(r"\s+\n", "\n", summary).strip()
-        return summary
-    except Exception:
+def _llm_summarize_table(
+    table_name: str,
+    sheet_name: str,
+    header_cells: List[str],
+) -> str:
+    """基于表格名称、Sheet 名称与表头文本调用 LLM 生成表格摘要（LLM 不可用或失败则返回空）。"""
+    messages = _table_summary_messages(table_name, sheet_name, header_cells)
+    if messages is None:
         return ""
+    return _clean_summary(get_default_llm_client().complete(messages))
 
 
 class TableSplitter(Splitter):
@@ -174,56 +211,154 @@ class TableSplitter(Splitter):
         use_llm_summary: bool = True,
         max_rows_per_chunk: int = 200,
         max_chars_per_chunk: int = 8000,
+        max_buffered_parts: int = 256,
     ):
         self.table_name = (table_name or "").strip()
         self.use_llm_summary = bool(use_llm_summary)
         self.max_rows_per_chunk = int(max_rows_per_chunk)
         self.max_chars_per_chunk = int(max_chars_per_chunk)
+        self.max_buffered_parts = int(max_buffered_parts)
+        self._summaries: Dict[Tuple[str, Tuple[str, ...]], Future] = {}
 
-    def split(self, text: str) -> List[Dict[str, Any]]:
-        sheets = _split_sheets(text)
-        chunks: List[Dict[str, Any]] = []
-
-        for sheet_name, sheet_text in sheets:
-            table_lines = _extract_markdown_table_lines(sheet_text)
-            header_cells = _parse_markdown_header(table_lines)
+    def prefetch_summaries(self, sheets: Iterable[Tuple[str, List[str]]]) -> None:
+        """提前并发请求各工作表的 LLM 摘要（`(sheet_name, header_cells)` 序列），拆分到该表时直接取结果
 
-            summary = ""
-            if self.use_llm_summary:
-                summary = _llm_summarize_table(
-                    table_name=self.table_name,
-                    sheet_name=sheet_name,
-                    header_cells=header_cells,
-                )
+        - 并发数由共享 LLM 客户端限制（`KB_LLM_CONCURRENCY`），结果写入持久化缓存
+        - 未启用摘要时忽略
+        """
+        if not self.use_llm_summary:
+            return
+        client = get_default_llm_client()
+        for sheet_name, header_cells in sheets:
+            key = (sheet_name, tuple(header_cells))
+            messages = _table_summary_messages(self.table_name, sheet_name, header_cells)
+            if messages is not None and key not in self._summaries:
+                self._summaries[key] = client.submit(messages)
+
+    def _summary(self, sheet_name: str, header_cells: List[str]) -> str:
+        future = self._summaries.pop((sheet_name, tuple(header_cells)), None)
+        if future is not None:
+            return _clean_summary(future.result())
+        return _llm_summarize_table(
+            table_name=self.table_name,
+            sheet_name=sheet_name,
+            header_cells=header_cells,
+        )
 
+    def split(self, text: str) -> List[Dict[str, Any]]:
+        chunks: List[Dict[str, Any]] = []
+        sheets = [(name, _extract_markdown_table_lines(sheet_text)) for name, sheet_text in _split_sheets(text)]
+        self.prefetch_summaries([(name, _parse_markdown_header(lines)) for name, lines in sheets if lines])
+        for sheet_name, table_lines in sheets:
             parts = _build_table_chunks(
                 table_lines=table_lines,
                 max_rows_per_chunk=self.max_rows_per_chunk,
                 max_chars_per_chunk=self.max_chars_per_chunk,
             )
-            if not parts:
-                continue
-
-            total_parts = len(parts)
-            for idx, md in enumerate(parts, start=1):
-                prefix_lines = [
-                    f"[Table] {self.table_name}",
-                    f"[Sheet] {sheet_name}",
-                ]
-                if idx == 1 and summary:
-                    prefix_lines.append(f"[TableSummary] {summary}")
-                content = ("\n".join(prefix_lines) + "\n" + md).strip()
-                chunks.append({
-                    "content": content,
-                    "metadata": {
-                        "type": "table",
-                        "table_name": self.table_name,
-                        "sheet_name": sheet_name,
-                        "part_index": idx,
-                        "part_count": total_parts,
-                        "header": header_cells,
-                    },
-                })
-
+            if parts:
+                chunks.extend(self._decorate(sheet_name, _parse_markdown_header(table_lines), parts, len(parts)))
         return chunks
 
+    def iter_split_sheets(self, sheets: Iterable[Tuple[Any, ...]]) -> Iterator[Dict[str, Any]]:
+        """直接由工作表单元格行生成片段，不经过整本 Markdown 文本的拼接与正则解析
+
+        - `sheets`：`(sheet_name, rows)` 或 `(sheet_name, rows, width)` 序列，`rows` 为单元格文本行，首行作为表头
+        - 给出 `width`（表格列数）时 `rows` 可以是只遍历一次的迭代器，逐行切分，内存占用与表格行数无关；
+          否则先读入整张表计算列数
+        - 表格渲染与切分规则同 `read_excel_text` + `split`，逐个工作表产出片段
+        """
+        for sheet in sheets:
+            sheet_name, rows = sheet[0], sheet[1]
+            width = sheet[2] if len(sheet) > 2 else None
+            if width is None:
+                rows = list(rows)
+                width = table_width(rows)
+            it = iter(rows)
+            first = next(it, None)
+            if first is None or not width:
+                continue
+            builder = TableChunkBuilder(
+                markdown_row(first, width),
+                "| " + " | ".join(["---"] * width) + " |",
+                self.max_rows_per_chunk,
+                self.max_chars_per_chunk,
+            )
+            header_cells = [c for c in first[:width] if c]
+            rendered = (markdown_row(r, width) for r in it)
+            yield from self._sheet_chunks(sheet_name, header_cells, self._iter_parts(builder, rendered))
+
+    def iter_split(self, lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """流式解析 `read_excel_text` 格式的文本行（`[Sheet]` 行 + Markdown 表格），逐个片段产出
+
+        - 切分规则与 `split` 一致；表格行边读边切，内存中只保留当前片段
+        - 摘要在拆分到该表时才请求（`split` 会先并发请求全部工作表的摘要）；
+          `part_count` 的缓冲规则同 `iter_split_sheets`
+        """
+        it = iter(lines)
+        next_sheet: List[str] = []
+        for line in it:
+            m = _SHEET_RE.match(line)
+            if m:
+                next_sheet.append(m.group(1).strip())
+                break
+        while next_sheet:
+            sheet_name = next_sheet.pop()
+            table = _iter_sheet_table_lines(it, next_sheet)
+            header = next(table, None)
+            if header is None:
+                continue
+            builder = TableChunkBuilder(header, next(table, ""), self.max_rows_per_chunk, self.max_chars_per_chunk)
+            header_cells = _parse_markdown_header([header])
+            yield from self._sheet_chunks(sheet_name, header_cells, self._iter_parts(builder, table))
+
+    @staticmethod
+    def _iter_parts(builder: TableChunkBuilder, rows: Iterable[str]) -> Iterator[str]:
+        for row in rows:
+            md = builder.add(row)
+            if md is not None:
+                yield md
+        md = builder.finish()
+        if md is not None:
+            yield md
+
+    def _sheet_chunks(self, sheet_name: str, header_cells: List[str], parts: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        """为一个工作表的表格片段加上表名、Sheet 名与（首片段的）LLM 摘要前缀
+
+        - 片段先缓冲以便得到 `part_count`；超过 `max_buffered_parts` 个时改为逐个产出，
+          此时总数未知，该工作表所有片段的 `part_count` 为 None
+        """
+        buffered: List[str] = []
+        it = iter(parts)
+        for md in it:
+            buffered.append(md)
+            if len(buffered) > self.max_buffered_parts:
+                break
+        else:
+            if buffered:
+                yield from self._decorate(sheet_name, header_cells, buffered, len(buffered))
+            return
+        yield from self._decorate(sheet_name, header_cells, chain(buffered, it), None)
+
+    def _decorate(
+        self, sheet_name: str, header_cells: List[str], parts: Iterable[str], total_parts: Optional[int]
+    ) -> Iterator[Dict[str, Any]]:
+        summary = self._summary(sheet_name, header_cells) if self.use_llm_summary else ""
+        for idx, md in enumerate(parts, start=1):
+            prefix_lines = [
+                f"[Table] {self.table_name}",
+                f"[Sheet] {sheet_name}",
+            ]
+            if idx == 1 and summary:
+                prefix_lines.append(f"[TableSummary] {summary}")
+            content = ("\n".join(prefix_lines) + "\n" + md).strip()
+            yield {
+                "content": content,
+                "metadata": {
+                    "type": "table",
+                    "table_name": self.table_name,
+                    "sheet_name": sheet_name,
+                    "part_index": idx,
+                    "part_count": total_parts,
+                    "header": header_cells,
+                },
+            }
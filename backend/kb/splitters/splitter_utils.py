@@ -1,4 +1,5 @@
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
+from functools import lru_cache
 import json
 import re
 
@@ -24,39 +25,58 @@ def parse_json_array(s: str) -> List[Dict[str, Any]]:
     return []
 
 
+_WS_RE = re.compile(r"\s+")
+_TRAILING_PUNCT_RE = re.compile(r"[\.:;、，]+$")
+_PAGE_NUM_RE = re.compile(r"\b\d{1,5}\s*$")
+_PAGE_NUM_STRIP_RE = re.compile(r"\s*\b\d{1,5}\s*$")
+_LEADER_RE = re.compile(r"(?:[\.·•⋅\u2026\-]\s*){3,}")
+_NUMBERED_RE = re.compile(r"^\s*\d+(?:\.\d+)*\s*\.?\s+.+")
+_APPENDIX_RE = re.compile(r"^\s*appendix\s+(\d+|[a-z])\s*[\-–—\.]?\s+.+", re.IGNORECASE)
+_LETTER_RE = re.compile(r"[A-Za-z\u4e00-\u9fff]")
+TOC_TITLE_RE = re.compile(r"^\s*(table\s+of\s+contents|contents|目录)\b", re.IGNORECASE)
+
+
 def normalize_title(s: str) -> str:
     s = (s or "").strip().lower()
-    s = re.sub(r"\s+", " ", s)
-    s = re.sub(r"[\.:;、，]+$", "", s)
+    s = _WS_RE.sub(" ", s)
+    s = _TRAILING_PUNCT_RE.sub("", s)
     return s
 
 
+@lru_cache(maxsize=1 << 14)
 def is_toc_line(line: str) -> bool:
+    """判断一行是否为目录条目（编号/附录标题或带引导符的条目，末尾为页码）
+
+    结果按行文本缓存：目录识别、目录文本提取与标题扫描会先后检查同一批行
+    """
     s = (line or "").strip()
     if not s:
         return False
-    has_page_num = re.search(r"\b\d{1,5}\s*$", s) is not None
+    has_page_num = _PAGE_NUM_RE.search(s) is not None
     if not has_page_num:
         return False
 
-    body = re.sub(r"\s*\b\d{1,5}\s*$", "", s).strip()
+    body = _PAGE_NUM_STRIP_RE.sub("", s).strip()
     if not body:
         return False
 
-    leader = re.search(r"(?:[\.·•⋅\u2026\-]\s*){3,}", body) is not None
-    numbered = re.match(r"^\s*\d+(?:\.\d+)*\s*\.?\s+.+", body) is not None
-    appendix = (
-        re.match(r"^\s*appendix\s+(\d+|[a-z])\s*[\-–—\.]?\s+.+", body, re.IGNORECASE)
-        is not None
-    )
+    leader = _LEADER_RE.search(body) is not None
+    numbered = _NUMBERED_RE.match(body) is not None
+    appendix = _APPENDIX_RE.match(body) is not None
 
     if numbered or appendix:
         return True
-    if leader and re.search(r"[A-Za-z\u4e00-\u9fff]", body):
+    if leader and _LETTER_RE.search(body):
         return True
     return False
 
 
+_PAGE_RANGE_RE = re.compile(r"^\s*\d+\s*-\s*\d+\s*$")
+_PAGE_LABEL_RE = re.compile(r"^\s*page\s+\d+\b", re.IGNORECASE)
+_DOC_FIELD_RE = re.compile(r"^\s*(author|version|current issue date|first issue date)\b", re.IGNORECASE)
+_ORG_RE = re.compile(r"\b(archsd|property services branch)\b", re.IGNORECASE)
+
+
 def detect_toc_bounds(lines: List[str]) -> Optional[Tuple[int, int, str]]:
     """
     识别目录（TOC）在全文中的行区间。
@@ -68,7 +88,7 @@ def detect_toc_bounds(lines: List[str]) -> Optional[Tuple[int, int, str]]:
     probe_n = min(n, 5000)
     title_idx = None
     title = ""
-    title_re = re.compile(r"^\s*(table\s+of\s+contents|contents|目录)\b", re.IGNORECASE)
+    title_re = TOC_TITLE_RE
     for i, line in enumerate(lines[:probe_n]):
         if title_re.match(line or ""):
             title_idx = i
@@ -97,13 +117,13 @@ def detect_toc_bounds(lines: List[str]) -> Optional[Tuple[int, int, str]]:
             return True
         if title_re.match(s):
             return True
-        if re.match(r"^\s*\d+\s*-\s*\d+\s*$", s):
+        if _PAGE_RANGE_RE.match(s):
             return True
-        if re.match(r"^\s*page\s+\d+\b", s, re.IGNORECASE):
+        if _PAGE_LABEL_RE.match(s):
             return True
-        if re.match(r"^\s*(author|version|current issue date|first issue date)\b", s, re.IGNORECASE):
+        if _DOC_FIELD_RE.match(s):
             return True
-        if re.search(r"\b(archsd|property services branch)\b", s, re.IGNORECASE):
+        if _ORG_RE.search(s):
             return True
         return False
 
@@ -136,3 +156,58 @@ def detect_toc_bounds(lines: List[str]) -> Optional[Tuple[int, int, str]]:
     if end - start < 3:
         return None
     return (start, end, title or "Table of Contents")
+
+
+# 超长片段的切分边界，依次尝试：段落（空行）→ 行 → 句末标点；仍超长时按字符硬切
+_PARAGRAPH_END_RE = re.compile(r"\n[ \t]*\n\s*")
+_LINE_END_RE = re.compile(r"\n")
+_SENTENCE_END_RE = re.compile(r"[。！？；!?;]+[\"”’）)]*\s*|\.[\"”’)]*\s+")
+_BOUNDARIES = (_PARAGRAPH_END_RE, _LINE_END_RE, _SENTENCE_END_RE)
+
+
+def split_text_bounded(text: str, max_chars: int, level: int = 0) -> List[str]:
+    """把文本切成不超过 `max_chars` 个字符的若干段，优先在段落、行、句子边界切开
+
+    - 同一级边界切出的相邻小段会合并，直到再加一段就超限；单段仍超限时降到下一级边界
+    - 各段去除首尾空白，空段丢弃；`max_chars <= 0` 表示不限制
+    """
+    text = text or ""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text.strip()] if text.strip() else []
+    if level >= len(_BOUNDARIES):
+        return [p for p in (text[i:i + max_chars].strip() for i in range(0, len(text), max_chars)) if p]
+    ends = [m.end() for m in _BOUNDARIES[level].finditer(text)]
+    segments = [text[a:b] for a, b in zip([0] + ends, ends + [len(text)]) if b > a]
+    pieces: List[str] = []
+    cur = ""
+    for seg in segments:
+        if len(seg) > max_chars:
+            pieces.append(cur)
+            cur = ""
+            pieces.extend(split_text_bounded(seg, max_chars, level + 1))
+        elif len(cur) + len(seg) <= max_chars:
+            cur += seg
+        else:
+            pieces.append(cur)
+            cur = seg
+    pieces.append(cur)
+    return [p.strip() for p in pieces if p.strip()]
+
+
+def split_oversized(chunks: Iterable[Dict[str, Any]], max_chars: int) -> Iterator[Dict[str, Any]]:
+    """拆分器后处理：内容超过 `max_chars` 的片段按 `split_text_bounded` 再切分
+
+    - 每段沿用原片段的元数据（含 `path`），并记录 `part_index`（从 1 开始）与 `part_count`
+    - 未超限的片段原样产出；`max_chars <= 0` 时不做处理
+    """
+    for chunk in chunks:
+        content = chunk.get("content") or ""
+        if max_chars <= 0 or len(content) <= max_chars:
+            yield chunk
+            continue
+        parts = split_text_bounded(content, max_chars)
+        for idx, part in enumerate(parts, start=1):
+            yield {
+                "content": part,
+                "metadata": {**(chunk.get("metadata") or {}), "part_index": idx, "part_count": len(parts)},
+            }
@@ -0,0 +1,358 @@
+from typing import List, Dict, Any, Optional, Iterable, Iterator
+from contextlib import contextmanager
+import argparse
+import json
+import os
+import sqlite3
+import numpy as np
+
+from .chunk_store import ChunkStore, ChunkWriter, JsonChunkStore
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'done',
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_filename ON files(filename);
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT,
+    embedding BLOB,
+    updated_at REAL NOT NULL DEFAULT (julianday('now'))
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chunks_file_chunk ON chunks(file_id, chunk_index);
+CREATE TABLE IF NOT EXISTS chunks_staging (
+    file_id INTEGER NOT NULL,
+    chunk_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    metadata TEXT,
+    embedding BLOB
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_staging_file ON chunks_staging(file_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+    content, content='chunks', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+CREATE TRIGGER IF NOT EXISTS chunks_au AFTER UPDATE OF content ON chunks BEGIN
+    INSERT INTO chunks_fts(chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    INSERT INTO chunks_fts(rowid, content) VALUES (new.id, new.content);
+END;
+"""
+
+_FILE_COLUMNS = {"id", "filename", "chunk_count", "status"}
+
+
+class SqliteChunkStore(ChunkStore):
+    """基于单个 SQLite 数据库（WAL 模式）的存储后端
+
+    - 位置：`data/kb/{kb_id}/kb.sqlite`
+    - `files` 表保存文件元信息（未知字段序列化到 `extra`），`chunks` 表按 `(file_id, chunk_index)` 建唯一索引
+    - `chunks_fts` 为 FTS5（trigram 分词）外部内容表，用于关键词检索的候选预筛；
+      查询含长度 < 3 的 token（如两字中文词）时 trigram 无法匹配，`keyword_candidates` 返回 None，退回全量扫描
+    - 候选顺序与 JSON 后端的遍历顺序不同，关键词检索的同分排序不依赖遍历顺序，两个后端结果一致
+    - 写入片段与删除文件均在单个事务内完成，多进程并发写入由 SQLite 锁保证一致
+    """
+
+    name = "sqlite"
+
+    def __init__(self, base_dir: str = "data/kb"):
+        super().__init__(base_dir)
+        self._initialized: set[str] = set()
+
+    def db_path(self, kb_id: int) -> str:
+        return os.path.join(self.kb_dir(kb_id), "kb.sqlite")
+
+    @contextmanager
+    def _connect(self, kb_id: int):
+        path = self.db_path(kb_id)
+        if path not in self._initialized or not os.path.exists(path):
+            os.makedirs(self.kb_dir(kb_id), exist_ok=True)
+            conn = sqlite3.connect(path, timeout=30)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized.add(path)
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def ensure_kb(self, kb_id: int) -> None:
+        with self._connect(kb_id):
+            pass
+
+    def reset_kb(self, kb_id: int) -> None:
+        with self._connect(kb_id) as conn:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM chunks")
+            conn.execute("INSERT OR REPLACE INTO kv(key, value) VALUES ('next_id', '1')")
+            self._bump_files_generation(conn)
+
+    @staticmethod
+    def _row_to_file(row: sqlite3.Row) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {}
+        if row["extra"]:
+            try:
+                rec.update(json.loads(row["extra"]))
+            except Exception:
+                pass
+        rec.update({
+            "id": int(row["id"]),
+            "filename": row["filename"],
+            "chunk_count": int(row["chunk_count"]),
+            "status": row["status"],
+        })
+        return rec
+
+    def load_files(self, kb_id: int) -> Dict[str, Any]:
+        with self._connect(kb_id) as conn:
+            rows = conn.execute("SELECT * FROM files ORDER BY position, id").fetchall()
+            nid = conn.execute("SELECT value FROM kv WHERE key = 'next_id'").fetchone()
+        files = [self._row_to_file(r) for r in rows]
+        next_id = int(nid["value"]) if nid else (max([f["id"] for f in files], default=0) + 1)
+        return {"files": files, "next_id": next_id}
+
+    def save_files(self, kb_id: int, data: Dict[str, Any]) -> None:
+        files = data.get("files", []) or []
+        with self._connect(kb_id) as conn:
+            conn.execute("DELETE FROM files")
+            conn.executemany(
+                "INSERT INTO files(id, position, filename, chunk_count, status, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        int(f["id"]),
+                        pos,
+                        str(f.get("filename", "")),
+                        int(f.get("chunk_count", 0) or 0),
+                        str(f.get("status", "done")),
+                        self._extra_json(f),
+                    )
+                    for pos, f in enumerate(files)
+                ],
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO kv(key, value) VALUES ('next_id', ?)",
+                (str(int(data.get("next_id", 1))),),
+            )
+            self._bump_files_generation(conn)
+
+    @staticmethod
+    def _bump_files_generation(conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "INSERT INTO kv(key, value) VALUES ('files_generation', '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    def files_version(self, kb_id: int) -> Optional[Any]:
+        with self._connect(kb_id) as conn:
+            row = conn.execute("SELECT value FROM kv WHERE key = 'files_generation'").fetchone()
+        return int(row["value"]) if row else 0
+
+    @staticmethod
+    def _extra_json(rec: Dict[str, Any]) -> Optional[str]:
+        extra = {k: v for k, v in rec.items() if k not in _FILE_COLUMNS}
+        return json.dumps(extra, ensure_ascii=False) if extra else None
+
+    @staticmethod
+    def _encode_embedding(emb: Optional[List[float]]) -> Optional[bytes]:
+        if emb is None:
+            return None
+        return np.asarray(emb, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _row_to_chunk(row: sqlite3.Row) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {
+            "file_id": int(row["file_id"]),
+            "chunk_index": int(row["chunk_index"]),
+            "content": row["content"],
+        }
+        if row["metadata"] is not None:
+            rec["metadata"] = json.loads(row["metadata"])
+        if "embedding" in row.keys() and row["embedding"] is not None:
+            rec["embedding"] = np.frombuffer(row["embedding"], dtype=np.float32).astype(float).tolist()
+        return rec
+
+    def _chunk_rows(self, file_id: int, records: List[Dict[str, Any]]) -> List[tuple]:
+        return [
+            (
+                int(file_id),
+                int(r["chunk_index"]),
+                str(r.get("content", "") or ""),
+                json.dumps(r["metadata"], ensure_ascii=False) if r.get("metadata") is not None else None,
+                self._encode_embedding(r.get("embedding")),
+            )
+            for r in records
+        ]
+
+    def write_chunks(self, kb_id: int, file_id: int, records: List[Dict[str, Any]]) -> None:
+        with self._connect(kb_id) as conn:
+            conn.execute("DELETE FROM chunks WHERE file_id = ?", (int(file_id),))
+            conn.executemany(
+                "INSERT INTO chunks(file_id, chunk_index, content, metadata, embedding) VALUES (?, ?, ?, ?, ?)",
+                self._chunk_rows(file_id, records),
+            )
+
+    def open_writer(self, kb_id: int, file_id: int) -> ChunkWriter:
+        return _SqliteChunkWriter(self, kb_id, file_id)
+
+    def read_chunks(self, kb_id: int, file_id: int, indices: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        with self._connect(kb_id) as conn:
+            if indices is None:
+                rows = conn.execute(
+                    "SELECT * FROM chunks WHERE file_id = ? ORDER BY chunk_index", (int(file_id),)
+                ).fetchall()
+            else:
+                want = sorted(set(int(i) for i in indices))
+                rows = []
+                # 分批绑定参数，避免超出 SQLite 变量数上限
+                for k in range(0, len(want), 500):
+                    part = want[k:k + 500]
+                    rows.extend(conn.execute(
+                        f"SELECT file_id, chunk_index, content, metadata FROM chunks WHERE file_id = ? AND chunk_index IN ({','.join('?' * len(part))}) ORDER BY chunk_index",
+                        (int(file_id), *part),
+                    ).fetchall())
+        return [self._row_to_chunk(r) for r in rows]
+
+    def iter_file_chunks(self, kb_id: int, file_id: int) -> Iterator[Dict[str, Any]]:
+        with self._connect(kb_id) as conn:
+            for r in conn.execute(
+                "SELECT file_id, chunk_index, content, metadata FROM chunks WHERE file_id = ? ORDER BY rowid", (int(file_id),)
+            ):
+                yield self._row_to_chunk(r)
+
+    def iter_chunks(self, kb_id: int) -> Iterator[Dict[str, Any]]:
+        with self._connect(kb_id) as conn:
+            for r in conn.execute("SELECT file_id, chunk_index, content, metadata FROM chunks ORDER BY file_id, chunk_index"):
+                yield self._row_to_chunk(r)
+
+    def keyword_candidates(self, kb_id: int, tokens: List[str]) -> Optional[Iterator[Dict[str, Any]]]:
+        # trigram 分词只能检索长度 ≥ 3 的子串，存在更短的 token 时交由调用方全量扫描以保证结果一致
+        if not tokens or any(len(t) < 3 for t in tokens):
+            return None
+        expr = " OR ".join('"' + t.replace('"', '""') + '"' for t in tokens)
+
+        def _gen() -> Iterator[Dict[str, Any]]:
+            with self._connect(kb_id) as conn:
+                rows = conn.execute(
+                    "SELECT c.file_id, c.chunk_index, c.content, c.metadata FROM chunks_fts "
+                    "JOIN chunks c ON c.id = chunks_fts.rowid WHERE chunks_fts MATCH ?",
+                    (expr,),
+                )
+                for r in rows:
+                    yield self._row_to_chunk(r)
+
+        return _gen()
+
+    def delete_file(self, kb_id: int, file_id: int) -> bool:
+        with self._connect(kb_id) as conn:
+            cur = conn.execute("DELETE FROM files WHERE id = ?", (int(file_id),))
+            if cur.rowcount == 0:
+                return False
+            conn.execute("DELETE FROM chunks WHERE file_id = ?", (int(file_id),))
+            self._bump_files_generation(conn)
+        return True
+
+    def chunks_mtime(self, kb_id: int, file_id: int) -> Optional[float]:
+        with self._connect(kb_id) as conn:
+            row = conn.execute(
+                "SELECT MAX(updated_at) AS t FROM chunks WHERE file_id = ?", (int(file_id),)
+            ).fetchone()
+        if not row or row["t"] is None:
+            return None
+        # julianday → Unix 秒
+        return (float(row["t"]) - 2440587.5) * 86400.0
+
+
+class _SqliteChunkWriter(ChunkWriter):
+    """逐批写入 `chunks_staging` 暂存表（不触发全文索引），提交时在单个事务内替换 `chunks` 中该文件的记录"""
+
+    def __init__(self, store: SqliteChunkStore, kb_id: int, file_id: int):
+        super().__init__(store, kb_id, file_id)
+        with store._connect(kb_id) as conn:
+            conn.execute("DELETE FROM chunks_staging WHERE file_id = ?", (int(file_id),))
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        with self.store._connect(self.kb_id) as conn:
+            conn.executemany(
+                "INSERT INTO chunks_staging(file_id, chunk_index, content, metadata, embedding) VALUES (?, ?, ?, ?, ?)",
+                self.store._chunk_rows(self.file_id, records),
+            )
+        self.count += len(records)
+
+    def commit(self) -> None:
+        with self.store._connect(self.kb_id) as conn:
+            conn.execute("DELETE FROM chunks WHERE file_id = ?", (int(self.file_id),))
+            conn.execute(
+                "INSERT INTO chunks(file_id, chunk_index, content, metadata, embedding) "
+                "SELECT file_id, chunk_index, content, metadata, embedding FROM chunks_staging "
+                "WHERE file_id = ? ORDER BY rowid",
+                (int(self.file_id),),
+            )
+            conn.execute("DELETE FROM chunks_staging WHERE file_id = ?", (int(self.file_id),))
+
+    def abort(self) -> None:
+        with self.store._connect(self.kb_id) as conn:
+            conn.execute("DELETE FROM chunks_staging WHERE file_id = ?", (int(self.file_id),))
+
+
+def migrate_json_to_sqlite(base_dir: str, kb_id: int) -> Dict[str, int]:
+    """将某个知识库的 `files.json` + `chunks/*.json` 目录结构迁移到 `kb.sqlite`
+
+    - 旧文件保留不删除；重复执行会以 JSON 内容覆盖数据库中的同名记录
+    - 返回迁移的文件数与片段数
+    """
+    src = JsonChunkStore(base_dir)
+    dst = SqliteChunkStore(base_dir)
+    meta = src.load_files(kb_id)
+    dst.save_files(kb_id, meta)
+    n_chunks = 0
+    for f in meta.get("files", []):
+        fid = int(f["id"])
+        records = src.read_chunks(kb_id, fid)
+        dst.write_chunks(kb_id, fid, records)
+        n_chunks += len(records)
+    return {"files": len(meta.get("files", [])), "chunks": n_chunks}
+
+
+def main():
+    """命令行入口：迁移 JSON 目录结构到 SQLite"""
+    parser = argparse.ArgumentParser(description="迁移知识库存储：JSON 目录结构 → SQLite")
+    parser.add_argument("--base_dir", default=os.path.join("data", "kb"), help="知识库根目录")
+    parser.add_argument("--kb", type=int, default=None, help="知识库ID，不传则迁移全部")
+    args = parser.parse_args()
+
+    if args.kb is not None:
+        kb_ids = [args.kb]
+    else:
+        kb_ids = sorted(int(n) for n in os.listdir(args.base_dir) if n.isdigit())
+    for kb_id in kb_ids:
+        stats = migrate_json_to_sqlite(args.base_dir, kb_id)
+        print(f"KB {kb_id}: 迁移文件 {stats['files']} 个，片段 {stats['chunks']} 条")
+
+
+if __name__ == "__main__":
+    main()
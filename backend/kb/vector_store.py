@@ -1,8 +1,89 @@
+import io
 import os
 import json
 import shutil
-from typing import List, Dict, Any, Optional
+import tempfile
+from typing import List, Dict, Any, Optional, Iterable, Tuple
 import numpy as np
+from .chunk_blocks import tmp_path_for
+
+
+def append_npy_rows(path: str, rows: np.ndarray) -> bool:
+    """在二维 `.npy` 文件末尾原地追加若干行，并改写头部中的形状
+
+    - 先写数据再改头部：中途失败时旧头部仍描述原有的行，多出的尾部字节被读取方忽略
+    - 文件格式不符（非二维、列数或 dtype 不一致、Fortran 顺序）或新头部长度变化时不做修改并返回 False，
+      由调用方回退为整体重写
+    """
+    rows = np.ascontiguousarray(rows)
+    if rows.ndim != 2:
+        return False
+    fmt = np.lib.format
+    with open(path, "r+b") as f:
+        version = fmt.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = fmt.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran, dtype = fmt.read_array_header_2_0(f)
+        else:
+            return False
+        data_off = f.tell()
+        if fortran or len(shape) != 2 or dtype != rows.dtype or shape[1] != rows.shape[1]:
+            return False
+        header = io.BytesIO()
+        d = {"descr": fmt.dtype_to_descr(dtype), "fortran_order": False, "shape": (shape[0] + rows.shape[0], shape[1])}
+        if version == (1, 0):
+            fmt.write_array_header_1_0(header, d)
+        else:
+            fmt.write_array_header_2_0(header, d)
+        if header.tell() != data_off:
+            return False
+        f.seek(data_off + shape[0] * shape[1] * dtype.itemsize)
+        f.write(rows.tobytes())
+        f.truncate()
+        f.flush()
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+
+class RowSpool:
+    """定长向量行的临时落盘缓冲：逐批追加，结束后以内存映射数组读回，避免整份向量常驻内存"""
+
+    def __init__(self, dir: Optional[str] = None, dtype: Any = np.float64):
+        self.dtype = np.dtype(dtype)
+        fd, self.path = tempfile.mkstemp(suffix=".spool", dir=dir)
+        self._f = os.fdopen(fd, "wb")
+        self.rows = 0
+        self.dim: Optional[int] = None
+
+    def append(self, rows: np.ndarray) -> Tuple[int, int]:
+        """追加若干行，返回其在缓冲中的行区间 `[start, end)`"""
+        arr = np.ascontiguousarray(rows, dtype=self.dtype)
+        if arr.ndim == 1:
+            arr = arr.reshape(1, -1)
+        if self.dim is None:
+            self.dim = int(arr.shape[1])
+        elif arr.shape[0] and arr.shape[1] != self.dim:
+            raise ValueError("向量维度不一致，无法写入同一缓冲")
+        start = self.rows
+        self._f.write(arr.tobytes())
+        self.rows += int(arr.shape[0])
+        return start, self.rows
+
+    def array(self) -> Optional[np.ndarray]:
+        """以只读内存映射返回全部行；尚无数据时返回 None"""
+        self._f.flush()
+        if not self.rows or not self.dim:
+            return None
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+
+    def close(self) -> None:
+        try:
+            self._f.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
 
 
 class LocalVectorStore:
@@ -11,6 +92,8 @@ class LocalVectorStore:
     - 存储位置：`data/kb/{kb_id}/vector_store/`
       - `embeddings.npy`：形状为 (N, D) 的向量矩阵
       - `meta.json`：长度为 N 的元信息列表，对应每个向量的来源与预览
+      - `sentences.npy` / `sentences_index.npy`（可选旁路）：片段内句子向量（float16）与
+        形如 (file_id, chunk_index, start, end) 的行区间索引，供 late-interaction 重排使用
     """
 
     def __init__(self, base_dir: str = "data/kb"):
@@ -25,6 +108,12 @@ class LocalVectorStore:
     def _meta_path(self, kb_id: int) -> str:
         return os.path.join(self._store_dir(kb_id), "meta.json")
 
+    def _sent_path(self, kb_id: int) -> str:
+        return os.path.join(self._store_dir(kb_id), "sentences.npy")
+
+    def _sent_index_path(self, kb_id: int) -> str:
+        return os.path.join(self._store_dir(kb_id), "sentences_index.npy")
+
     def _ensure_store(self, kb_id: int) -> None:
         os.makedirs(self._store_dir(kb_id), exist_ok=True)
         mp = self._meta_path(kb_id)
@@ -44,29 +133,156 @@ class LocalVectorStore:
         meta_path = self._meta_path(kb_id)
 
         new_embs = np.asarray([it["embedding"] for it in items], dtype=float)
-        if os.path.exists(emb_path):
+        self._append_embeddings(emb_path, new_embs)
+
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta.extend(self._meta_entry(it) for it in items)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @staticmethod
+    def _meta_entry(it: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "file_id": int(it["file_id"]),
+            "chunk_index": int(it["chunk_index"]),
+            "filename": it.get("filename", ""),
+            "metadata": it.get("metadata"),
+            "preview": it.get("preview"),
+        }
+
+    @staticmethod
+    def _append_embeddings(emb_path: str, new_embs: np.ndarray) -> None:
+        """追加向量行：优先原地追加，格式不符时整体重写"""
+        if not os.path.exists(emb_path):
+            np.save(emb_path, np.asarray(new_embs, dtype=float))
+            return
+        old = np.load(emb_path, mmap_mode="r")
+        if old.ndim == 1:
+            old = old.reshape(1, -1)
+        if old.shape[0] and old.shape[1] != new_embs.shape[1]:
+            raise ValueError("嵌入维度不一致，无法追加到现有向量存储")
+        del old
+        if not append_npy_rows(emb_path, np.asarray(new_embs, dtype=float)):
             old = np.load(emb_path)
+            np.save(emb_path, np.vstack([old.reshape(-1, new_embs.shape[1]), new_embs]))
+
+    def replace_file_items(self, kb_id: int, file_id: int, embeddings: np.ndarray, items: List[Dict[str, Any]], block_rows: int = 4096) -> int:
+        """用一次重写替换某个文件的全部向量：保留其他文件的行并追加新行（同时清除所有墓碑行）
+
+        - `embeddings` 与 `items` 一一对应，可传入内存映射数组；新矩阵经 `open_memmap` 分段拷贝写出，
+          不会同时在内存中持有新旧两份向量
+        - `items` 的元素字段同 `add_items`（不含 `embedding`）
+        - 返回被替换掉的该文件有效向量行数
+        """
+        self._ensure_store(kb_id)
+        emb_path = self._emb_path(kb_id)
+        meta_path = self._meta_path(kb_id)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        old = None
+        if os.path.exists(emb_path):
+            old = np.load(emb_path, mmap_mode="r")
             if old.ndim == 1:
                 old = old.reshape(1, -1)
-            if old.shape[1] != new_embs.shape[1]:
-                raise ValueError("嵌入维度不一致，无法追加到现有向量存储")
-            all_embs = np.vstack([old, new_embs])
+        n_old = int(old.shape[0]) if old is not None else 0
+        live = [i for i, m in enumerate(meta[:n_old]) if not m.get("deleted")]
+        keep = np.asarray([i for i in live if int(meta[i].get("file_id", -1)) != int(file_id)], dtype=np.int64)
+        replaced = len(live) - len(keep)
+        n_new = int(embeddings.shape[0]) if embeddings is not None else 0
+        dim = int(embeddings.shape[1]) if n_new else (int(old.shape[1]) if old is not None else 0)
+        if old is not None and n_new and old.shape[0] and old.shape[1] != dim:
+            raise ValueError("嵌入维度不一致，无法追加到现有向量存储")
+        total = len(keep) + n_new
+        if total == 0:
+            if os.path.exists(emb_path):
+                os.remove(emb_path)
         else:
-            all_embs = new_embs
-        np.save(emb_path, all_embs)
+            tmp_path = tmp_path_for(emb_path[:-len(".npy")]) + ".npy"
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=float, shape=(total, dim))
+            for k in range(0, len(keep), block_rows):
+                part = keep[k:k + block_rows]
+                out[k:k + len(part)] = old[part]
+            for k in range(0, n_new, block_rows):
+                part = embeddings[k:k + block_rows]
+                out[len(keep) + k:len(keep) + k + len(part)] = part
+            out.flush()
+            del out, old
+            os.replace(tmp_path, emb_path)
+        new_meta = [meta[i] for i in keep.tolist()]
+        new_meta.extend(self._meta_entry(it) for it in items)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(new_meta, f, ensure_ascii=False, indent=2)
+        return replaced
+
+    def apply_file_delta(
+        self,
+        kb_id: int,
+        file_id: int,
+        removed: Iterable[int],
+        embeddings: Optional[np.ndarray],
+        items: List[Dict[str, Any]],
+        updates: Optional[Dict[int, Dict[str, Any]]] = None,
+    ) -> None:
+        """增量更新某个文件的向量：删除的片段只在元信息中标记墓碑，新增向量原地追加
 
+        - `removed`：要删除的 chunk_index；对应行标记 `deleted`，检索时跳过，向量矩阵不重写
+        - `embeddings` / `items`：新增的向量与元信息（同 `replace_file_items`）
+        - `updates`：保留片段的元信息更新 `{旧 chunk_index: {"chunk_index": 新编号, "metadata": ..., "preview": ...}}`，
+          按更新前的编号匹配，可用于重新编号
+        - 墓碑行占比超过 `KB_VECTOR_COMPACT_RATIO`（默认 0.3）时整体压缩一次
+        """
+        self._ensure_store(kb_id)
+        emb_path = self._emb_path(kb_id)
+        meta_path = self._meta_path(kb_id)
         with open(meta_path, "r", encoding="utf-8") as f:
             meta = json.load(f)
-        for it in items:
-            meta.append({
-                "file_id": int(it["file_id"]),
-                "chunk_index": int(it["chunk_index"]),
-                "filename": it.get("filename", ""),
-                "metadata": it.get("metadata"),
-                "preview": it.get("preview"),
-            })
+        removed = set(int(i) for i in removed)
+        updates = updates or {}
+        for m in meta:
+            if int(m.get("file_id", -1)) != int(file_id) or m.get("deleted"):
+                continue
+            idx = int(m.get("chunk_index", -1))
+            if idx in removed:
+                m["deleted"] = True
+            elif idx in updates:
+                m.update(updates[idx])
+        if embeddings is not None and len(items):
+            self._append_embeddings(emb_path, np.asarray(embeddings, dtype=float))
+            meta.extend(self._meta_entry(it) for it in items)
         with open(meta_path, "w", encoding="utf-8") as f:
             json.dump(meta, f, ensure_ascii=False, indent=2)
+        dead = sum(1 for m in meta if m.get("deleted"))
+        if meta and dead / len(meta) > float(os.getenv("KB_VECTOR_COMPACT_RATIO", "0.3")):
+            self.compact(kb_id)
+
+    def compact(self, kb_id: int) -> int:
+        """重写向量矩阵与元信息，清除墓碑行，返回清除的行数"""
+        meta_path = self._meta_path(kb_id)
+        if not os.path.exists(meta_path):
+            return 0
+        with open(meta_path, "r", encoding="utf-8") as f:
+            dead = sum(1 for m in json.load(f) if m.get("deleted"))
+        if dead:
+            # 以“替换一个不存在的文件”完成一次去墓碑的重写
+            self.replace_file_items(kb_id, -1, np.zeros((0, 0)), [])
+        return dead
+
+    def file_vector_rows(self, kb_id: int, file_id: int) -> Tuple[Dict[int, int], Optional[np.ndarray]]:
+        """返回某个文件有效向量的 `{chunk_index: 行号}` 及向量矩阵（内存映射，只读），不存在时矩阵为 None"""
+        emb_path = self._emb_path(kb_id)
+        meta_path = self._meta_path(kb_id)
+        if not os.path.exists(emb_path) or not os.path.exists(meta_path):
+            return {}, None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        embs = np.load(emb_path, mmap_mode="r")
+        rows = {
+            int(m.get("chunk_index", -1)): i
+            for i, m in enumerate(meta[:embs.shape[0]])
+            if int(m.get("file_id", -1)) == int(file_id) and not m.get("deleted")
+        }
+        return rows, embs
 
     def query_embeddings(self, kb_id: int, query_vec: np.ndarray, top_k: int = 5) -> List[Dict[str, Any]]:
         """以查询向量进行相似度检索，返回 Top-K 元信息与分数"""
@@ -89,9 +305,14 @@ class LocalVectorStore:
         sims = np.zeros(embs.shape[0], dtype=float)
         sims[nonzero] = (embs[nonzero] @ q) / (norms[nonzero] * qn)
 
-        idxs = np.argsort(-sims)[:top_k]
         with open(meta_path, "r", encoding="utf-8") as f:
             meta = json.load(f)
+        # 墓碑行与（追加中断导致的）无元信息的行不参与排序
+        sims[len(meta):] = -np.inf
+        for i, m in enumerate(meta[:len(sims)]):
+            if m.get("deleted"):
+                sims[i] = -np.inf
+        idxs = [i for i in np.argsort(-sims)[:top_k] if np.isfinite(sims[i])]
         results: List[Dict[str, Any]] = []
         for i in idxs:
             m = meta[i]
@@ -150,6 +371,193 @@ class LocalVectorStore:
                 os.remove(emb_path)
         return delete_count
 
+    def add_sentence_vectors(self, kb_id: int, items: List[Dict[str, Any]]) -> None:
+        """追加片段的句子向量旁路数据
+
+        - 每个 `items` 的元素需包含：`file_id`、`chunk_index`、`vectors`（形状为 (S, D) 的数组）
+        """
+        items = [it for it in items if len(it.get("vectors", [])) > 0]
+        if not items:
+            return
+        self._ensure_store(kb_id)
+        sent_path = self._sent_path(kb_id)
+        index_path = self._sent_index_path(kb_id)
+        new_vecs = np.vstack([np.asarray(it["vectors"], dtype=np.float16) for it in items])
+        spans: List[Tuple[int, int, int]] = []
+        pos = 0
+        for it in items:
+            n = len(it["vectors"])
+            spans.append((int(it["file_id"]), pos, pos + n, int(it["chunk_index"])))
+            pos += n
+        old_index = np.load(index_path) if os.path.exists(sent_path) and os.path.exists(index_path) else np.zeros((0, 4), dtype=np.int64)
+        base = self._append_sentence_rows(sent_path, index_path, new_vecs)
+        rows = [[fid, idx, base + start, base + end] for fid, start, end, idx in spans]
+        np.save(index_path, np.vstack([old_index.reshape(-1, 4), np.asarray(rows, dtype=np.int64)]))
+
+    @staticmethod
+    def _append_sentence_rows(sent_path: str, index_path: str, new_vecs: np.ndarray) -> int:
+        """向句子向量文件追加行（优先原地追加），返回新行的起始行号"""
+        if not (os.path.exists(sent_path) and os.path.exists(index_path)):
+            np.save(sent_path, new_vecs)
+            return 0
+        old_vecs = np.load(sent_path, mmap_mode="r")
+        base = int(old_vecs.shape[0])
+        if base and old_vecs.shape[1] != new_vecs.shape[1]:
+            raise ValueError("句子向量维度不一致，无法追加到现有旁路存储")
+        del old_vecs
+        if not append_npy_rows(sent_path, new_vecs):
+            old_vecs = np.load(sent_path)
+            np.save(sent_path, np.vstack([old_vecs.reshape(-1, new_vecs.shape[1]), new_vecs]))
+        return base
+
+    def replace_file_sentence_vectors(
+        self,
+        kb_id: int,
+        file_id: int,
+        vectors: np.ndarray,
+        spans: Iterable[Tuple[int, int, int]],
+        block_rows: int = 65536,
+    ) -> None:
+        """用一次重写替换某个文件的句子向量旁路
+
+        - `vectors` 为该文件全部句子向量（可为内存映射数组），`spans` 为 `(chunk_index, start, end)` 行区间
+        """
+        self._ensure_store(kb_id)
+        sent_path = self._sent_path(kb_id)
+        index_path = self._sent_index_path(kb_id)
+        old_vecs = None
+        old_index = np.zeros((0, 4), dtype=np.int64)
+        if os.path.exists(sent_path) and os.path.exists(index_path):
+            old_vecs = np.load(sent_path, mmap_mode="r")
+            old_index = np.load(index_path)
+        kept = old_index[old_index[:, 0] != int(file_id)] if old_index.size else old_index
+        n_new = int(vectors.shape[0]) if vectors is not None else 0
+        dim = int(vectors.shape[1]) if n_new else (int(old_vecs.shape[1]) if old_vecs is not None else 0)
+        if old_vecs is not None and n_new and old_vecs.shape[0] and old_vecs.shape[1] != dim:
+            raise ValueError("句子向量维度不一致，无法追加到现有旁路存储")
+        n_kept = int((kept[:, 3] - kept[:, 2]).sum()) if kept.size else 0
+        total = n_kept + n_new
+        if total == 0:
+            for p in (sent_path, index_path):
+                if os.path.exists(p):
+                    os.remove(p)
+            return
+        tmp_path = tmp_path_for(sent_path[:-len(".npy")]) + ".npy"
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float16, shape=(total, dim))
+        rows: List[List[int]] = []
+        pos = 0
+        for fid, idx, start, end in kept.tolist():
+            out[pos:pos + (end - start)] = old_vecs[start:end]
+            rows.append([fid, idx, pos, pos + (end - start)])
+            pos += end - start
+        for k in range(0, n_new, block_rows):
+            part = vectors[k:k + block_rows]
+            out[pos + k:pos + k + len(part)] = part
+        for idx, start, end in spans:
+            if end > start:
+                rows.append([int(file_id), int(idx), pos + int(start), pos + int(end)])
+        out.flush()
+        del out, old_vecs
+        os.replace(tmp_path, sent_path)
+        np.save(index_path, np.asarray(rows, dtype=np.int64).reshape(-1, 4))
+
+    def apply_file_sentence_delta(
+        self,
+        kb_id: int,
+        file_id: int,
+        removed: Iterable[int],
+        vectors: Optional[np.ndarray],
+        spans: Iterable[Tuple[int, int, int]],
+        remap: Optional[Dict[int, int]] = None,
+    ) -> None:
+        """增量更新某个文件的句子向量：移除删除片段的索引行，新增向量原地追加
+
+        - 被移除片段的向量行成为孤行，占比超过 `KB_VECTOR_COMPACT_RATIO` 时整体压缩
+        - `remap`：保留片段的 `{旧 chunk_index: 新 chunk_index}`，在移除之后、追加之前改写索引行
+        - `vectors` / `spans` 同 `replace_file_sentence_vectors`（`spans` 使用新编号）
+        """
+        self._ensure_store(kb_id)
+        sent_path = self._sent_path(kb_id)
+        index_path = self._sent_index_path(kb_id)
+        removed = set(int(i) for i in removed)
+        index = np.zeros((0, 4), dtype=np.int64)
+        if os.path.exists(sent_path) and os.path.exists(index_path):
+            index = np.load(index_path).reshape(-1, 4)
+        if removed and index.size:
+            drop = np.asarray([fid == int(file_id) and idx in removed for fid, idx, _, __ in index.tolist()], dtype=bool)
+            index = index[~drop]
+        if remap and index.size:
+            index = index.copy()
+            for k, (fid, idx, _, __) in enumerate(index.tolist()):
+                if fid == int(file_id) and idx in remap:
+                    index[k, 1] = remap[idx]
+        rows: List[List[int]] = []
+        if vectors is not None and len(vectors):
+            base = self._append_sentence_rows(sent_path, index_path, np.asarray(vectors, dtype=np.float16))
+            rows = [[int(file_id), int(idx), base + int(start), base + int(end)] for idx, start, end in spans if end > start]
+        if not os.path.exists(sent_path):
+            return
+        index = np.vstack([index, np.asarray(rows, dtype=np.int64).reshape(-1, 4)])
+        np.save(index_path, index)
+        total = int(np.load(sent_path, mmap_mode="r").shape[0])
+        live = int((index[:, 3] - index[:, 2]).sum()) if index.size else 0
+        if total and (total - live) / total > float(os.getenv("KB_VECTOR_COMPACT_RATIO", "0.3")):
+            # 以“替换一个不存在的文件”完成一次去孤行的重写
+            self.replace_file_sentence_vectors(kb_id, -1, None, [])
+
+    def load_sentence_vectors(self, kb_id: int, pairs: List[tuple[int, int]]) -> Dict[tuple[int, int], np.ndarray]:
+        """按 (file_id, chunk_index) 读取句子向量（内存映射，仅拷贝命中的行）
+
+        - 旁路缺失或无法读取时返回空字典；索引行超出 `sentences.npy` 行数（两者不同步）时跳过该行，
+          对应候选由重排方按缺少句子向量处理
+        """
+        sent_path = self._sent_path(kb_id)
+        index_path = self._sent_index_path(kb_id)
+        if not pairs or not os.path.exists(sent_path) or not os.path.exists(index_path):
+            return {}
+        try:
+            index = np.load(index_path).reshape(-1, 4)
+            vecs = np.load(sent_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return {}
+        if vecs.ndim != 2:
+            return {}
+        n_rows = int(vecs.shape[0])
+        want = {(int(f), int(i)) for f, i in pairs}
+        out: Dict[tuple[int, int], np.ndarray] = {}
+        for fid, idx, start, end in index.tolist():
+            if (fid, idx) in want and 0 <= start < end <= n_rows:
+                out[(fid, idx)] = np.asarray(vecs[start:end], dtype=np.float32)
+        return out
+
+    def delete_sentence_vectors(self, kb_id: int, file_id: int) -> int:
+        """删除某个文件的句子向量旁路数据，返回删除的句子数"""
+        sent_path = self._sent_path(kb_id)
+        index_path = self._sent_index_path(kb_id)
+        if not os.path.exists(sent_path) or not os.path.exists(index_path):
+            return 0
+        index = np.load(index_path)
+        drop = index[:, 0] == int(file_id)
+        if not drop.any():
+            return 0
+        vecs = np.load(sent_path)
+        keep_rows = index[~drop]
+        parts: List[np.ndarray] = []
+        new_index: List[List[int]] = []
+        pos = 0
+        for fid, idx, start, end in keep_rows.tolist():
+            parts.append(vecs[start:end])
+            new_index.append([fid, idx, pos, pos + (end - start)])
+            pos += end - start
+        removed = int(vecs.shape[0] - pos)
+        if parts:
+            np.save(sent_path, np.vstack(parts))
+            np.save(index_path, np.asarray(new_index, dtype=np.int64))
+        else:
+            os.remove(sent_path)
+            os.remove(index_path)
+        return removed
+
     def clear(self, kb_id: int) -> None:
         """清空指定知识库的向量存储目录"""
         dirp = self._store_dir(kb_id)
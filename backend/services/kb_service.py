@@ -1,14 +1,20 @@
+import hashlib
 import os
 import re
 import json
-from typing import Any, Dict, List, Optional
+import tempfile
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional
 from datetime import datetime
 
 from backend.kb.knowledge_base import PersistentKnowledgeBaseController
+from backend.kb.jobs import IngestionWorkerPool, IngestJobStore, default_queue_path, enqueue_image_job
 
 
 KB_CTRL = PersistentKnowledgeBaseController(base_dir=os.path.join("data", "kb"))
 
+_INGEST_POOL: Optional[IngestionWorkerPool] = None
+_JOB_STORE: Optional[IngestJobStore] = None
+
 
 def now_ts() -> int:
     """返回当前UTC时间戳（毫秒）"""
@@ -126,15 +132,9 @@ def list_files(kb_id: str) -> List[Dict[str, Any]]:
         fid = int(f.get("id"))
         filename = f.get("filename")
         chunk_count = int(f.get("chunk_count", 0))
-        chunks_path = os.path.join(KB_CTRL._chunks_dir(kb_int), f"{fid}.json")
-        created_at = int(os.path.getmtime(chunks_path)) * 1000 if os.path.exists(chunks_path) else now_ts()
-        lower = (str(filename or "")).lower()
-        if lower.endswith(".pdf"):
-            ftype = "application/pdf"
-        elif lower.endswith(".xlsx"):
-            ftype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        else:
-            ftype = "application/octet-stream"
+        mtime = KB_CTRL._chunks_mtime(kb_int, fid)
+        created_at = int(mtime) * 1000 if mtime is not None else now_ts()
+        ftype = _upload_type(str(filename or ""))
         status = str(f.get("status", "done"))
         out.append({
             "id": f"f-{fid}",
@@ -148,45 +148,173 @@ def list_files(kb_id: str) -> List[Dict[str, Any]]:
     return out
 
 
-def save_upload(kb_id: str, name: str, content_b64: Optional[str]) -> Dict[str, Any]:
-    """保存上传文件（可选Base64内容）并入库为未向量化"""
-    kb_int = parse_kb_id(kb_id)
-    KB_CTRL._ensure_kb(kb_int)
-    lower = name.lower()
-    uploads_dir = os.path.join(KB_CTRL._kb_dir(kb_int), "uploads")
-    os.makedirs(uploads_dir, exist_ok=True)
-    saved_path = os.path.join(uploads_dir, name)
-    if content_b64:
-        import base64
-        with open(saved_path, "wb") as f:
-            f.write(base64.b64decode(content_b64))
-    meta = KB_CTRL._load_files(kb_int)
-    files = meta.get("files", [])
-    existing = None
-    for f in files:
-        if str(f.get("filename")) == name:
-            existing = f
-            break
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+
+class UploadTooLarge(ValueError):
+    """上传文件超过大小上限（`KB_UPLOAD_MAX_MB`）"""
+
+
+def upload_max_bytes() -> int:
+    """单个上传文件的大小上限（字节），由 `KB_UPLOAD_MAX_MB` 控制（默认 200MB）"""
+    return int(float(os.getenv("KB_UPLOAD_MAX_MB", "200")) * (1 << 20))
+
+
+# 支持上传与入库的文件类型：扩展名 → MIME 类型
+UPLOAD_TYPES = {
+    ".pdf": "application/pdf",
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".chm": "application/vnd.ms-htmlhelp",
+}
+
+
+def _upload_type(name: str) -> str:
+    return UPLOAD_TYPES.get(os.path.splitext(name.lower())[1], "application/octet-stream")
+
+
+def is_supported_upload(name: str) -> bool:
+    return os.path.splitext(str(name or "").lower())[1] in UPLOAD_TYPES
+
+
+class UploadWriter:
+    """分块写入某个知识库的上传文件，边写边计算 sha256 并检查大小上限
+
+    - 写入 `uploads/` 下的临时文件，`commit` 时收入 blob 存储（相同内容只保存一份）并原子替换同名文件；`abort` 丢弃临时文件
+    - 超过 `max_bytes` 时删除临时文件并抛出 `UploadTooLarge`，已有的同名文件保持不变
+    """
+
+    def __init__(self, kb_id: str, name: str, max_bytes: Optional[int] = None):
+        self.kb_int = parse_kb_id(kb_id)
+        # 客户端提供的文件名可能带路径，只保留文件名部分
+        self.name = os.path.basename(str(name).replace("\\", "/")).strip()
+        if not self.name:
+            raise ValueError("文件名不能为空")
+        KB_CTRL._ensure_kb(self.kb_int)
+        uploads_dir = os.path.join(KB_CTRL._kb_dir(self.kb_int), "uploads")
+        os.makedirs(uploads_dir, exist_ok=True)
+        self.path = os.path.join(uploads_dir, self.name)
+        self.max_bytes = upload_max_bytes() if max_bytes is None else int(max_bytes)
+        self.size = 0
+        self._sha = hashlib.sha256()
+        self._f = tempfile.NamedTemporaryFile(dir=uploads_dir, prefix=".upload-", suffix=".part", delete=False)
+
+    def write(self, data: bytes) -> None:
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.abort()
+            raise UploadTooLarge(f"文件超过大小上限 {self.max_bytes // (1 << 20)}MB：{self.name}")
+        self._sha.update(data)
+        self._f.write(data)
+
+    def copy_from(self, fileobj: BinaryIO) -> None:
+        """从文件对象按 `UPLOAD_CHUNK_BYTES` 分块读取并写入"""
+        for data in iter(lambda: fileobj.read(UPLOAD_CHUNK_BYTES), b""):
+            self.write(data)
+
+    def commit(self) -> Dict[str, Any]:
+        """收入内容寻址存储后链接为 `uploads/{文件名}`，并登记为未向量化"""
+        self._f.close()
+        sha = self._sha.hexdigest()
+        KB_CTRL._blobs.put_file(self._f.name, sha)
+        KB_CTRL._blobs.link(sha, self.path)
+        return _register_upload(self.kb_int, self.name, sha256=sha, size=self.size)
+
+    def abort(self) -> None:
+        if not self._f.closed:
+            self._f.close()
+        if os.path.exists(self._f.name):
+            os.remove(self._f.name)
+
+
+def _iter_base64_chunks(content_b64: str) -> Iterable[bytes]:
+    """按固定窗口分段解码 Base64，不生成去空白后的完整副本
+
+    - 每个窗口去除空白（换行等）后，按 4 字符对齐解码，不足 4 的余下字符并入下一个窗口
+    """
+    import base64
+    step = (UPLOAD_CHUNK_BYTES // 3) * 4
+    carry = ""
+    for k in range(0, len(content_b64), step):
+        text = carry + "".join(content_b64[k:k + step].split())
+        cut = len(text) - len(text) % 4
+        carry = text[cut:]
+        if cut:
+            yield base64.b64decode(text[:cut])
+    if carry:
+        # 残缺的结尾交给解码器报错（binascii.Error）
+        yield base64.b64decode(carry)
+
+
+def _register_upload(kb_int: int, name: str, **fields: Any) -> Dict[str, Any]:
+    """登记（或重置）上传文件的记录为未向量化，返回文件信息"""
+    existing = KB_CTRL._file_by_name(kb_int, name)
     if existing:
-        existing["chunk_count"] = 0
-        existing["status"] = "uploaded"
-        KB_CTRL._save_files(kb_int, meta)
         fid = int(existing.get("id"))
+        # 内容已变，原入库键失效
+        KB_CTRL._update_file(kb_int, fid, chunk_count=0, status="uploaded", ingest_key=None, **fields)
+        KB_CTRL._derived.forget(kb_int, fid)
     else:
         info = KB_CTRL.add_file(kb_int, filename=name, chunk_count=0, status="uploaded")
         fid = int(info.id)
-    ftype = "application/pdf" if lower.endswith(".pdf") else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        if fields:
+            KB_CTRL._update_file(kb_int, fid, **fields)
     return {
         "id": f"f-{fid}",
         "kbId": format_kb_id(kb_int),
         "name": name,
-        "type": ftype,
+        "type": _upload_type(name),
         "createdAt": now_ts(),
         "chunkCount": 0,
         "status": "uploaded",
+        "sha256": fields.get("sha256"),
+        "size": fields.get("size"),
     }
 
 
+def save_upload(kb_id: str, name: str, content_b64: Optional[str]) -> Dict[str, Any]:
+    """保存上传文件（可选Base64内容）并入库为未向量化"""
+    if content_b64:
+        writer = UploadWriter(kb_id, name)
+        try:
+            for data in _iter_base64_chunks(content_b64):
+                writer.write(data)
+            return writer.commit()
+        except BaseException:
+            writer.abort()
+            raise
+    kb_int = parse_kb_id(kb_id)
+    KB_CTRL._ensure_kb(kb_int)
+    return _register_upload(kb_int, name)
+
+
+def save_upload_stream(kb_id: str, name: str, fileobj: BinaryIO) -> Dict[str, Any]:
+    """从文件对象（如 multipart 上传的临时文件）分块保存上传文件，见 `UploadWriter`"""
+    writer = UploadWriter(kb_id, name)
+    try:
+        writer.copy_from(fileobj)
+        return writer.commit()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def save_upload_from_blob(kb_id: str, name: str, sha256: str) -> Dict[str, Any]:
+    """以已上传过的内容（按 sha256）登记上传文件，无需再次传输；内容不存在时抛出 FileNotFoundError"""
+    sha = str(sha256 or "").strip().lower()
+    if not re.fullmatch(r"[0-9a-f]{64}", sha) or not KB_CTRL._blobs.has(sha):
+        raise FileNotFoundError("内容不存在，请先上传文件")
+    kb_int = parse_kb_id(kb_id)
+    KB_CTRL._ensure_kb(kb_int)
+    name = os.path.basename(str(name).replace("\\", "/")).strip()
+    if not name:
+        raise ValueError("文件名不能为空")
+    uploads_dir = os.path.join(KB_CTRL._kb_dir(kb_int), "uploads")
+    os.makedirs(uploads_dir, exist_ok=True)
+    KB_CTRL._blobs.link(sha, os.path.join(uploads_dir, name))
+    size = os.path.getsize(KB_CTRL._blobs.path(sha))
+    return _register_upload(kb_int, name, sha256=sha, size=size)
+
+
 def read_file_chunks(kb_id: str, file_id: str) -> List[Dict[str, Any]]:
     """读取指定文件的全部片段内容"""
     kb_int = parse_kb_id(kb_id)
@@ -198,24 +326,23 @@ def read_file_chunks(kb_id: str, file_id: str) -> List[Dict[str, Any]]:
     return [c.__dict__ for c in chunks]
 
 
-def ingest_uploaded_file(kb_id: str, filename: str) -> Dict[str, Any]:
-    """向量化处理上传到uploads目录的PDF或Excel文件"""
+def ingest_uploaded_file(kb_id: str, filename: str, incremental: Optional[bool] = None) -> Dict[str, Any]:
+    """向量化处理上传到uploads目录的PDF、Excel或CHM文件
+
+    - `incremental`：增量入库，只嵌入新增或改动的片段；返回的 `ingest` 为新增/保留/删除的片段数
+    """
     kb_int = parse_kb_id(kb_id)
     KB_CTRL._ensure_kb(kb_int)
-    lower = filename.lower()
     uploads_dir = os.path.join(KB_CTRL._kb_dir(kb_int), "uploads")
     src_path = os.path.join(uploads_dir, filename)
     if not os.path.exists(src_path):
         raise FileNotFoundError("文件不存在，请先上传")
-    from kb.ingestion import ingest_pdf, ingest_excel
-    if lower.endswith(".pdf"):
-        info = ingest_pdf(KB_CTRL, kb_int, src_path)
-        ftype = "application/pdf"
-    elif lower.endswith(".xlsx"):
-        info = ingest_excel(KB_CTRL, kb_int, src_path)
-        ftype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    else:
-        raise ValueError("仅支持 PDF 或 Excel(xlsx)")
+    from backend.kb.ingestion import ingest_file
+    info = ingest_file(KB_CTRL, kb_int, src_path, incremental=incremental)
+    # 延后提取的图片交给后台任务渲染
+    if enqueue_image_job(job_store(), KB_CTRL, kb_int, filename) is not None and _INGEST_POOL is not None:
+        _INGEST_POOL.wake()
+    ftype = _upload_type(filename)
     meta = KB_CTRL._load_files(kb_int)
     files = meta.get("files", [])
     chunk_count = 0
@@ -231,6 +358,8 @@ def ingest_uploaded_file(kb_id: str, filename: str) -> Dict[str, Any]:
         "createdAt": now_ts(),
         "chunkCount": chunk_count,
         "status": "done",
+        "ingest": info.stats,
+        "sheets": info.sheets,
     }
 
 
@@ -250,3 +379,96 @@ def delete_file_global(file_id: str) -> None:
         if KB_CTRL.deleteFile(kb_int, fid):
             return
     raise FileNotFoundError("文件不存在")
+
+
+def job_store() -> IngestJobStore:
+    """获取入库任务队列（与工作进程池共享同一数据库）"""
+    global _JOB_STORE
+    if _INGEST_POOL is not None:
+        return _INGEST_POOL.store
+    if _JOB_STORE is None:
+        _JOB_STORE = IngestJobStore(default_queue_path(KB_CTRL.base_dir))
+    return _JOB_STORE
+
+
+def start_ingest_workers() -> IngestionWorkerPool:
+    """启动入库工作进程池（服务启动时调用，重复调用返回同一实例）"""
+    global _INGEST_POOL
+    if _INGEST_POOL is None:
+        _INGEST_POOL = IngestionWorkerPool(KB_CTRL.base_dir)
+        _INGEST_POOL.start()
+    return _INGEST_POOL
+
+
+def stop_ingest_workers() -> None:
+    """停止入库工作进程池（服务关闭时调用）"""
+    global _INGEST_POOL
+    if _INGEST_POOL is not None:
+        _INGEST_POOL.stop()
+        _INGEST_POOL = None
+
+
+def format_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """将任务记录转换为接口响应结构"""
+    return {
+        "id": job["id"],
+        "kbId": format_kb_id(int(job["kb_id"])),
+        "filename": job["filename"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "progress": job.get("progress") or {},
+        "error": job.get("error"),
+        "result": job.get("result"),
+        "createdAt": int(job["created_at"] * 1000),
+        "startedAt": int(job["started_at"] * 1000) if job.get("started_at") else None,
+        "finishedAt": int(job["finished_at"] * 1000) if job.get("finished_at") else None,
+    }
+
+
+def submit_ingest_job(kb_id: str, filename: str, incremental: bool = False) -> Dict[str, Any]:
+    """提交后台入库任务并立即返回任务信息，文件状态置为 `queued`；`incremental` 同 `ingest_uploaded_file`
+
+    - 同一文件已有排队中或运行中的入库任务时返回该任务，不会出现两个任务同时写同一文件
+    """
+    kb_int = parse_kb_id(kb_id)
+    KB_CTRL._ensure_kb(kb_int)
+    if not is_supported_upload(filename):
+        raise ValueError("仅支持 PDF、Excel(xlsx) 或 CHM")
+    src_path = os.path.join(KB_CTRL._kb_dir(kb_int), "uploads", filename)
+    record = KB_CTRL._file_by_name(kb_int, filename)
+    if record is None or not os.path.exists(src_path):
+        raise FileNotFoundError("文件不存在，请先上传")
+    # 该文件已有排队中或运行中的入库任务时返回该任务，不重复提交
+    job = job_store().enqueue(kb_int, filename, options={"incremental": True} if incremental else None)
+    if job["status"] == "queued":
+        KB_CTRL._update_file(kb_int, int(record["id"]), status="queued")
+    if _INGEST_POOL is not None:
+        _INGEST_POOL.wake()
+    return format_job(job)
+
+
+def get_ingest_job(job_id: str) -> Dict[str, Any]:
+    """查询入库任务状态与分阶段进度"""
+    job = job_store().get(job_id)
+    if job is None:
+        raise FileNotFoundError("任务不存在")
+    return format_job(job)
+
+
+def list_ingest_jobs(kb_id: str) -> List[Dict[str, Any]]:
+    """列出指定知识库最近的入库任务"""
+    kb_int = parse_kb_id(kb_id)
+    return [format_job(j) for j in job_store().list(kb_int)]
+
+
+def cancel_ingest_job(job_id: str) -> Dict[str, Any]:
+    """取消入库任务：排队中立即取消（文件状态恢复为 `uploaded`），运行中在下一个进度点停止"""
+    store = job_store()
+    job = store.request_cancel(job_id)
+    if job is None:
+        raise FileNotFoundError("任务不存在")
+    if job["status"] == "cancelled":
+        record = KB_CTRL._file_by_name(int(job["kb_id"]), job["filename"])
+        if record is not None and record.get("status") == "queued":
+            KB_CTRL._update_file(int(job["kb_id"]), int(record["id"]), status="uploaded")
+    return format_job(job)
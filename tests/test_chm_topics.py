@@ -0,0 +1,77 @@
+import os
+import sys
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.ingestion import _TopicsTreeParser, _chm_topic_chunks, _decode_html, _html_to_text, _parse_topics
+
+
+_HHC = """
+<HTML><BODY>
+<UL>
+  <LI><OBJECT type="text/sitemap"><param name="Name" value="概述"><param name="Local" value="html/intro.htm"></OBJECT>
+  <UL>
+    <LI><OBJECT type="text/sitemap"><param name="Name" value="安装"><param name="Local" value="html/install.htm#top"></OBJECT>
+    <LI><OBJECT type="text/sitemap"><param name="Name" value="目录节点"></OBJECT>
+    <UL>
+      <LI><OBJECT type="text/sitemap"><param name="Name" value="配置 &amp; 参数"><param name="Local" value="html/config.htm"></OBJECT>
+    </UL>
+  </UL>
+  <LI><OBJECT type="text/sitemap"><param name="Name" value="API"><param name="Local" value="html/api.htm"></OBJECT>
+</UL>
+</BODY></HTML>
+"""
+
+
+def test_topics_tree_parser_keeps_title_paths_in_order():
+    """目录树按出现顺序产出 (标题路径, 内部路径)，无页面的目录节点只作为路径前缀"""
+    parser = _TopicsTreeParser()
+    parser.feed(_HHC)
+    parser.close()
+    assert parser.topics == [
+        (["概述"], "html/intro.htm"),
+        (["概述", "安装"], "html/install.htm#top"),
+        (["概述", "目录节点", "配置 & 参数"], "html/config.htm"),
+        (["API"], "html/api.htm"),
+    ]
+
+
+def test_topic_html_decoding_and_text():
+    """按页面声明的字符集解码，脚本与样式不进入正文"""
+    raw = '<html><head><meta charset="gbk"><style>p{}</style></head><body><p>标题</p><script>x()</script><p>正文</p></body></html>'
+    text = _html_to_text(_decode_html(raw.encode("gbk")))
+    assert text.split("\n") == ["标题", "正文"]
+    assert _decode_html(b"\xff\xfe plain") == "\xff\xfe plain"
+
+
+def _pages(n):
+    return {f"/t{i}.htm": f"<html><body><h1>主题{i}</h1><p>内容 {i}</p></body></html>".encode("utf-8") for i in range(n)}
+
+
+def test_parse_topics_in_process_pool_keeps_order_and_reports_progress():
+    """多进程分批解析的结果与单进程一致且保持目录顺序；缺失页面产出空文本；extract 进度单调到达总数"""
+    pages = _pages(9)
+    topics = [([f"主题{i}"], f"/t{i}.htm") for i in range(9)] + [(["缺失"], "/missing.htm")]
+    reports = []
+    pooled = list(_parse_topics(topics, pages.get, workers=2, topics_per_task=2, progress=lambda *a: reports.append(a)))
+    single = list(_parse_topics(topics, pages.get, workers=1, topics_per_task=2))
+    assert pooled == single
+    assert [path for _, path, _ in pooled] == [path for _, path in topics]
+    assert pooled[3] == (["主题3"], "/t3.htm", "主题3\n内容 3")
+    assert pooled[-1] == (["缺失"], "/missing.htm", "")
+    assert reports[0] == ("extract", 0, 10) and reports[-1] == ("extract", 10, 10)
+    assert [d for _, d, _ in reports] == sorted(d for _, d, _ in reports)
+
+
+def test_topic_chunks_prefix_heading_and_skip_empty():
+    """每个主题单独切分，片段以标题路径开头，空主题不产生片段"""
+    topics = [(["概述", "安装"], "/install.htm", "步骤一 " * 200), (["空"], "/empty.htm", "  ")]
+    chunks = list(_chm_topic_chunks(topics, chunk_size=300, overlap=50))
+    assert len(chunks) > 1
+    assert all(c["content"].startswith("概述 > 安装\n") for c in chunks)
+    meta = chunks[-1]["metadata"]
+    assert (meta["topic"], meta["title"], meta["path"]) == ("/install.htm", "安装", ["概述", "安装"])
+    assert meta["part_index"] == meta["part_count"] == len(chunks)
@@ -0,0 +1,138 @@
+import os
+import sys
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.chunk_store import JsonChunkStore
+
+
+def _records(n, file_id=1):
+    return [
+        {"file_id": file_id, "chunk_index": i, "content": f"第{i}段 | 表头 | 值{i} " * (1 + i % 5), "metadata": {"n": i}}
+        for i in range(n)
+    ]
+
+
+def test_block_records_keep_unicode_line_separators(tmp_path):
+    """正文含 U+2028/U+2029/U+0085 时压缩块仍按记录完整读回，不被当作换行切开"""
+    store = JsonChunkStore(base_dir=str(tmp_path), compression="zlib")
+    recs = [{"file_id": 1, "chunk_index": 0, "content": "line\u2028sep\u2029para\u0085next"}] + _records(3)[1:]
+    store.write_chunks(1, 1, recs)
+    assert store.read_chunks(1, 1) == recs
+    assert [r["content"] for r in store.iter_chunks(1)] == [r["content"] for r in recs]
+
+
+def test_block_codecs_round_trip_with_random_access(tmp_path):
+    """zlib（含文件内共享字典）与 lzma 压缩均可完整读回，并可跨块边界按下标随机读取"""
+    from backend.kb.chunk_blocks import BlockFile, BlockWriter
+
+    recs = _records(200)
+    for codec in ("zlib", "lzma"):
+        path, index_path = str(tmp_path / f"{codec}.cblk"), str(tmp_path / f"{codec}.cidx.npy")
+        writer = BlockWriter(path, index_path, codec=codec, block_bytes=1024, dict_bytes=512, sample_bytes=2048)
+        for k in range(0, len(recs), 7):
+            writer.write(recs[k:k + 7])
+        stats = writer.commit()
+        assert stats["stored_bytes"] < stats["raw_bytes"]
+
+        bf = BlockFile(path, index_path)
+        assert bf.valid and bf.codec == writer.codec_id
+        assert (0 < bf.dict_len <= 512) if codec == "zlib" else bf.dict_len == 0
+        assert len({int(off) for off in bf.rows[:, 1]}) > 10
+        assert list(bf.iter_records()) == recs
+        picked = [0, 1, 57, 58, 59, 130, 199]
+        assert bf.read(picked) == {i: recs[i] for i in picked}
+
+
+def test_block_cache_is_invalidated_by_rewrite(tmp_path):
+    """改写同一文件（内容等长）后，按下标读取与全量遍历都返回新内容，不命中旧版本的块缓存"""
+    from backend.kb.chunk_blocks import BLOCK_CACHE
+
+    store = JsonChunkStore(base_dir=str(tmp_path), compression="zlib")
+    old = _records(50)
+    store.write_chunks(1, 1, old)
+    assert store.read_chunks(1, 1, [3, 40]) == [old[3], old[40]]
+    hits = BLOCK_CACHE.stats()["hits"]
+    assert store.read_chunks(1, 1, [41])
+    assert BLOCK_CACHE.stats()["hits"] > hits
+
+    new = [dict(r, content=r["content"].replace("值", "新")) for r in old]
+    store.write_chunks(1, 1, new)
+    assert store.read_chunks(1, 1, [3, 40, 41]) == [new[3], new[40], new[41]]
+    assert store.read_chunks(1, 1) == new
+
+
+def _strip(rec):
+    return {k: v for k, v in rec.items() if k != "embedding"}
+
+
+def test_jsonl_random_read_falls_back_without_valid_index(tmp_path):
+    """偏移索引缺失、字节数不符或偏移处记录不符时，按下标读取退回顺序扫描且结果正确"""
+    import shutil
+
+    store = JsonChunkStore(base_dir=str(tmp_path))
+    recs = [dict(r, embedding=[0.1, 0.2]) for r in _records(30)]
+    store.write_chunks(1, 1, recs)
+    index_path = store._index_path(1, 1)
+    picked = [0, 7, 29]
+    expected = [_strip(recs[i]) for i in picked]
+    assert store.read_chunks(1, 1, picked) == expected
+
+    # 索引缺失
+    os.remove(index_path)
+    assert store.read_chunks(1, 1, [1, 8]) == [_strip(recs[1]), _strip(recs[8])]
+
+    # 索引来自另一版本的数据：首行字节数不符
+    store.write_chunks(1, 1, recs[:10])
+    shutil.copy(index_path, str(tmp_path / "short.idx.npy"))
+    store.write_chunks(1, 1, recs)
+    shutil.copy(str(tmp_path / "short.idx.npy"), index_path)
+    assert store.read_chunks(1, 1, [2, 9, 20]) == [_strip(recs[i]) for i in (2, 9, 20)]
+
+    # 数据已替换为等长的新内容而索引仍是旧的：偏移处记录与下标不符
+    swapped = [dict(r, chunk_index=29 - r["chunk_index"]) for r in recs]
+    swapped.reverse()
+    store.write_chunks(1, 1, recs)
+    shutil.copy(index_path, str(tmp_path / "old.idx.npy"))
+    store.write_chunks(1, 1, swapped)
+    shutil.copy(str(tmp_path / "old.idx.npy"), index_path)
+    assert os.path.getsize(store._chunk_path(1, 1)) == int(__import__("numpy").load(index_path)[0, 1])
+    by_ci = {r["chunk_index"]: _strip(r) for r in swapped}
+    assert store.read_chunks(1, 1, [3, 11, 25]) == [by_ci[3], by_ci[11], by_ci[25]]
+
+
+def test_chunk_cache_not_stale_after_jsonl_rewrite(tmp_path):
+    """同一文件被等长内容改写后，按下标读取不再返回缓存中的旧记录"""
+    store = JsonChunkStore(base_dir=str(tmp_path))
+    old = _records(20)
+    store.write_chunks(1, 1, old)
+    assert store.read_chunks(1, 1, [4, 15]) == [old[4], old[15]]
+
+    new = [dict(r, content=r["content"].replace("值", "新")) for r in old]
+    store.write_chunks(1, 1, new)
+    assert os.path.getsize(store._chunk_path(1, 1)) > 0
+    assert store.read_chunks(1, 1, [4, 15]) == [new[4], new[15]]
+
+
+def test_files_meta_cache_sees_same_size_rewrite_from_other_writer(tmp_path):
+    """另一写入方在同一 mtime 刻度内写入等长的 files.json 时，缓存仍能识别并重新加载"""
+    from backend.kb.chunk_store import FilesMetaCache
+
+    writer = JsonChunkStore(base_dir=str(tmp_path))
+    reader = JsonChunkStore(base_dir=str(tmp_path))
+    cache = FilesMetaCache(reader)
+
+    files_path = writer._files_path(1)
+    writer.save_files(1, {"files": [{"id": 1, "filename": "a.txt", "status": "queued"}], "next_id": 2})
+    assert cache.get(1).by_id[1]["status"] == "queued"
+    st = os.stat(files_path)
+
+    writer.save_files(1, {"files": [{"id": 1, "filename": "a.txt", "status": "failed"}], "next_id": 2})
+    # 模拟两次写入落在同一时间刻度
+    os.utime(files_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert os.path.getsize(files_path) == st.st_size
+    assert cache.get(1).by_id[1]["status"] == "failed"
+    assert not [p for p in os.listdir(writer.kb_dir(1)) if p.endswith(".tmp")]
@@ -0,0 +1,119 @@
+import os
+import sys
+
+import numpy as np
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.embeddings import HashingEmbeddingProvider
+from backend.kb.knowledge_base import PersistentKnowledgeBaseController
+
+
+def test_incremental_save_embeds_only_changed_chunks(tmp_path):
+    """内容未变的片段沿用原编号且不重新嵌入；删除的片段不再被检索到"""
+    embedder = HashingEmbeddingProvider()
+    kb = PersistentKnowledgeBaseController(base_dir=str(tmp_path), embedder=embedder)
+    kb._ensure_kb(1)
+    fid = kb.add_file(1, "a.pdf", 0).id
+    v1 = [f"第{i}段 alpha beta {i}" for i in range(6)]
+    kb.save_chunks(1, fid, v1, incremental=True)
+
+    embedded = []
+    orig = embedder.embed_texts
+    embedder.embed_texts = lambda texts: embedded.extend(texts) or orig(texts)
+    v2 = v1[:2] + ["新增段落 gamma"] + v1[3:]
+    with kb.open_chunk_sink(1, fid, incremental=True) as sink:
+        for c in v2:
+            sink.add(c)
+
+    assert sink.stats == {"added": 1, "kept": 5, "removed": 1}
+    assert embedded == ["新增段落 gamma"]
+    indices = [r["chunk_index"] for r in kb._store.read_chunks(1, fid)]
+    assert sorted(indices) == [0, 1, 2, 3, 4, 5]
+    hits = kb._vstore.query_embeddings(1, np.asarray(orig([v1[2]])[0]), top_k=10)
+    assert v1[2] not in {h["preview"] for h in hits}
+    assert len(hits) == 6
+
+
+def test_incremental_reingest_keeps_document_order(tmp_path):
+    """中间插入、改动片段后重新入库，chunk_index 仍按文档顺序连续，向量随编号一起迁移"""
+    embedder = HashingEmbeddingProvider()
+    kb = PersistentKnowledgeBaseController(base_dir=str(tmp_path), embedder=embedder)
+    kb._ensure_kb(1)
+    fid = kb.add_file(1, "a.pdf", 0).id
+    v1 = [f"第{i}段 alpha beta {i}" for i in range(6)]
+    kb.save_chunks(1, fid, v1, incremental=True)
+    v2 = v1[:2] + ["插入段落 gamma", "改动后的第2段 delta"] + v1[3:]
+    with kb.open_chunk_sink(1, fid, incremental=True) as sink:
+        for c in v2:
+            sink.add(c)
+
+    kb._update_file(1, fid, chunk_count=sink.count)
+    count = kb._file_by_name(1, "a.pdf")["chunk_count"]
+    assert count == len(v2)
+    chunks = kb.readFileChunks(1, [{"fileId": fid, "chunkIndex": i} for i in range(count)])
+    assert [c["content"] for c in chunks] == v2
+    for i, text in enumerate(v2):
+        hit = kb._vstore.query_embeddings(1, np.asarray(embedder.embed_texts([text])[0]), top_k=1)[0]
+        assert (hit["chunk_index"], hit["preview"]) == (i, text)
+
+
+def test_same_content_reuses_derived_index_across_kbs(tmp_path):
+    """同一内容、同一拆分与嵌入配置在另一个知识库入库时直接复制片段与向量，不再嵌入"""
+    import shutil
+    from backend.kb.ingestion import ingest_file
+
+    src = os.path.join(ROOT_DIR, "tests", "testfiles", "excel", "CAT_Sub CAT Code Master List.xlsx")
+    embedder = HashingEmbeddingProvider()
+    kb = PersistentKnowledgeBaseController(base_dir=str(tmp_path), embedder=embedder)
+    embedded = []
+    orig = embedder.embed_texts
+    embedder.embed_texts = lambda texts: embedded.extend(texts) or orig(texts)
+    for kb_id in (1, 2):
+        kb._ensure_kb(kb_id)
+        uploads = os.path.join(kb._kb_dir(kb_id), "uploads")
+        os.makedirs(uploads, exist_ok=True)
+        path = shutil.copy(src, uploads)
+        kb.add_file(kb_id, os.path.basename(src), 0, status="uploaded")
+        embedded.clear()
+        ingest_file(kb, kb_id, path)
+
+    assert embedded == []
+    first = kb._store.read_chunks(1, 1)
+    assert [c["content"] for c in kb._store.read_chunks(2, 1)] == [c["content"] for c in first]
+    q = np.asarray(orig([first[3]["content"]])[0])
+    assert kb._vstore.query_embeddings(2, q, top_k=1)[0]["chunk_index"] == first[3]["chunk_index"]
+
+
+def _bump_file_field(base_dir, file_id, rounds):
+    kb = PersistentKnowledgeBaseController(base_dir=base_dir, embedder=HashingEmbeddingProvider())
+    for i in range(rounds):
+        kb._update_file(1, file_id, counter=i + 1)
+        kb.add_file(1, f"p{file_id}-{i}.txt", 0)
+
+
+def test_files_meta_updates_from_several_processes_are_not_lost(tmp_path):
+    """多个进程同时读-改-写 files.json 时，各自的更新与新增记录都被保留"""
+    import multiprocessing
+
+    import pytest
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("需要 fork 启动方式")
+    kb = PersistentKnowledgeBaseController(base_dir=str(tmp_path), embedder=HashingEmbeddingProvider())
+    ids = [kb.add_file(1, f"{n}.txt", 0).id for n in ("a", "b", "c")]
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_bump_file_field, args=(str(tmp_path), fid, 15)) for fid in ids]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    files = kb._load_files(1)["files"]
+    assert [f.get("counter") for f in files if f["id"] in ids] == [15, 15, 15]
+    assert len(files) == 3 + 3 * 15
+    assert len({f["id"] for f in files}) == len(files)
@@ -0,0 +1,111 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.jobs import IngestJobStore, IngestionWorkerPool, JobCancelled, JobProgress
+
+
+def test_job_queue_claims_in_order_and_recovers(tmp_path):
+    """任务按提交顺序被领取；重启后遗留的运行中任务重新排队"""
+    store = IngestJobStore(str(tmp_path / "jobs.sqlite"))
+    a = store.enqueue(1, "a.pdf")
+    b = store.enqueue(1, "b.xlsx")
+    assert store.claim_next()["id"] == a["id"]
+    assert store.get(a["id"])["status"] == "running"
+    assert store.recover() == 1
+    assert [store.claim_next()["id"] for _ in range(2)] == [a["id"], b["id"]]
+    assert store.claim_next() is None
+
+
+def test_job_cancel_queued_and_running(tmp_path):
+    """排队任务立即取消；运行中的任务在下一个进度点抛出 JobCancelled"""
+    store = IngestJobStore(str(tmp_path / "jobs.sqlite"))
+    queued = store.enqueue(1, "a.pdf")
+    assert store.request_cancel(queued["id"])["status"] == "cancelled"
+
+    running = store.enqueue(1, "b.pdf")
+    store.claim_next()
+    progress = JobProgress(store, running["id"], min_interval=0.0)
+    progress("embed", 1, 4)
+    assert store.get(running["id"])["progress"]["embed"] == {"done": 1, "total": 4}
+    store.request_cancel(running["id"])
+    with pytest.raises(JobCancelled):
+        progress("embed", 2, 4)
+
+
+def test_enqueue_returns_active_job_for_same_file(tmp_path):
+    """同一文件已有排队中或运行中的任务时返回该任务；结束后可再次提交，图片任务单独计算"""
+    store = IngestJobStore(str(tmp_path / "jobs.sqlite"))
+    first = store.enqueue(1, "a.pdf")
+    assert store.enqueue(1, "a.pdf", options={"incremental": True})["id"] == first["id"]
+    store.claim_next()
+    assert store.enqueue(1, "a.pdf")["id"] == first["id"]
+    images = store.enqueue(1, "a.pdf", options={"task": "images"})
+    assert images["id"] != first["id"]
+    assert store.enqueue(2, "a.pdf")["id"] != first["id"]
+    store.finish(first["id"], "done")
+    assert store.enqueue(1, "a.pdf")["id"] not in {first["id"], images["id"]}
+
+
+class _BrokenExecutor:
+    def __init__(self):
+        self.shut = False
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("worker died")
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut = True
+
+
+def test_dispatcher_requeues_job_and_rebuilds_broken_pool(tmp_path):
+    """进程池损坏时已领取的任务放回队列、进程池被重建，调度线程继续运行"""
+    pool = IngestionWorkerPool(str(tmp_path / "kb"), queue_path=str(tmp_path / "jobs.sqlite"), workers=1, poll_interval=0.01)
+    broken, fresh = _BrokenExecutor(), _BrokenExecutor()
+    pool._executor = broken
+    pool._new_executor = lambda: fresh
+    job = pool.store.enqueue(1, "a.pdf")
+
+    assert pool._dispatch_once() is False
+    assert broken.shut and pool._executor is fresh
+    assert pool.store.get(job["id"])["status"] == "queued"
+
+    pool._thread = threading.Thread(target=pool._loop, daemon=True)
+    pool._thread.start()
+    time.sleep(0.1)
+    assert pool._thread.is_alive()
+    pool.stop()
+    assert pool.store.get(job["id"])["status"] == "queued"
+
+
+def test_on_done_records_cancelled_and_crashed_futures(tmp_path):
+    """被取消的 future 记为 cancelled，工作进程异常退出记为 failed，已自行记录结果的任务不被覆盖"""
+    from concurrent.futures import Future
+
+    pool = IngestionWorkerPool(str(tmp_path / "kb"), queue_path=str(tmp_path / "jobs.sqlite"), workers=3)
+    jobs = [pool.store.enqueue(1, name) for name in ("a.pdf", "b.pdf", "c.pdf")]
+    for _ in jobs:
+        pool.store.claim_next()
+
+    cancelled = Future()
+    assert cancelled.cancel()
+    pool._on_done(jobs[0]["id"], cancelled)
+    crashed = Future()
+    crashed.set_exception(BrokenProcessPool("killed"))
+    pool._on_done(jobs[1]["id"], crashed)
+    pool.store.finish(jobs[2]["id"], "done")
+    ok = Future()
+    ok.set_result({"id": jobs[2]["id"], "status": "done"})
+    pool._on_done(jobs[2]["id"], ok)
+
+    assert [pool.store.get(j["id"])["status"] for j in jobs] == ["cancelled", "failed", "done"]
+    assert "killed" in pool.store.get(jobs[1]["id"])["error"]
@@ -0,0 +1,49 @@
+import os
+import sys
+import threading
+import time
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.llm_client import LLMClient, PromptCache, StubLLM, set_default_llm_client
+from backend.kb.splitters.splitter_table import TableSplitter
+
+
+def test_sheet_summaries_run_concurrently_and_are_cached(tmp_path):
+    """各工作表摘要并发请求且不超过并发上限；同样的表格再次拆分时全部命中缓存"""
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def responder(messages):
+        with lock:
+            active.append(1)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.pop()
+        return "摘要：" + messages[-1][1][-20:]
+
+    stub = StubLLM(responder)
+    cache_path = str(tmp_path / "llm.sqlite")
+    set_default_llm_client(LLMClient(stub, cache=PromptCache(cache_path), max_concurrency=3))
+    try:
+        sheets = [(f"S{i}", [["编号", f"列{i}"], ["1", "a"]]) for i in range(6)]
+        splitter = TableSplitter(table_name="T", use_llm_summary=True)
+        splitter.prefetch_summaries([(name, rows[0]) for name, rows in sheets])
+        first = list(splitter.iter_split_sheets(sheets))
+        assert stub.calls == 6
+        assert max(peak) == 3
+        assert all("[TableSummary] 摘要：" in c["content"] for c in first)
+
+        # 新的客户端（如进程重启）读取同一持久化缓存，不再调用 LLM
+        stub2 = StubLLM(responder)
+        set_default_llm_client(LLMClient(stub2, cache=PromptCache(cache_path), max_concurrency=3))
+        again = list(TableSplitter(table_name="T", use_llm_summary=True).iter_split_sheets(sheets))
+        assert stub2.calls == 0
+        assert again == first
+    finally:
+        set_default_llm_client(None)
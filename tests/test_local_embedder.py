@@ -0,0 +1,98 @@
+import os
+import sys
+
+import numpy as np
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.embeddings import HashingEmbeddingProvider, get_embedder
+
+
+def test_local_embedder_is_deterministic_and_normalized():
+    """本地哈希嵌入在不同实例间结果一致，且为单位向量"""
+    a = HashingEmbeddingProvider(dim=128).embed_texts(["BIM Guide for Architectural Design", "结构 设计 指南"])
+    b = HashingEmbeddingProvider(dim=128).embed_texts(["BIM Guide for Architectural Design", "结构 设计 指南"])
+    assert a.shape == (2, 128)
+    assert np.allclose(a, b)
+    assert np.allclose(np.linalg.norm(a, axis=1), 1.0)
+
+
+def test_local_embedder_single_matches_batch_and_ranks_overlap():
+    """单条嵌入与批量一致，词面重叠更多的文本相似度更高"""
+    emb = get_embedder("local")
+    q = emb.embed_text("industry standards")
+    docs = emb.embed_texts(["industry standards", "Industry standards for BIM models", "drainage pipe sizing"])
+    assert np.allclose(q, docs[0])
+    sims = docs @ q
+    assert sims[1] > sims[2]
+
+
+def test_query_embedder_has_own_breaker_and_slo_timeout(monkeypatch, tmp_path):
+    """查询嵌入与入库嵌入使用不同的熔断器；查询超时取延迟 SLO；非预期错误不会被吞掉"""
+    import urllib.error
+    import pytest
+    from backend.kb.embeddings import get_default_embedder, get_query_embedder
+    from backend.kb.knowledge_base import PersistentKnowledgeBaseController
+
+    monkeypatch.setenv("EMBEDDING_BACKEND", "ollama")
+    monkeypatch.setenv("OLLAMA_TIMEOUT", "30")
+    monkeypatch.setenv("EMBED_CB_SLO_MS", "2000")
+    monkeypatch.delenv("EMBED_QUERY_TIMEOUT_S", raising=False)
+    ingest, query = get_default_embedder(), get_query_embedder()
+    assert ingest.breaker is not query.breaker
+    assert (ingest.timeout, query.timeout) == (30.0, 2.0)
+
+    class Failing:
+        def __init__(self, error):
+            self.error = error
+
+        def embed_text(self, text):
+            raise self.error
+
+    kb = PersistentKnowledgeBaseController(
+        base_dir=str(tmp_path),
+        embedder=HashingEmbeddingProvider(),
+        query_embedder=Failing(urllib.error.URLError("connection refused")),
+    )
+    kb._ensure_kb(1)
+    assert kb.search(1, "BIM") == []
+    kb._query_embedder = Failing(TypeError("bug"))
+    with pytest.raises(TypeError):
+        kb.search(1, "BIM")
+
+
+def test_breaker_probe_is_released_when_call_is_interrupted():
+    """半开探测被 BaseException 中断时释放探测名额，下一次调用仍可探测并在成功后关闭熔断"""
+    import pytest
+    from backend.kb.circuit_breaker import CircuitBreaker, CircuitOpenError
+    from backend.kb.embeddings import CircuitBreakingEmbedder
+
+    class Interrupted:
+        def __init__(self):
+            self.interrupt = True
+
+        def embed_text(self, text):
+            if self.interrupt:
+                raise KeyboardInterrupt()
+            return np.zeros(3, dtype=np.float32)
+
+    breaker = CircuitBreaker("test-probe", failure_threshold=1, slo_ms=0, reset_timeout=0)
+    provider = Interrupted()
+    embedder = CircuitBreakingEmbedder(provider, breaker)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    with pytest.raises(KeyboardInterrupt):
+        embedder.embed_text("q")
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        embedder.embed_text("q")
+    breaker.release_probe()
+
+    provider.interrupt = False
+    assert embedder.embed_text("q").shape == (3,)
+    assert breaker.state == CircuitBreaker.CLOSED
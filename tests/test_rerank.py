@@ -0,0 +1,224 @@
+import os
+import sys
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.rerank import RERANK_METRICS, CascadeReranker, CrossEncoderReranker, LateInteractionReranker, RerankBatcher, RerankScoreCache
+
+
+class _BrokenModel(CrossEncoderReranker):
+    def _ensure_model(self):
+        raise OSError("模型文件不存在")
+
+
+def test_cascade_records_fallback_when_model_unavailable():
+    """内层模型加载失败时级联重排返回初筛顺序，决策记为 fallback 而不是 band/full"""
+    initial = [
+        {"file_id": 1, "chunk_index": i, "source": "semantic", "score": 0.5 - i * 0.01, "preview": f"p{i}"}
+        for i in range(4)
+    ]
+    before = RERANK_METRICS.snapshot()["decisions"].get("fallback", 0)
+    cascade = CascadeReranker(_BrokenModel(fallback_on_error=False), budget_ms=0)
+    out = cascade.rerank("q", initial, lambda f, i: f"内容{i}", top_k=3)
+    assert [r["chunk_index"] for r in out] == [0, 1, 2]
+    assert {r["rerank_decision"] for r in out} == {"fallback"}
+    assert RERANK_METRICS.snapshot()["decisions"]["fallback"] == before + 1
+
+    plain = _BrokenModel().rerank("q", initial, lambda f, i: f"内容{i}", top_k=2)
+    assert [r["chunk_index"] for r in plain] == [0, 1]
+
+
+def test_model_load_failure_is_retried_after_backoff(monkeypatch):
+    """模型加载失败后在退避时间内复用错误，超过退避时间再次尝试加载"""
+    import types
+    import pytest
+    from backend.kb import rerank
+
+    attempts = []
+
+    class FlakyCrossEncoder:
+        def __init__(self, name):
+            attempts.append(name)
+            if len(attempts) == 1:
+                raise OSError("暂时无法加载")
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers", types.SimpleNamespace(CrossEncoder=FlakyCrossEncoder))
+    now = [100.0]
+    monkeypatch.setattr(rerank.time, "monotonic", lambda: now[0])
+    model = CrossEncoderReranker(model_name="m")
+    model.retry_seconds = 30
+    for _ in range(2):
+        with pytest.raises(OSError):
+            model._ensure_model()
+    assert len(attempts) == 1
+    now[0] += 31
+    model._ensure_model()
+    assert len(attempts) == 2 and isinstance(model._model, FlakyCrossEncoder)
+
+
+def test_batcher_is_off_by_default(monkeypatch):
+    """未设置 `KB_RERANK_BATCH_WINDOW_MS` 时不启用跨请求微批，设置后才启用"""
+    monkeypatch.delenv("KB_RERANK_BATCH_WINDOW_MS", raising=False)
+    assert CrossEncoderReranker(model_name="m")._batcher is None
+    monkeypatch.setenv("KB_RERANK_BATCH_WINDOW_MS", "4")
+    assert CrossEncoderReranker(model_name="m")._batcher.window_ms == 4.0
+
+
+def test_batcher_merges_concurrent_requests_and_splits_scores():
+    """窗口内的并发请求合并为一次推理，各请求按原顺序拿回自己的分数"""
+    import threading
+
+    calls = []
+
+    def predict(pairs):
+        calls.append(len(pairs))
+        return [float(len(p)) for _, p in pairs]
+
+    batcher = RerankBatcher(predict, window_ms=200, max_batch=64)
+    requests = [[("q", "a" * (10 * r + i)) for i in range(1, 4)] for r in range(3)]
+    results = [None] * 3
+    barrier = threading.Barrier(3)
+
+    def worker(r):
+        barrier.wait()
+        results[r] = batcher.submit(requests[r]).result(timeout=5)
+
+    threads = [threading.Thread(target=worker, args=(r,)) for r in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [9]
+    assert results == [[float(len(p)) for _, p in req] for req in requests]
+
+
+def test_batcher_propagates_errors_to_every_caller():
+    """一批推理失败时，批内每个请求都收到同一异常；之后的批次不受影响"""
+    import pytest
+
+    fail = [True]
+
+    def predict(pairs):
+        if fail[0]:
+            raise RuntimeError("推理失败")
+        return [1.0] * len(pairs)
+
+    batcher = RerankBatcher(predict, window_ms=100, max_batch=64)
+    futs = [batcher.submit([("q", f"p{i}")]) for i in range(3)]
+    for f in futs:
+        with pytest.raises(RuntimeError, match="推理失败"):
+            f.result(timeout=5)
+    fail[0] = False
+    assert batcher.submit([("q", "p"), ("q", "r")]).result(timeout=5) == [1.0, 1.0]
+
+
+def test_score_cache_hit_miss_and_lru_eviction():
+    """命中与未命中分别计数；超出容量时淘汰最久未使用的键；键区分模型与查询，查询按空白与大小写归一化"""
+    cache = RerankScoreCache(max_size=2)
+    a = cache.make_key("m1", "Invoice  Approval", "内容A")
+    b = cache.make_key("m1", "invoice approval", "内容B")
+    c = cache.make_key("m1", "invoice approval", "内容C")
+    assert a == cache.make_key("m1", " invoice approval ", "内容A")
+    assert a != cache.make_key("m2", "invoice approval", "内容A")
+    assert a != cache.make_key("m1", "invoice", "内容A")
+
+    assert cache.get_many([a]) == {}
+    cache.put_many({a: 0.1, b: 0.2})
+    assert cache.get_many([a]) == {a: 0.1}
+    cache.put_many({c: 0.3})
+    assert cache.get_many([a, b, c]) == {a: 0.1, c: 0.3}
+    assert cache.stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 2}
+    assert cache.get_many([cache.make_key("m2", "invoice approval", "内容A")]) == {}
+
+
+class _CountingModel(CrossEncoderReranker):
+    def __init__(self, model_name, cache):
+        super().__init__(model_name=model_name)
+        self._batcher = None
+        self.score_cache = cache
+        self.predicted = []
+
+    def _ensure_model(self):
+        pass
+
+    def _predict(self, pairs):
+        self.predicted.extend(pairs)
+        return [float(len(p)) for _, p in pairs]
+
+
+def test_cross_encoder_reuses_cached_scores_per_model_and_query():
+    """相同模型与查询的片段只推理一次；换查询或换模型（共享缓存）时重新推理"""
+    cache = RerankScoreCache(max_size=100)
+    initial = [{"file_id": 1, "chunk_index": i, "preview": ""} for i in range(3)]
+    load = lambda f, i: "x" * (i + 1)
+
+    m1 = _CountingModel("m1", cache)
+    out = m1.rerank("Query", initial, load, top_k=3)
+    assert [r["chunk_index"] for r in out] == [2, 1, 0]
+    assert len(m1.predicted) == 3
+    m1.rerank("query ", initial, load, top_k=3)
+    assert len(m1.predicted) == 3
+    m1.rerank("another query", initial, load, top_k=3)
+    assert len(m1.predicted) == 6
+
+    m2 = _CountingModel("m2", cache)
+    m2.rerank("query", initial, load, top_k=3)
+    assert len(m2.predicted) == 3
+
+
+def _late_candidates():
+    return [
+        {"file_id": 1, "chunk_index": 0, "source": "semantic", "score": 0.9},
+        {"file_id": 1, "chunk_index": 1, "source": "semantic", "score": 0.5},
+        {"file_id": 1, "chunk_index": 2, "source": "keyword", "score": 3.0},
+    ]
+
+
+def test_late_interaction_uses_sentence_sidecar(tmp_path):
+    """句子向量旁路存在时以 MaxSim 打分，缺少句子向量的语义候选沿用初筛分数，关键词候选排在最后"""
+    import numpy as np
+    from backend.kb.vector_store import LocalVectorStore
+
+    vstore = LocalVectorStore(base_dir=str(tmp_path))
+    q = np.asarray([1.0, 0.0, 0.0], dtype=np.float32)
+    vstore.add_sentence_vectors(1, [
+        {"file_id": 1, "chunk_index": 0, "vectors": [[0.0, 1.0, 0.0], [0.6, 0.8, 0.0]]},
+        {"file_id": 1, "chunk_index": 2, "vectors": [[1.0, 0.0, 0.0]]},
+    ])
+    vec_map = vstore.load_sentence_vectors(1, [(1, 0), (1, 1), (1, 2)])
+    assert set(vec_map) == {(1, 0), (1, 2)}
+
+    out = LateInteractionReranker().rerank("q", _late_candidates(), lambda f, i: "", top_k=3, query_vec=q, load_vectors=lambda f, i: vec_map.get((f, i)))
+    assert [r["chunk_index"] for r in out] == [2, 0, 1]
+    assert [round(r["rerank_score"], 2) for r in out] == [1.0, 0.6, 0.5]
+
+
+def test_late_interaction_falls_back_without_valid_sidecar(tmp_path):
+    """旁路缺失、索引超出向量行数或维度不符时，候选按缺少句子向量处理，不报错"""
+    import numpy as np
+    from backend.kb.vector_store import LocalVectorStore
+
+    vstore = LocalVectorStore(base_dir=str(tmp_path))
+    q = np.asarray([1.0, 0.0, 0.0], dtype=np.float32)
+    reranker = LateInteractionReranker()
+    assert vstore.load_sentence_vectors(1, [(1, 0)]) == {}
+
+    vstore.add_sentence_vectors(1, [{"file_id": 1, "chunk_index": 0, "vectors": [[1.0, 0.0, 0.0]]}])
+    # 索引指向 sentences.npy 之外的行：模拟两者不同步
+    np.save(vstore._sent_index_path(1), np.asarray([[1, 0, 0, 1], [1, 1, 1, 3]], dtype=np.int64))
+    vec_map = vstore.load_sentence_vectors(1, [(1, 0), (1, 1)])
+    assert set(vec_map) == {(1, 0)}
+
+    with open(vstore._sent_path(1), "wb") as f:
+        f.write(b"not an npy file")
+    assert vstore.load_sentence_vectors(1, [(1, 0)]) == {}
+
+    wrong_dim = {(1, 0): np.ones((2, 5), dtype=np.float32)}
+    for loader in (lambda f, i: None, lambda f, i: wrong_dim.get((f, i))):
+        out = reranker.rerank("q", _late_candidates(), lambda f, i: "", top_k=3, query_vec=q, load_vectors=loader)
+        assert [r["chunk_index"] for r in out] == [0, 1, 2]
+        assert [r["rerank_score"] for r in out] == [0.9, 0.5, -1.0]
+    assert reranker.rerank("q", _late_candidates(), lambda f, i: "", top_k=2) == _late_candidates()[:2]
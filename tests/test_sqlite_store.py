@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.chunk_store import JsonChunkStore
+from backend.kb.embeddings import HashingEmbeddingProvider
+from backend.kb.knowledge_base import PersistentKnowledgeBaseController
+from backend.kb.sqlite_store import SqliteChunkStore, migrate_json_to_sqlite
+
+
+def _has_fts5() -> bool:
+    try:
+        sqlite3.connect(":memory:").execute("CREATE VIRTUAL TABLE t USING fts5(c, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+pytestmark = pytest.mark.skipif(not _has_fts5(), reason="SQLite 未编译 FTS5 trigram 分词")
+
+
+_CONTENTS = {
+    1: ["报销流程：提交发票后由财务审核", "Invoice approval requires a manager", "差旅报销标准按城市分级", "无关内容"],
+    2: ["报销流程：提交发票后由财务审核", "manager approval for INVOICE over limit", "年假规定与报销无关"],
+    3: ["Invoice approval requires a manager", "报销", "财务审核周期为五个工作日"],
+}
+
+
+def _fill(kb):
+    for fid, texts in _CONTENTS.items():
+        assert kb.add_file(1, f"{fid}.txt", len(texts)).id == fid
+        kb._store.write_chunks(1, fid, [
+            {"file_id": fid, "chunk_index": i, "content": t, "metadata": {"page": i + 1}} for i, t in enumerate(texts)
+        ])
+
+
+def test_sqlite_keyword_search_matches_json_store(tmp_path):
+    """同样的数据下 SQLite（FTS5 预筛）与 JSON（全量扫描）的关键词检索结果与同分排序一致"""
+    kbs = []
+    for name, store_cls in (("json", JsonChunkStore), ("sqlite", SqliteChunkStore)):
+        base = str(tmp_path / name)
+        kb = PersistentKnowledgeBaseController(base_dir=base, embedder=HashingEmbeddingProvider(), store=store_cls(base))
+        _fill(kb)
+        kbs.append(kb)
+
+    json_kb, sqlite_kb = kbs
+    # 含长 token（走 FTS5 预筛）、两字中文词（退回全量扫描）与大小写不同的英文词
+    assert sqlite_kb._store.keyword_candidates(1, ["报销流程"]) is not None
+    assert sqlite_kb._store.keyword_candidates(1, ["报销"]) is None
+    for query in ("报销流程", "报销", "invoice approval", "manager", "财务审核 INVOICE", "不存在的词语"):
+        for top_k in (1, 2, 10):
+            assert sqlite_kb._keyword_search(1, query, top_k=top_k) == json_kb._keyword_search(1, query, top_k=top_k), query
+    ties = json_kb._keyword_search(1, "报销流程", top_k=2)
+    assert [(h["file_id"], h["chunk_index"]) for h in ties] == [(1, 0), (2, 0)]
+
+
+def test_migrate_json_to_sqlite_copies_files_and_chunks(tmp_path):
+    """迁移后文件元信息（含扩展字段）与片段（含 embedding）一致，重复执行不产生重复记录"""
+    base = str(tmp_path)
+    src = JsonChunkStore(base)
+    src.ensure_kb(1)
+    src.save_files(1, {
+        "files": [
+            {"id": 2, "filename": "b.pdf", "chunk_count": 2, "status": "done", "sheets": [{"name": "S1"}]},
+            {"id": 5, "filename": "a.txt", "chunk_count": 1, "status": "uploaded"},
+        ],
+        "next_id": 6,
+    })
+    src.write_chunks(1, 2, [
+        {"file_id": 2, "chunk_index": 0, "content": "第一段", "metadata": {"page": 1}, "embedding": [0.5, -1.0]},
+        {"file_id": 2, "chunk_index": 1, "content": "second part", "metadata": None},
+    ])
+    src.write_chunks(1, 5, [{"file_id": 5, "chunk_index": 0, "content": "only"}])
+
+    assert migrate_json_to_sqlite(base, 1) == {"files": 2, "chunks": 3}
+    assert migrate_json_to_sqlite(base, 1) == {"files": 2, "chunks": 3}
+
+    dst = SqliteChunkStore(base)
+    assert dst.load_files(1) == src.load_files(1)
+    for fid in (2, 5):
+        assert dst.read_chunks(1, fid) == [
+            {k: v for k, v in r.items() if v is not None} for r in src.read_chunks(1, fid)
+        ]
+    assert dst.read_chunks(1, 2, [1]) == [{"file_id": 2, "chunk_index": 1, "content": "second part"}]
+    assert sum(1 for _ in dst.iter_chunks(1)) == 3
+    assert os.path.exists(src._files_path(1))
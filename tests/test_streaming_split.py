@@ -0,0 +1,147 @@
+import os
+import sys
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.kb.ingestion import _table_to_markdown, iter_text_lines
+from backend.kb.splitters import AdaptiveSplitter, HeadingsSplitter, NormalSplitter
+from backend.kb.splitters.splitter_table import TableSplitter
+
+
+TEXT = """
+
+前言内容，不属于任何章节
+
+1 Introduction
+正文第一段
+1.1 Scope
+范围说明
+  跨页的半行
+2 Requirements
+要求说明
+
+"""
+
+
+def test_text_lines_match_whole_text_across_windows():
+    """按任意位置切开的文本窗口，逐行结果与整体 strip().splitlines() 一致"""
+    for step in (1, 3, 7, 50):
+        pieces = [TEXT[i:i + step] for i in range(0, len(TEXT), step)]
+        assert list(iter_text_lines(pieces)) == TEXT.strip().splitlines()
+
+
+def test_streaming_split_matches_split():
+    """流式拆分与整段拆分的片段内容、标题一致；无标题时交给 fallback"""
+    lines = TEXT.strip().splitlines()
+    whole = HeadingsSplitter().split(TEXT.strip())
+    streamed = list(HeadingsSplitter().iter_split(iter(lines)))
+    assert [c["content"] for c in streamed] == [c["content"] for c in whole]
+    assert [c["metadata"]["path"] for c in streamed] == [c["metadata"]["path"] for c in whole]
+
+    plain = "没有任何编号标题的正文。" * 40
+    normal = NormalSplitter(chunk_size=50, overlap=10)
+    streamed = list(AdaptiveSplitter().iter_split(iter(plain.splitlines()), fallback=normal))
+    assert streamed == normal.split(plain)
+
+
+def test_table_rows_split_matches_markdown_split():
+    """由单元格行直接切分的表格片段与渲染为 Markdown 后再解析切分的结果一致"""
+    rows = [["编号", "名称", ""]] + [[str(i), f"名称|{i}" * (i % 7), ""] for i in range(300)]
+    text = f"[Sheet] S1\n{_table_to_markdown(rows)}"
+    splitter = TableSplitter(table_name="T", use_llm_summary=False, max_rows_per_chunk=40, max_chars_per_chunk=900)
+    streamed = list(splitter.iter_split_sheets([("S1", rows)]))
+    assert len(streamed) > 300 // 40
+    assert streamed == splitter.split(text)
+    assert list(splitter.iter_split(iter(text.splitlines()))) == streamed
+
+    # 给出列数时逐行流式切分；片段数超过缓冲上限后 part_count 未知
+    splitter.max_buffered_parts = 3
+    rows_iter = iter([r[:2] for r in rows])
+    lazy = list(splitter.iter_split_sheets([("S1", rows_iter, 2)]))
+    assert [c["content"] for c in lazy] == [c["content"] for c in streamed]
+    assert {c["metadata"]["part_count"] for c in lazy} == {None}
+
+
+def test_allowed_headings_match_number_then_title():
+    """允许的标题先按编号整词、再按归一化标题匹配，取允许列表中靠前的一项"""
+    from backend.kb.splitters.splitter_headings import HeadingItem
+
+    text = "\n".join([
+        "前言",
+        "## **1 Introduction**",
+        "正文",
+        "see 1.1 scope: details",
+        "APPENDIX a Forms",
+        "11 Introduction",
+    ])
+    allowed = [
+        HeadingItem(number="1.1", title="Scope"),
+        HeadingItem(number="1", title="Introduction"),
+        HeadingItem(number="Appendix A", title="Forms"),
+        HeadingItem(number="1", title="Scope"),
+    ]
+    chunks = HeadingsSplitter(allowed_headings=allowed).split(text)
+    assert [(c["metadata"]["number"], c["metadata"]["title"]) for c in chunks] == [
+        ("1", "Introduction"), ("1.1", "Scope"), ("Appendix A", "Forms"),
+    ]
+    assert chunks[2]["content"] == "APPENDIX a Forms\n11 Introduction"
+
+
+def test_oversized_sections_split_on_paragraphs_and_sentences():
+    """超长章节按段落、句子边界切成不超过上限的片段，各段保留标题路径并记录序号"""
+    body = "\n\n".join(["短段落。"] + ["这是一个很长的句子，" * 8 + "结束。"] * 3)
+    text = f"1 Introduction\n{body}\n1.1 Scope\n范围说明"
+    splitter = HeadingsSplitter(max_section_chars=120)
+    chunks = splitter.split(text)
+    assert [len(c["content"]) <= 120 for c in chunks] == [True] * len(chunks)
+    parts = [c for c in chunks if c["metadata"]["number"] == "1"]
+    assert len(parts) > 1
+    assert [c["metadata"]["part_index"] for c in parts] == list(range(1, len(parts) + 1))
+    assert {c["metadata"]["part_count"] for c in parts} == {len(parts)}
+    assert all(c["metadata"]["path"] == [{"number": "1", "title": "Introduction"}] for c in parts)
+    assert all(c["content"].endswith("。") for c in parts)
+    assert "part_index" not in chunks[-1]["metadata"]
+    assert list(splitter.iter_split(iter(text.splitlines()))) == chunks
+
+
+def test_iter_split_lines_matches_split_for_all_splitters():
+    """各拆分器的逐行 `iter_split` 与 `split` 结果一致；基类默认实现退化为整段拆分"""
+    from backend.kb.splitters.splitter_base import Splitter
+
+    sheets = "\n".join([
+        "表前说明",
+        "[Sheet] 空表",
+        "没有表格行",
+        "[Sheet] 仅表头",
+        "| 编号 | 名称 |",
+        "[Sheet] 数据",
+        "| 编号 | 名称 |",
+        "| --- | --- |",
+    ] + [f"| {i} | 名称{i} |" for i in range(25)])
+    table = TableSplitter(table_name="T", use_llm_summary=False, max_rows_per_chunk=10)
+    assert list(table.iter_split(iter(sheets.splitlines()))) == table.split(sheets)
+    assert [c["metadata"]["sheet_name"] for c in table.split(sheets)] == ["仅表头"] + ["数据"] * 3
+
+    for splitter in (NormalSplitter(chunk_size=40, overlap=5), HeadingsSplitter(), AdaptiveSplitter()):
+        lines = TEXT.strip().splitlines()
+        assert [c["content"] for c in splitter.iter_split(iter(lines))] == [c["content"] for c in splitter.split(TEXT.strip())]
+
+    class Upper(Splitter):
+        def split(self, text):
+            return [{"content": text.upper(), "metadata": {"number": "", "title": "", "path": []}}]
+
+    assert [c["content"] for c in Upper().iter_split(iter(["a", "b"]))] == ["A\nB"]
+
+
+def test_streaming_path_uses_headings_seen_so_far():
+    """流式拆分的 path 只取已扫描到的上级标题；整段拆分取全文中同编号的最后一次出现"""
+    text = "1.1 Scope\n范围\n1 Intro\n引言\n1.2 Next\n下一节"
+    whole = HeadingsSplitter().split(text)
+    streamed = list(HeadingsSplitter().iter_split(iter(text.splitlines())))
+    assert [c["content"] for c in streamed] == [c["content"] for c in whole]
+    assert whole[0]["metadata"]["path"] == [{"number": "1", "title": "Intro"}, {"number": "1.1", "title": "Scope"}]
+    assert streamed[0]["metadata"]["path"] == [{"number": "1.1", "title": "Scope"}]
+    assert streamed[2]["metadata"]["path"] == whole[2]["metadata"]["path"]
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import sys
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+# 确保可导入顶层包
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from backend.api.routers import kb as kb_router
+from backend.kb.embeddings import HashingEmbeddingProvider
+from backend.kb.knowledge_base import PersistentKnowledgeBaseController
+from backend.services import kb_service
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    ctrl = PersistentKnowledgeBaseController(base_dir=str(tmp_path / "kb"), embedder=HashingEmbeddingProvider())
+    monkeypatch.setattr(kb_service, "KB_CTRL", ctrl)
+    app = FastAPI()
+    app.include_router(kb_router.router)
+    return TestClient(app)
+
+
+def _uploads(name=None):
+    d = os.path.join(kb_service.KB_CTRL._kb_dir(1), "uploads")
+    if name is None:
+        return sorted(os.listdir(d)) if os.path.exists(d) else []
+    with open(os.path.join(d, name), "rb") as f:
+        return f.read()
+
+
+def test_multipart_upload_saves_file_and_sha256(client):
+    """单文件 multipart 上传：内容按原样保存，返回 sha256 与大小并登记为未向量化"""
+    data = os.urandom(3 * kb_service.UPLOAD_CHUNK_BYTES + 123)
+    resp = client.post("/api/kb/kb-1/files/upload", files={"file": ("a.pdf", data, "application/pdf")})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == "uploaded" and body["size"] == len(data)
+    assert body["sha256"] == hashlib.sha256(data).hexdigest()
+    assert _uploads("a.pdf") == data
+    assert kb_service.KB_CTRL._file_by_name(1, "a.pdf")["sha256"] == body["sha256"]
+
+
+def test_batch_upload_checks_names_first(client):
+    """批量上传先校验全部文件名：任一不支持时返回 400 且不保存任何文件；全部合法时逐个保存"""
+    resp = client.post(
+        "/api/kb/kb-1/files/upload/batch",
+        files=[("files", ("a.pdf", b"%PDF-a", "application/pdf")), ("files", ("b.txt", b"x", "text/plain"))],
+    )
+    assert resp.status_code == 400
+    assert _uploads() == []
+
+    resp = client.post(
+        "/api/kb/kb-1/files/upload/batch",
+        files=[("files", ("a.pdf", b"%PDF-a", "application/pdf")), ("files", ("b.xlsx", b"PK-b", "application/octet-stream"))],
+    )
+    assert resp.status_code == 200
+    assert [f["name"] for f in resp.json()] == ["a.pdf", "b.xlsx"]
+    assert (_uploads("a.pdf"), _uploads("b.xlsx")) == (b"%PDF-a", b"PK-b")
+
+
+def test_raw_put_upload_streams_and_enforces_limit(client, monkeypatch):
+    """原始请求体上传按原样保存；超过大小上限返回 413，既有同名文件不变且不留临时文件"""
+    data = os.urandom(2 * kb_service.UPLOAD_CHUNK_BYTES + 7)
+    resp = client.put("/api/kb/kb-1/files/c.pdf/content", content=data)
+    assert resp.status_code == 200
+    assert resp.json()["sha256"] == hashlib.sha256(data).hexdigest()
+    assert _uploads("c.pdf") == data
+
+    monkeypatch.setenv("KB_UPLOAD_MAX_MB", "1")
+    chunks = (os.urandom(256 * 1024) for _ in range(6))
+    resp = client.put("/api/kb/kb-1/files/c.pdf/content", content=chunks)
+    assert resp.status_code == 413
+    assert _uploads("c.pdf") == data
+    assert _uploads() == ["c.pdf"]
+
+
+def test_raw_put_upload_discards_temp_file_when_commit_fails(client, monkeypatch):
+    """提交（收入 blob 存储）失败时丢弃临时文件"""
+    def broken_put_file(tmp_path, sha256):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(kb_service.KB_CTRL._blobs, "put_file", broken_put_file)
+    with pytest.raises(OSError):
+        client.put("/api/kb/kb-1/files/d.pdf/content", content=b"%PDF-d")
+    assert _uploads() == []
+
+
+def test_base64_upload_decodes_in_windows(client):
+    """带换行的 Base64 内容分窗口解码后与原始字节一致，窗口边界落在 4 字符组中间时同样正确"""
+    import base64
+
+    data = os.urandom(2 * kb_service.UPLOAD_CHUNK_BYTES + 5)
+    encoded = base64.encodebytes(data).decode("ascii")
+    assert b"".join(kb_service._iter_base64_chunks(encoded)) == data
+    assert b"".join(kb_service._iter_base64_chunks(" " + encoded.replace("\n", "\r\n"))) == data
+
+    resp = client.post("/api/kb/kb-1/files", json={"name": "e.pdf", "contentBase64": encoded})
+    assert resp.status_code == 200
+    assert _uploads("e.pdf") == data